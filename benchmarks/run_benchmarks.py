@@ -0,0 +1,214 @@
+"""Benchmarks of the solver, the lock-in amplifier, the filters and the measurement sweeps.
+
+Every benchmark records its best wall time over a few repeats, its peak traced memory (tracemalloc, in a separate
+run so the timing is not affected) and its throughput in steps (or samples) per second, as JSON.
+
+    python benchmarks/run_benchmarks.py run --output results.json
+    python benchmarks/run_benchmarks.py run --quick --baseline baseline.json
+    python benchmarks/run_benchmarks.py compare baseline.json results.json --threshold 1.25
+
+compare (and run with --baseline) flags every benchmark whose time or peak memory grew by more than the threshold
+ratio, and exits with status 1 if there is any regression.
+"""
+# PYTHON PACKAGES
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import scipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# MY PACKAGES
+import physical_constant_units as phy
+import environment as env
+import xenon as xe
+import comagnetometer as comag
+import lab_instruments as li
+import measurements
+import utils
+
+
+T1, T2 = 30., 8.
+
+
+def _single_species(gamma, steps, dt=0.1, wr_amp=0.01, Bnoise_amp=5e-7, seed=0):
+    """An Environment with world rotation and magnetic noise, and a Xenon in its steady state, for a run of steps"""
+    t_final = steps * dt
+    ts = np.arange(steps) * dt
+    rng = np.random.default_rng(seed)
+    my_env = env.Environment()
+    my_env.set_state(wr=wr_amp * utils.sigmoid(ts, 1, 50), B0=1e-6 * phy.G2T * np.ones(steps),
+                     Bnoise=utils.butter_low_pass_filter(utils.get_white_noise(Bnoise_amp * phy.G2T, 1 / dt, ts, rng=rng), 2, 1, 1 / dt),
+                     Ad_y=2 * np.sqrt(1 / T1 / T2) * np.ones(steps), wd_y=gamma * 1e-6 * phy.G2T * np.ones(steps),
+                     Ad_x=np.zeros(steps), wd_x=np.zeros(steps))
+    my_Xe = xe.Xenon(gamma=gamma, t1=T1, t2=T2, K0=np.array([0.0259, 0.02, 0.3]), ts=t_final + dt / 2, dt=dt)
+    my_Xe.set_spin_exchange_amp(np.array([0, 0, 0.1]) * T1)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+    return my_Xe, my_env
+
+
+def bench_solve_dynamics(steps, solver):
+    my_Xe, my_env = _single_species(phy.G129, steps)
+    return lambda: my_Xe.solve_dynamics(my_env, solver=solver), steps
+
+
+def bench_dual_species(steps):
+    xenon_a, environment_a = _single_species(phy.G129, steps)
+    xenon_b, environment_b = _single_species(phy.G131, steps)
+    environment_b.Bnoise = environment_a.Bnoise
+    my_comag = comag.Comagnetometer(xenon_a, xenon_b)
+    return lambda: my_comag.solve_dynamics(environment_a, environment_b), steps
+
+
+def bench_bandwidth_sweep(points, points_in_period):
+    """A bandwidth sweep over the default range of four decades around 1 / (pi T2)
+
+    The production default of points_in_period=1000 is not benchmarked: at the top of this range it asks for more than
+    the 1e5 steps per frequency that single_species_Open_Loop_bandwidth_simualtion allows, so the benchmark runs
+    a reduced points_in_period, which its name records.
+    """
+    freq_list = np.logspace(np.log10(1 / T2 / np.pi) - 2, np.log10(1 / T2 / np.pi) + 2, points)
+    periods = 1 / freq_list
+    steps = int(np.sum(np.maximum(2 * periods, 10 * T2) // (periods / points_in_period)))
+
+    def run():
+        measurements.single_species_Open_Loop_bandwidth_simualtion(phy.G129, T1, T2, freq_list=freq_list,
+                                                                   points_in_period=points_in_period, plot_results=False)
+    return run, steps
+
+
+def bench_dynamic_range_sweep(points):
+    wr_amp = np.logspace(-4, -1, points)
+
+    def run():
+        measurements.single_species_Open_Loop_dynamic_range_simulation(phy.G129, T1, T2, wr_amp, Bnoise_amp=1e-8, t_final=1000,
+                                                                       plot_results=False, seed=0)
+    return run, points * 1000
+
+
+def bench_lia(samples):
+    fs = 1000.
+    t = np.arange(samples) / fs
+    x = 4 * np.cos(2 * np.pi * 2 * t + np.pi / 5) * (1 + 0.1 * np.random.default_rng(0).normal(size=samples))
+    lia = li.LIA({'order': 3, 'cutoff_hz': 0.2, 'sampling_frequency_hz': fs, 'plot_filter': False})
+    return lambda: lia.use(x, t, 2), samples
+
+
+def bench_low_pass_filter(samples):
+    x = np.random.default_rng(0).normal(size=samples)
+    return lambda: utils.butter_low_pass_filter(x, 4, 1., 1000.), samples
+
+
+# name: (benchmark, arguments, included in --quick)
+BENCHMARKS = {
+    'solve_dynamics_expm_1e3': (bench_solve_dynamics, (10 ** 3, 'expm'), True),
+    'solve_dynamics_expm_1e4': (bench_solve_dynamics, (10 ** 4, 'expm'), True),
+    'solve_dynamics_expm_1e5': (bench_solve_dynamics, (10 ** 5, 'expm'), False),
+    'solve_dynamics_odeint_1e3': (bench_solve_dynamics, (10 ** 3, 'odeint'), True),
+    'solve_dynamics_odeint_1e4': (bench_solve_dynamics, (10 ** 4, 'odeint'), False),
+    'solve_dynamics_odeint_1e5': (bench_solve_dynamics, (10 ** 5, 'odeint'), False),
+    'dual_species_1e4': (bench_dual_species, (10 ** 4,), True),
+    'bandwidth_sweep_30_ppp100': (bench_bandwidth_sweep, (30, 100), False),  # reduced points_in_period, see above
+    'dynamic_range_sweep_10': (bench_dynamic_range_sweep, (10,), True),
+    'lia_use_1e7': (bench_lia, (10 ** 7,), False),
+    'lia_use_1e6': (bench_lia, (10 ** 6,), True),
+    'butter_low_pass_filter_1e7': (bench_low_pass_filter, (10 ** 7,), False),
+}
+
+
+def run_benchmark(name, repeat=3):
+    """Time (best of repeat) and peak memory of a single benchmark"""
+    benchmark, args, _ = BENCHMARKS[name]
+    function, steps = benchmark(*args)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(times)
+    return {'time_s': best, 'times_s': times, 'peak_memory_bytes': peak, 'steps': steps, 'steps_per_s': steps / best}
+
+
+def machine_info():
+    return {'platform': platform.platform(), 'processor': platform.processor(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__}
+
+
+def compare(baseline, results, threshold=1.25):
+    """Compare two benchmark result dicts. Returns the names of the benchmarks whose time or peak memory grew by
+    more than the threshold ratio, and prints a table of the ratios"""
+    regressions = []
+    print(f'{"benchmark":32s} {"time ratio":>12s} {"memory ratio":>14s}')
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            print(f'{name:32s} {"new":>12s}')
+            continue
+        base = baseline['benchmarks'][name]
+        time_ratio = result['time_s'] / base['time_s']
+        memory_ratio = result['peak_memory_bytes'] / max(base['peak_memory_bytes'], 1)
+        flag = time_ratio > threshold or memory_ratio > threshold
+        if flag:
+            regressions.append(name)
+        print(f'{name:32s} {time_ratio:12.3f} {memory_ratio:14.3f}{"   REGRESSION" if flag else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--output', default=None, help='JSON results file (printed if not given)')
+    run_parser.add_argument('--quick', action='store_true', help='run only the fast benchmarks')
+    run_parser.add_argument('--only', nargs='+', default=None, help='names of the benchmarks to run')
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--baseline', default=None, help='JSON results file to compare against')
+    run_parser.add_argument('--threshold', type=float, default=1.25)
+    compare_parser = commands.add_parser('compare', help='compare two JSON results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.results) as f:
+            results = json.load(f)
+        return 1 if compare(baseline, results, args.threshold) else 0
+
+    names = args.only if args.only is not None else [name for name, (_, _, quick) in BENCHMARKS.items() if quick or not args.quick]
+    results = {'machine': machine_info(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'benchmarks': {}}
+    for name in names:
+        results['benchmarks'][name] = run_benchmark(name, repeat=args.repeat)
+        result = results['benchmarks'][name]
+        print(f'{name:32s} {result["time_s"]:10.4f} s {result["peak_memory_bytes"] / 2 ** 20:10.1f} MiB '
+              f'{result["steps_per_s"]:14.0f} steps/s', file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return 1 if compare(baseline, results, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
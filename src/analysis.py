@@ -0,0 +1,153 @@
+# PYTHON PACKAGES
+import numpy as np
+import scipy.signal as signal
+
+
+def octave_taus(n_samples, sampling_frequency):
+    """Octave spaced averaging times tau = m / fs, m = 1, 2, 4, ... up to half the record"""
+    m = 2 ** np.arange(int(np.floor(np.log2(max((n_samples - 1) // 2, 1)))) + 1)
+    return m / sampling_frequency
+
+
+def _cumulative_sum_chunks(x, offset, terms, chunk_size, boundaries):
+    """The cumulative sum theta[k] = sum(x[:k]) at k = offset, ..., offset + terms - 1, yielded chunk_size values at a
+    time, so only a chunk of theta is ever in memory (x may be a memory mapped array). boundaries holds theta at the
+    multiples of chunk_size"""
+    first = offset // chunk_size * chunk_size
+    total = boundaries[offset // chunk_size] + np.sum(x[first:offset], dtype=float)
+    for start in range(offset, offset + terms, chunk_size):
+        stop = min(start + chunk_size, offset + terms)
+        theta = np.empty(stop - start)
+        theta[0] = 0.
+        np.cumsum(x[start:stop - 1], dtype=float, out=theta[1:])
+        theta += total
+        if stop < offset + terms:
+            total = theta[-1] + x[stop - 1]
+        yield theta
+
+
+def allan_deviation(x, sampling_frequency, taus=None, chunk_size=2 ** 22):
+    """Overlapping Allan deviation of a rate signal x (e.g. the world rotation estimate [rad / s]).
+
+    Computed from the cumulative sum theta of x, sigma^2(tau = m / fs) is the mean of
+    (theta[k + 2m] - 2 theta[k + m] + theta[k])^2 / (2 m^2) over all the k, so each tau costs O(N). The three
+    windows of theta are accumulated chunk_size samples at a time and theta is never stored whole, so x may be a
+    memory mapped array and the memory stays O(chunk_size).
+
+    :param x: 1D rate signal
+    :param sampling_frequency: [Hz]
+    :param taus: averaging times [s], rounded to whole samples. Octave spaced if None
+    :return: taus [s], Allan deviation [units of x]
+    """
+    n = len(x)
+    if taus is None:
+        taus = octave_taus(n, sampling_frequency)
+    m = np.unique(np.round(np.asarray(taus) * sampling_frequency).astype(int))
+    m = m[(m >= 1) & (2 * m < n)]
+    if len(m) == 0:
+        raise ValueError(f'a record of {n} samples is too short for the requested taus')
+
+    # theta at the chunk boundaries, so no window sums its prefix again
+    boundaries = np.concatenate(([0.], np.cumsum([np.sum(x[start:start + chunk_size], dtype=float)
+                                                  for start in range(0, n, chunk_size)])))
+    adev = np.zeros(len(m))
+    for j, mj in enumerate(m):
+        terms = n + 1 - 2 * mj
+        total = 0.
+        for theta_0, theta_m, theta_2m in zip(*[_cumulative_sum_chunks(x, offset, terms, chunk_size, boundaries)
+                                                for offset in (0, mj, 2 * mj)]):
+            d = np.subtract(theta_2m, theta_m, out=theta_2m)
+            d -= theta_m
+            d += theta_0
+            total += np.dot(d, d)
+        adev[j] = np.sqrt(total / terms / (2. * mj ** 2))
+    return m / sampling_frequency, adev
+
+
+def angle_random_walk(taus, adev, slope_tolerance=0.25):
+    """Angle random walk coefficient [units of x * sqrt(s)] (rad / sqrt(s) for a rotation rate), the value at
+    tau = 1 s of the -1/2 slope line fitted to the Allan deviation where its log-log slope is close to -1/2"""
+    log_tau, log_adev = np.log(taus), np.log(adev)
+    slopes = np.gradient(log_adev, log_tau) if len(taus) > 1 else np.array([-0.5])
+    white = np.abs(slopes + 0.5) <= slope_tolerance
+    if not np.any(white):
+        white = np.arange(len(taus)) == np.argmin(np.abs(slopes + 0.5))
+    return np.exp(np.mean(log_adev[white] + 0.5 * log_tau[white]))
+
+
+def bias_instability(taus, adev):
+    """Bias instability [units of x] and the tau [s] at which it is read, from the flat bottom of the Allan
+    deviation: B = min(sigma) / sqrt(2 ln(2) / pi)"""
+    k = np.argmin(adev)
+    return adev[k] / np.sqrt(2 * np.log(2) / np.pi), taus[k]
+
+
+def noise_coefficients(taus, adev):
+    """The gyro noise coefficients fitted to an Allan deviation curve"""
+    bias, bias_tau = bias_instability(taus, adev)
+    return {'angle_random_walk': angle_random_walk(taus, adev), 'bias_instability': bias, 'bias_instability_tau': bias_tau}
+
+
+class WelchAccumulator:
+    """Streaming Welch power spectral density, for records that do not fit in memory.
+
+    Blocks of samples (of any length) are added with update(), and the periodograms of all the complete segments
+    are averaged. For a whole record the result equals scipy.signal.welch(x, fs, window, nperseg, noverlap) with
+    detrend='constant' and scaling='density'. The leading axes of the blocks (e.g. channels) are kept.
+    """
+    def __init__(self, sampling_frequency, nperseg=4096, noverlap=None, window='hann'):
+        self.sampling_frequency = sampling_frequency
+        self.nperseg = nperseg
+        self.noverlap = nperseg // 2 if noverlap is None else noverlap
+        self.step = self.nperseg - self.noverlap
+        self.window = signal.get_window(window, nperseg)
+        self.scale = 1. / (sampling_frequency * np.sum(self.window ** 2))
+        self.frequencies = np.fft.rfftfreq(nperseg, d=1. / sampling_frequency)
+        self.buffer = None      # samples not yet in a complete segment
+        self.total = None       # sum of the periodograms
+        self.segments = 0
+
+    def update(self, x):
+        """Add the next block of samples, shape (..., n)"""
+        x = np.asarray(x, dtype=float)
+        x = x if self.buffer is None else np.concatenate([self.buffer, x], axis=-1)
+        n_segments = (x.shape[-1] - self.noverlap) // self.step if x.shape[-1] >= self.nperseg else 0
+        if n_segments > 0:
+            segments = np.lib.stride_tricks.sliding_window_view(x, self.nperseg, axis=-1)[..., ::self.step, :][..., :n_segments, :]
+            segments = segments - segments.mean(axis=-1, keepdims=True)
+            periodograms = np.abs(np.fft.rfft(segments * self.window, axis=-1)) ** 2
+            total = periodograms.sum(axis=-2)
+            self.total = total if self.total is None else self.total + total
+            self.segments += n_segments
+        self.buffer = x[..., n_segments * self.step:].copy()
+
+    def psd(self):
+        """The frequencies [Hz] and the one sided power spectral density [units^2 / Hz] of the samples so far"""
+        if self.segments == 0:
+            raise ValueError(f'less than nperseg = {self.nperseg} samples were added')
+        pxx = self.total * self.scale / self.segments
+        pxx[..., 1:] *= 2
+        if self.nperseg % 2 == 0:
+            pxx[..., -1] /= 2
+        return self.frequencies, pxx
+
+
+def welch(x, sampling_frequency, nperseg=4096, noverlap=None, window='hann', chunk_size=2 ** 22):
+    """Welch power spectral density of x (..., n), accumulated chunk_size samples at a time (x may be memory mapped)"""
+    accumulator = WelchAccumulator(sampling_frequency, nperseg=nperseg, noverlap=noverlap, window=window)
+    for start in range(0, x.shape[-1], chunk_size):
+        accumulator.update(x[..., start:start + chunk_size])
+    return accumulator.psd()
+
+
+def plot_allan_deviation(taus, adev, coefficients=None, ax=None, label=None):
+    """Log-log plot of an Allan deviation curve, with the fitted noise coefficients if given (see
+    visualization.plot_allan_deviation)"""
+    import visualization
+    return visualization.plot_allan_deviation(taus, adev, coefficients=coefficients, ax=ax, label=label)
+
+
+def plot_psd(frequencies, pxx, ax=None, label=None):
+    """Log-log plot of the amplitude spectral density sqrt(PSD) (see visualization.plot_psd)"""
+    import visualization
+    return visualization.plot_psd(frequencies, pxx, ax=ax, label=label)
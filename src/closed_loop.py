@@ -0,0 +1,90 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import xenon as xe
+
+
+class ClosedLoop:
+    """Closed loop single species NMR gyroscope: the y drive frequency wd_y is locked to the spin precession.
+
+    The Bloch equations are integrated at the system rate (1 / xenon.dt) with exact propagators. The transverse
+    polarization is read out in the lab frame, S = Kx cos(phi) - Ky sin(phi) with phi the drive phase, and
+    demodulated at the drive frequency by a streaming LIA. Every pid.period_steps system samples the PID reads the
+    LIA phase and sets the next wd_y, which is held until the following update. The world rotation estimate is
+        wr = wd_y - gamma * B0 - gamma2 * phase
+    All the results are written into buffers preallocated for the whole run.
+    """
+    def __init__(self, xenon, lia, pid, setpoint=0.):
+        """
+        :param xenon: Xenon, with its spin exchange pumping and initial state set
+        :param lia: lab_instruments.LIA sampled at the system rate
+        :param pid: lab_instruments.PIDController with fs_system the system rate, controlling wd_y [rad / s]
+        :param setpoint: the LIA phase [rad] the PID locks to
+        """
+        fs = 1. / xenon.dt
+        assert np.isclose(lia.lpf_params['sampling_frequency_hz'], fs) and np.isclose(pid.fs_system, fs)
+        self.xenon = xenon
+        self.lia = lia
+        self.pid = pid
+        self.setpoint = setpoint
+        self.t_steps = xenon.t_steps
+        self.time_vec = xenon.sample_times()
+
+        # result buffers
+        self.Kt = np.zeros((self.t_steps, 3))
+        self.wd_y = np.zeros(self.t_steps)          # drive frequency of every sample [rad / s]
+        self.signal = np.zeros(self.t_steps)        # lab frame transverse polarization
+        self.X = np.zeros(self.t_steps)             # LIA outputs
+        self.Y = np.zeros(self.t_steps)
+        self.Theta = np.zeros(self.t_steps)
+        self.world_rotation = None
+        self.solver_done = False
+
+    def run(self, environment):
+        """Run the closed loop over an Environment. Its wd_y channel gives only the initial drive frequency, the
+        other channels are used as they are"""
+        xenon, lia, pid = self.xenon, self.lia, self.pid
+        channels = {name: xenon.channel_samples(environment, name) for name in environment.channel_names}
+        wd_y = float(np.ravel(channels['wd_y'])[0])
+        pid.MV_bar = wd_y
+        lia.start_stream(wd_y / (2 * np.pi), input_amplitude=np.sqrt(xenon.K0[0] ** 2 + xenon.K0[1] ** 2))
+        Rse = np.asarray(xenon.Rse, dtype=float)
+
+        # Bloch matrices of all the steps without the y drive frequency, which is subtracted from M12 block by block
+        M0 = xe.bloch_matrices(xenon.gamma, xenon.gamma1, xenon.gamma2, *[channels[name] if name != 'wd_y' else 0.
+                               for name in environment.channel_names], drive=xenon.drive)
+        constant = M0.ndim == 2     # a single propagator per block
+
+        K = np.array(xenon.K0, dtype=float)
+        for start in range(0, self.t_steps, pid.period_steps):
+            stop = min(start + pid.period_steps, self.t_steps)
+            n = stop - start
+
+            # physics of the block with the drive frequency held at wd_y
+            M = np.array(M0 if constant else M0[start:stop])
+            if xenon.drive:
+                M[..., 0, 1] -= wd_y
+                M[..., 1, 0] += wd_y
+            P = xe.propagators(M, Rse, xenon.dt)
+            # the state at step i is propagated with the environment of step i - 1
+            self.Kt[start, :] = K
+            states = xe.propagate(np.broadcast_to(P, (n, 4, 4)), K)
+            self.Kt[start + 1:stop, :] = states[:-1]
+            K = states[-1]
+            self.wd_y[start:stop] = wd_y
+
+            # lab frame readout with the drive phase, demodulated by the LIA (which carries the same phase)
+            phase = lia.stream_phase + 2 * np.pi * lia.stream_ref_frequency / lia.lpf_params['sampling_frequency_hz'] * np.arange(n)
+            self.signal[start:stop] = self.Kt[start:stop, 0] * np.cos(phase) - self.Kt[start:stop, 1] * np.sin(phase)
+            self.X[start:stop], self.Y[start:stop], _, self.Theta[start:stop] = lia.use_stream(self.signal[start:stop])
+
+            # PID update at the next system sample
+            if pid.is_update_step(stop):
+                wd_y = pid.lock(self.Theta[stop - 1], self.setpoint)
+                lia.stream_ref_frequency = wd_y / (2 * np.pi)
+
+        xenon.M = M if constant else M[-1]
+        self.world_rotation = self.wd_y - xenon.gamma * channels['B0'] - xenon.gamma2 * self.Theta
+        self.solver_done = True
+        return self.world_rotation
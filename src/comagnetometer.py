@@ -0,0 +1,89 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import xenon as xe
+
+
+class Comagnetometer:
+    """Dual species (e.g. 129Xe / 131Xe) co-simulation.
+
+    Both species are solved together as a single 6 dimensional block diagonal linear system, and the magnetic noise
+    cancelling world rotation estimate
+        A1 * (A_a - A_b),   A1 = gamma_a * gamma_b / (gamma_a - gamma_b),   A = (phase_perp * gamma2 - wd_y) / gamma
+    is computed along with the dynamics. The Xenon objects keep their own results (Kt, Ks, phase_perp, ...).
+    """
+    def __init__(self, xenon_a, xenon_b):
+        assert xenon_a.dt == xenon_b.dt and xenon_a.t_steps == xenon_b.t_steps
+        if len(xenon_a.Kt) != xenon_a.t_steps or len(xenon_b.Kt) != xenon_b.t_steps:
+            raise ValueError('The Comagnetometer records every step, reset the Xenon recording policies (set_recording())')
+        self.xenon_a = xenon_a
+        self.xenon_b = xenon_b
+        self.dt = xenon_a.dt
+        self.t_steps = xenon_a.t_steps
+        self.time_vec = xenon_a.time_vec
+        self.world_rotation = None
+        self.solver_done = False
+
+    def bloch_matrices(self, environment_a, environment_b, start, stop):
+        """Constructing the 6x6 block diagonal Bloch matrices of both species at steps [start, stop)"""
+        M = np.zeros((stop - start, 6, 6))
+        for k, (xenon, environment) in enumerate([(self.xenon_a, environment_a), (self.xenon_b, environment_b)]):
+            channels = [xenon.channel_samples(environment, name, start, stop) for name in environment.channel_names]
+            M[:, 3 * k:3 * k + 3, 3 * k:3 * k + 3] = xe.bloch_matrices(xenon.gamma, xenon.gamma1, xenon.gamma2, *channels,
+                                                                       drive=xenon.drive)
+        return M
+
+    def compute_world_rotation(self, environment_a, environment_b, start=0, stop=None):
+        """The comagnetometer world rotation estimate at steps [start, stop) from the phases of both species"""
+        stop = self.t_steps if stop is None else stop
+        a, b = self.xenon_a, self.xenon_b
+        wd_y_a = a.channel_samples(environment_a, 'wd_y', start, stop)
+        wd_y_b = b.channel_samples(environment_b, 'wd_y', start, stop)
+        phase_a = np.arctan(a.Kt[start:stop, 1] / a.Kt[start:stop, 0])
+        phase_b = np.arctan(b.Kt[start:stop, 1] / b.Kt[start:stop, 0])
+        A1 = a.gamma * b.gamma / (a.gamma - b.gamma)
+        A_a = (phase_a * a.gamma2 - wd_y_a) / a.gamma
+        A_b = (phase_b * b.gamma2 - wd_y_b) / b.gamma
+        return A1 * (A_a - A_b)
+
+    def solve_dynamics(self, environment_a, environment_b, chunk_size=1024):
+        """Solving the Bloch equations of both species in a single loop over the (shared) time axis
+
+        :param environment_a, environment_b: the Environments of both species. They usually share the wr, B0 and
+                                             Bnoise arrays and differ in the drive
+        :param chunk_size: number of time steps whose Bloch matrices and propagators are computed at once
+        """
+        a, b = self.xenon_a, self.xenon_b
+        Rse = np.concatenate([np.asarray(a.Rse, dtype=float), np.asarray(b.Rse, dtype=float)])
+        K = np.concatenate([a.K0, b.K0])
+        self.world_rotation = np.zeros(self.t_steps)
+        for start in range(0, self.t_steps, chunk_size):
+            stop = min(start + chunk_size, self.t_steps)
+            M = self.bloch_matrices(environment_a, environment_b, start, stop)
+            a.Ks[start:stop, :] = xe.bloch_matrix_steady_states(M[:, :3, :3], a.Rse)
+            b.Ks[start:stop, :] = xe.bloch_matrix_steady_states(M[:, 3:, 3:], b.Rse)
+
+            # exact propagators of the augmented 7x7 system, a single one if the chunk is constant
+            constant = np.array_equal(M, np.broadcast_to(M[:1], M.shape))
+            P = xe.propagators(M[:1] if constant else M, Rse, self.dt)
+
+            # the state at step i is propagated with the environment of step i - 1
+            n = min(stop, self.t_steps - 1) - start
+            if n > 0:
+                states = xe.propagate(np.broadcast_to(P, (n, 7, 7)) if constant else P[:n], K)
+                a.Kt[start + 1:start + 1 + n, :] = states[:, :3]
+                b.Kt[start + 1:start + 1 + n, :] = states[:, 3:]
+                K = states[-1]
+            self.world_rotation[start:stop] = self.compute_world_rotation(environment_a, environment_b, start, stop)
+
+        for xenon, environment, block in [(a, environment_a, slice(0, 3)), (b, environment_b, slice(3, 6))]:
+            environment.set_step(self.t_steps - 1)
+            xenon.M = M[-1, block, block]
+            xenon.compute_perpendicular_values()
+            xenon.solver_done = True
+        self.solver_done = True
+
+    def display_params(self):
+        self.xenon_a.display_params()
+        self.xenon_b.display_params()
@@ -0,0 +1,165 @@
+# PYTHON PACKAGES
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# MY PACKAGES
+import physical_constant_units as phy
+import environment as env
+import xenon_batch as xe_batch
+import sweeps
+import noise
+import utils
+
+
+class RunningStats:
+    """Online (Welford / Chan et al.) mean and variance of a stream of samples, element wise over an array shape.
+
+    Samples are added one batch at a time with update(), and the statistics of independent streams (e.g. computed
+    by different worker processes) are combined with merge(). Memory is the size of a single sample.
+    """
+    def __init__(self, shape=()):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)   # sum of squared deviations from the mean
+
+    def update(self, x):
+        """Add a batch of samples x with shape (n,) + shape"""
+        x = np.asarray(x, dtype=float)
+        batch = RunningStats(x.shape[1:])
+        batch.count = x.shape[0]
+        batch.mean = x.mean(axis=0)
+        batch.m2 = ((x - batch.mean) ** 2).sum(axis=0)
+        self.merge(batch)
+
+    def merge(self, other):
+        """Combine the statistics of another (independent) RunningStats into this one"""
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def variance(self):
+        """Sample (unbiased) variance"""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.full_like(self.m2, np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class EnsembleResult:
+    """Statistics of the world rotation error (calculated - true world rotation) [rad / s] of an ensemble.
+
+    error is the RunningStats along the time axis (O(t_steps) memory). Only two numbers are kept for every member,
+    its final error and its RMS error after settle_time, to provide percentiles over the ensemble.
+    """
+    def __init__(self, ts, settle_time=0.):
+        self.ts = ts
+        self.settle_time = settle_time
+        self.error = RunningStats(ts.shape)
+        self.final_errors = np.zeros(0)
+        self.rms_errors = np.zeros(0)
+
+    @property
+    def n_members(self):
+        return self.error.count
+
+    def update(self, errors):
+        """Add the world rotation errors of a batch of members, shape (n_members, t_steps)"""
+        self.error.update(errors)
+        self.final_errors = np.concatenate([self.final_errors, errors[:, -1]])
+        self.rms_errors = np.concatenate([self.rms_errors, np.sqrt(np.mean(errors[:, self.ts >= self.settle_time] ** 2, axis=1))])
+
+    def merge(self, other):
+        self.error.merge(other.error)
+        self.final_errors = np.concatenate([self.final_errors, other.final_errors])
+        self.rms_errors = np.concatenate([self.rms_errors, other.rms_errors])
+
+    def percentiles(self, q=(5, 50, 95), final=True):
+        """Percentiles over the ensemble of the final (final=True) or RMS (final=False) world rotation errors"""
+        return np.percentile(self.final_errors if final else self.rms_errors, q)
+
+
+def member_seeds(seed, start, stop):
+    """Reproducible RNG seeds of ensemble members [start, stop), independent of the batching of the members"""
+    return [np.random.SeedSequence(seed, spawn_key=(member,)) for member in range(start, stop)]
+
+
+def _ensemble_batch(gyromagnetic, t1, t2, wr_amp, B0_amp, Bnoise_amp, noise_cutoff_hz, filter_order, dt, t_final,
+                    settle_time, seed, start, stop):
+    """Solves ensemble members [start, stop) in lockstep and returns their EnsembleResult"""
+    # solver parameters
+    steps = int(t_final // dt)
+    sampling_frequency = 1. / dt
+    ts = np.linspace(0, t_final, steps)
+    n_runs = stop - start
+
+    # Environment parameters, only the magnetic noise differs between the members
+    wr = wr_amp * utils.sigmoid(ts, 1, 100)  # rad / s
+    B0 = B0_amp * phy.G2T  # Tesla
+    Bnoise = 0.
+    if Bnoise_amp != 0:
+        Bnoise = noise.band_limited(Bnoise_amp * phy.G2T, sampling_frequency, steps, noise_cutoff_hz, order=filter_order,
+                                    n_realizations=n_runs, rng=member_seeds(seed, start, stop))  # Tesla
+    Ad_y = 2 * np.sqrt((1 / t1) * (1 / t2))  # rad / s
+    wd_y = gyromagnetic * B0_amp * phy.G2T  # rad / s
+    Ad_x = 0.  # rad / s
+    wd_x = 0.  # rad / s
+
+    my_env = env.Environment()
+    my_env.set_state(wr=wr, B0=B0, Bnoise=Bnoise, Ad_y=Ad_y, wd_y=wd_y, Ad_x=Ad_x, wd_x=wd_x)
+
+    my_Xe = xe_batch.XenonBatch(gamma=gyromagnetic, t1=t1, t2=t2, K0=np.array([0.0259, 0.02, 0.3]), ts=t_final, dt=dt, n_runs=n_runs)
+    my_Xe.set_spin_exchange_amp(np.array([0, 0, 0.1]) * t1)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+    my_Xe.solve_dynamics(my_env)
+
+    result = EnsembleResult(ts, settle_time=settle_time)
+    result.update(my_Xe.compute_world_rotation(my_env) - wr)
+    return result
+
+
+def run_ensemble(gyromagnetic, t1, t2, wr_amp, B0_amp=1e-6, Bnoise_amp=0, noise_cutoff_hz=0.1, filter_order=2, dt=1,
+                 t_final=1000, n_members=100, batch_size=100, workers=1, seed=None, settle_time=0., progress=True):
+    """Monte-Carlo ensemble of open loop single species runs (the dynamic range configuration) with independent
+    magnetic noise realizations, reduced online to the statistics of the world rotation error.
+
+    The members are solved batch_size at a time by a XenonBatch, and with workers > 1 the batches are distributed over
+    a pool of worker processes. The batches are merged in order, so a seeded ensemble gives the same result for any
+    number of workers. Without a seed the member seeds are spawned from fresh entropy drawn once here, in the parent
+    process, so that the batches of worker processes (forked with copies of the same global random state) still get
+    independent noise. Memory is O(batch_size * t_steps) per process, independent of n_members.
+
+    :return: EnsembleResult
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    batches = [(start, min(start + batch_size, n_members)) for start in range(0, n_members, batch_size)]
+    params = dict(gyromagnetic=gyromagnetic, t1=t1, t2=t2, wr_amp=wr_amp, B0_amp=B0_amp, Bnoise_amp=Bnoise_amp,
+                  noise_cutoff_hz=noise_cutoff_hz, filter_order=filter_order, dt=dt, t_final=t_final,
+                  settle_time=settle_time, seed=seed)
+    steps = int(t_final // dt)
+    result = EnsembleResult(np.linspace(0, t_final, steps), settle_time=settle_time)
+
+    if workers == 1:
+        for start, stop in sweeps.progress_bar(batches, disable=not progress):
+            result.merge(_ensemble_batch(start=start, stop=stop, **params))
+        return result
+
+    # merge the batches in order as they complete, holding only the out of order ones
+    done = {}
+    merged = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_ensemble_batch, start=start, stop=stop, **params): k
+                   for k, (start, stop) in enumerate(batches)}
+        for future in sweeps.progress_bar(as_completed(futures), total=len(futures), disable=not progress):
+            done[futures.pop(future)] = future.result()
+            while merged in done:
+                result.merge(done.pop(merged))
+                merged += 1
+    return result
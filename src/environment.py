@@ -1,5 +1,5 @@
 # PYTHON PACKAGES
-import matplotlib.pyplot as plt
+import hashlib
 import numpy as np
 
 # MY PACKAGES
@@ -7,7 +7,21 @@ import physical_constant_units as phy
 import utils
 
 
+def _all_equal(x):
+    """True if x is a non empty 1D array whose samples are all equal"""
+    return x.ndim == 1 and x.size > 0 and bool(np.all(x == x[0]))
+
+
 class Environment:
+    """The Environment channels a Xenon is solved in. Every channel is either
+        a scalar                    constant over the whole run (no per step samples are stored),
+        an array                    samples along its last axis,
+        a callable f(t)             evaluated on demand at the sample times t [s] (an array), e.g.
+                                    wr=lambda t: 0.01 * utils.sigmoid(t, 1, 100)
+    The solvers read the channels with channel(), and skip the per step rebuilds of the channels that are constant.
+    """
+    channel_names = ['wr', 'B0', 'Bnoise', 'wd_x', 'Ad_x', 'wd_y', 'Ad_y']
+
     def __init__(self, name='Xenon129 Environment'):
         self.name = name
         self.B0 = 0.  # DC z magnetic field             [Tesla]
@@ -38,15 +52,88 @@ class Environment:
         """Setting step for solver"""
         self.i = i
 
+    def is_lazy(self, name):
+        """True if the channel is a callable evaluated on demand"""
+        return callable(getattr(self, name))
+
+    def is_constant(self, name):
+        """True if the channel is a scalar, or a 1D array whose samples are all equal. Callable channels and stacked
+        (n_runs, t_steps) arrays are never treated as constant. Nothing is cached, so a channel changed in place is
+        seen by the next call"""
+        x = getattr(self, name)
+        if callable(x):
+            return False
+        x = np.asarray(x)
+        return x.ndim == 0 or _all_equal(x)
+
+    def constant_channels(self):
+        """The names of the constant channels"""
+        return [name for name in self.channel_names if self.is_constant(name)]
+
+    def channel(self, name, start=0, stop=None, times=None):
+        """The samples [start, stop) of a channel. A scalar channel, or a 1D array channel whose samples [start, stop)
+        are all equal, is returned as a scalar, another array channel as a slice (a view) along its last axis and
+        a callable channel is evaluated at times.
+
+        :param times: the times [s] of the samples [start, stop), needed only by callable channels
+        """
+        x = getattr(self, name)
+        if callable(x):
+            if times is None:
+                raise ValueError(f'The {name} channel is a callable, the sample times are needed to evaluate it')
+            return np.broadcast_to(np.asarray(x(times), dtype=float), np.shape(times))
+        x = np.asarray(x, dtype=float)
+        if x.ndim == 0:
+            return x[()]
+        x = x[..., start:stop]
+        return x[0] if _all_equal(x) else x
+
+    def steps(self):
+        """Number of samples along the time axis of the Environment arrays (None if all the channels are scalars or
+        callables)"""
+        lengths = [np.shape(getattr(self, name))[-1] for name in self.channel_names
+                   if not self.is_lazy(name) and np.ndim(getattr(self, name))]
+        return max(lengths) if lengths else None
+
+    def chunks(self, chunk_size, times=None):
+        """Iterate over the Environment in consecutive chunks of chunk_size samples, each one an Environment. Callable
+        channels are evaluated chunk by chunk at times (the times [s] of all the samples)"""
+        steps = self.steps() if times is None else len(times)
+        for start in range(0, steps, chunk_size):
+            stop = min(start + chunk_size, steps)
+            chunk = Environment(name=self.name)
+            chunk.set_state(**{name: self.channel(name, start, stop, None if times is None else times[start:stop]) if self.is_lazy(name)
+                               else getattr(self, name)[..., start:stop] if np.ndim(getattr(self, name))
+                               else getattr(self, name) for name in self.channel_names})
+            yield chunk
+
+    def hash(self, times=None):
+        """A content hash of all the Environment channels, identifying the Environment a simulation was solved in.
+        Callable channels are hashed by their samples at times"""
+        sha = hashlib.sha256()
+        for name in self.channel_names:
+            x = np.ascontiguousarray(self.channel(name, times=times) if self.is_lazy(name) else getattr(self, name), dtype=float)
+            sha.update(name.encode())
+            sha.update(str(x.shape).encode())
+            sha.update(x.tobytes())
+        return sha.hexdigest()
+
+    def _first_sample(self, name):
+        """The first sample of a channel, for display"""
+        if self.is_lazy(name):
+            return self.channel(name, 0, 1, np.zeros(1))[0]
+        x = np.asarray(getattr(self, name))
+        return x if x.ndim == 0 else x[..., 0]
+
     def display_params(self):
         print('===================================================================')
         print(f'| {self.name}:')
         print(f'| ----------')
-        print(f'| B0:                     {self.B0[0]}')
-        print(f'| B_noise:                {self.Bnoise[0]}')
-        print(f'| {phy.OMEGA}d_x:                   {self.wd_x[0]}')
-        print(f'| {phy.BIG_OMEGA}d_x:                   {self.Ad_x[0]}')
-        print(f'| {phy.OMEGA}d_y:                   {self.wd_y[0]}')
-        print(f'| {phy.BIG_OMEGA}d_y:                   {self.Ad_y[0]}')
-        print(f'| {phy.BIG_OMEGA}r:                     {self.wr[0]}')
+        print(f'| B0:                     {self._first_sample("B0")}')
+        print(f'| B_noise:                {self._first_sample("Bnoise")}')
+        print(f'| {phy.OMEGA}d_x:                   {self._first_sample("wd_x")}')
+        print(f'| {phy.BIG_OMEGA}d_x:                   {self._first_sample("Ad_x")}')
+        print(f'| {phy.OMEGA}d_y:                   {self._first_sample("wd_y")}')
+        print(f'| {phy.BIG_OMEGA}d_y:                   {self._first_sample("Ad_y")}')
+        print(f'| {phy.BIG_OMEGA}r:                     {self._first_sample("wr")}')
         print('===================================================================')
@@ -0,0 +1,133 @@
+# PYTHON PACKAGES
+from contextlib import contextmanager, nullcontext
+import json
+import time
+
+
+class _Phase:
+    """Times a single pass through a phase of the profiled code"""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        phase = self.profiler.phases.setdefault(self.name, {'time_s': 0., 'calls': 0})
+        phase['time_s'] += time.perf_counter() - self.start
+        phase['calls'] += 1
+        return False
+
+
+class Profiler:
+    """Collects the instrumentation of the solver and the measurement sweeps: the time spent in every phase (nested
+    phases are timed separately, so their times overlap), counters (e.g. the solver steps and the integrator
+    right hand side evaluations, nfev) and the wall time of every sweep point."""
+    enabled = True
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.points = []
+
+    def phase(self, name):
+        """Context manager timing a phase"""
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def record_point(self, sweep, index, wall_time):
+        """The wall time [s] of point index of a sweep"""
+        self.points.append({'sweep': sweep, 'index': index, 'time_s': wall_time})
+
+    def report(self):
+        return ProfileReport(self.phases, self.counters, self.points)
+
+
+class NullProfiler:
+    """The default profiler, which does nothing. Its phases are a shared null context, so the instrumented code
+    costs a function call per phase when profiling is disabled"""
+    enabled = False
+    _null_phase = nullcontext()
+
+    def phase(self, name):
+        return self._null_phase
+
+    def count(self, name, n=1):
+        pass
+
+    def record_point(self, sweep, index, wall_time):
+        pass
+
+
+class ProfileReport:
+    """A snapshot of the instrumentation collected by a Profiler"""
+    def __init__(self, phases, counters, points):
+        self.phases = {name: dict(phase) for name, phase in phases.items()}
+        self.counters = dict(counters)
+        self.points = list(points)
+
+    @property
+    def steps_per_second(self):
+        """Solver steps per second of integration"""
+        if 'steps' not in self.counters or 'integrate' not in self.phases or self.phases['integrate']['time_s'] == 0:
+            return None
+        return self.counters['steps'] / self.phases['integrate']['time_s']
+
+    def as_dict(self):
+        return {'phases': self.phases, 'counters': self.counters, 'points': self.points,
+                'steps_per_second': self.steps_per_second}
+
+    def write_json_lines(self, path):
+        """Append the report to a JSON lines file, one record per phase, counter and sweep point"""
+        with open(path, 'a') as f:
+            for name, phase in self.phases.items():
+                f.write(json.dumps({'type': 'phase', 'name': name, **phase}) + '\n')
+            for name, value in self.counters.items():
+                f.write(json.dumps({'type': 'counter', 'name': name, 'value': value}) + '\n')
+            for point in self.points:
+                f.write(json.dumps({'type': 'point', **point}) + '\n')
+            f.write(json.dumps({'type': 'summary', 'steps_per_second': self.steps_per_second}) + '\n')
+
+    def __str__(self):
+        lines = [f'{"phase":28s} {"time [s]":>12s} {"calls":>10s}']
+        for name, phase in sorted(self.phases.items(), key=lambda item: -item[1]['time_s']):
+            lines.append(f'{name:28s} {phase["time_s"]:12.4f} {phase["calls"]:10d}')
+        for name, value in self.counters.items():
+            lines.append(f'{name:28s} {value:12d}')
+        if self.steps_per_second is not None:
+            lines.append(f'{"steps / s":28s} {self.steps_per_second:12.0f}')
+        if self.points:
+            times = [point['time_s'] for point in self.points]
+            lines.append(f'{"sweep points":28s} {len(times):12d}   mean {sum(times) / len(times):.4f} s   max {max(times):.4f} s')
+        return '\n'.join(lines)
+
+
+# the active profiler, looked up by the instrumented code on every call
+profiler = NullProfiler()
+
+
+@contextmanager
+def profiling(json_lines=None):
+    """Enable the instrumentation inside a with block, and yield the Profiler
+
+        with instrumentation.profiling() as profiler:
+            measurements.single_species_Open_Loop_bandwidth_simualtion(...)
+        print(profiler.report())
+
+    The sweep points computed by worker processes (workers > 1) report their wall times, but not their phases.
+
+    :param json_lines: a JSON lines file the report is appended to at the end of the block
+    """
+    global profiler
+    previous = profiler
+    profiler = Profiler()
+    try:
+        yield profiler
+    finally:
+        active, profiler = profiler, previous
+        if json_lines is not None:
+            active.report().write_json_lines(json_lines)
@@ -1,33 +1,33 @@
 import numpy as np
 import scipy as sp
 import scipy.signal as sps
-import matplotlib.pyplot as plt
+
+# MY PACKAGES
+import utils
 
 
 class LIA:
-    def __init__(self, lpf_params: dict, alpha: np.float = 0.,
-                 amp: np.float = 1.):
+    stream_block_max = 256      # longest use_stream block filtered with block operators
+
+    def __init__(self, lpf_params: dict, alpha: float = 0.,
+                 amp: float = 1.):
         self.lpf_params = lpf_params
         self.alpha = alpha
         self.amp = amp
 
-        """set up low pass filter parameters using a Butterworth low pass filter"""
-        b, a = sps.butter(self.lpf_params['order'],
-                          self.lpf_params['cutoff_hz'] / (self.lpf_params['sampling_frequency_hz'] / 2),
-                          btype='low', analog=False, output='ba')
+        """set up low pass filter parameters using a Butterworth low pass filter in second order sections"""
+        self.lpf_sos = utils.butter_low_pass_sos(self.lpf_params['order'], self.lpf_params['cutoff_hz'],
+                                                 self.lpf_params['sampling_frequency_hz'])
         if self.lpf_params['plot_filter']:
-            # plot the filter frequency response
-            w, h = sps.freqz(b, a, fs=self.lpf_params['sampling_frequency_hz'])
-            plt.semilogx(w, 20 * np.log10(abs(h)))
-            plt.title('Butterworth filter frequency response')
-            plt.xlabel('Frequency [rad / sec]')
-            plt.ylabel('Amplitude [dB]')
-            plt.grid(which='both', axis='both')
-            plt.axvline(self.lpf_params['cutoff_hz'], color='green')  # cutoff frequency
-            plt.show()
-
-        self.lpf_a = a
-        self.lpf_b = b
+            import visualization
+            visualization.plot_filter_response(self.lpf_sos, self.lpf_params['cutoff_hz'], self.lpf_params['sampling_frequency_hz'])
+
+        # real time (streaming) lock-in state
+        self.stream_ref_frequency = None
+        self.stream_input_amplitude = 1.
+        self.stream_phase = 0.
+        self.stream_zi = None
+        self.stream_operators = {}      # block length -> state space block operators of the low pass filter
 
     def filter_signal(self, input_signal):
         """
@@ -35,7 +35,7 @@ class LIA:
         :param input_signal: The signal that we want to filter
         :return: the filtered signal
         """
-        filtered_x = sps.filtfilt(self.lpf_b, self.lpf_a, input_signal)
+        filtered_x = sps.sosfiltfilt(self.lpf_sos, input_signal)
         return filtered_x
 
     def use(self, input_signal, input_time, ref_frequency):
@@ -60,8 +60,12 @@ class LIA:
         Y_modulated_signal = np.multiply(input_signal, Y_ref_signal) * 2 / amplitude_input
 
         # filter and amplify modulated signals
-        X_lia = self.filter_signal(X_modulated_signal) * self.amp
-        Y_lia = self.filter_signal(Y_modulated_signal) * self.amp
+        return self.lia_outputs(self.filter_signal(X_modulated_signal), self.filter_signal(Y_modulated_signal))
+
+    def lia_outputs(self, X_filtered, Y_filtered):
+        """Amplify the filtered X, Y signals and compute the R, Theta lock-in outputs"""
+        X_lia = X_filtered * self.amp
+        Y_lia = Y_filtered * self.amp
         R_lia = np.sqrt(X_lia ** 2 + Y_lia ** 2) * self.amp
 
         # set zeros in signal to numerical zero
@@ -73,10 +77,159 @@ class LIA:
 
         return X_lia, Y_lia, R_lia, Theta_lia
 
+    def start_stream(self, ref_frequency, input_amplitude=1.):
+        """
+        Reset the real time lock-in. In real time the whole input record is not available, so the input signal
+        amplitude used for normalization is given up front
+        :param ref_frequency: the reference frequency which is used for generating the reference signal
+        :param input_amplitude: the input signal amplitude (normalization of the modulated signals)
+        """
+        self.stream_ref_frequency = ref_frequency
+        self.stream_input_amplitude = input_amplitude
+        self.stream_phase = 0.
+        self.stream_zi = np.zeros((self.lpf_sos.shape[0], 2, 2))
+
+    def stream_block_operators(self, n):
+        """The (cached) state space operators running the low pass filter over a block of n samples at once (see
+        utils.state_space_block_operators)"""
+        if n not in self.stream_operators:
+            self.stream_operators[n] = utils.state_space_block_operators(*utils.sos_to_state_space(self.lpf_sos), n)
+        return self.stream_operators[n]
+
+    def use_stream(self, input_block):
+        """
+        Real time lock-in: demodulate a block of consecutive input samples with a causal low pass filter whose state
+        is kept between calls, and a reference generated by a running phase accumulator. Blocks may have any length,
+        and the reference frequency (stream_ref_frequency) may be changed between blocks. Short blocks (up to
+        stream_block_max samples, e.g. between the updates of a control loop) are filtered with cached block
+        operators, which avoids the per call overhead of sosfilt
+        :param input_block: the next block of input signal samples
+        :return: the X, Y, R, Theta lock-in outputs of the block
+        """
+        assert self.stream_zi is not None, 'call start_stream() first'
+        input_block = np.asarray(input_block, dtype=float)
+        fs = self.lpf_params['sampling_frequency_hz']
+
+        # reference phase of every sample in the block
+        phase_step = 2 * np.pi * self.stream_ref_frequency / fs
+        phase = self.stream_phase + phase_step * np.arange(len(input_block)) + self.alpha
+        self.stream_phase = np.mod(self.stream_phase + phase_step * len(input_block), 2 * np.pi)
+
+        # modulate with the X, Y references and filter both in a single call
+        modulated = np.stack([np.multiply(input_block, np.cos(phase)),
+                              np.multiply(input_block, np.cos(phase + np.pi / 2))]) * 2 / self.stream_input_amplitude
+        n = len(input_block)
+        if n <= self.stream_block_max:
+            O, T, An, G = self.stream_block_operators(n)
+            state = self.stream_zi.transpose(1, 0, 2).reshape(2, -1)   # (X / Y, n_state)
+            filtered = state @ O.T + modulated @ T.T
+            self.stream_zi = (state @ An.T + modulated @ G.T).reshape(2, -1, 2).transpose(1, 0, 2)
+        else:
+            filtered, self.stream_zi = sps.sosfilt(self.lpf_sos, modulated, axis=-1, zi=self.stream_zi)
+        return self.lia_outputs(filtered[0], filtered[1])
+
     def scan_alpha(self):
         pass
 
 
+class PIDController:
+    def __init__(self, Kp, Ki, Kd, fs_system, fs_pid, MV_bar=0, e_lim_n=-100, e_lim_p=100, beta=1, gamma=0,
+                 save_error=False):
+        """A PID controller running at fs_pid inside a system sampled at fs_system. The controller is scheduled by
+        the system sample index (every period_steps samples), so its time step is exactly period_steps / fs_system
+
+        :param Kp, Ki, Kd: proportional, integral and derivative gains
+        :param fs_system: the sampling frequency of the physics [Hz]
+        :param fs_pid: the sampling frequency of the PID [Hz], rounded to a whole number of system samples
+        :param MV_bar: initial manipulated variable (MV)
+        :param e_lim_n, e_lim_p: lower and upper limits of the MV correction of a single update
+        :param beta, gamma: set point weights of the proportional and derivative terms
+        :param save_error: keep the MV corrections of all the updates in e_saved
+        """
+        assert fs_system >= fs_pid
+        self.Kp = Kp
+        self.Ki = Ki
+        self.Kd = Kd
+        self.fs_system = fs_system                              # the sampling frequency of the physics
+        self.fs_pid = fs_pid                                    # the sampling frequency of the PID
+        self.period_steps = int(round(fs_system / fs_pid))      # system samples between PID updates
+        self.dt = self.period_steps / fs_system                 # PID time step [s]
+        self.MV_bar = MV_bar                                    # initial MV
+        self.e_lim_p = e_lim_p                                  # e upper limit
+        self.e_lim_n = e_lim_n                                  # e lower limit
+        self.beta = beta
+        self.gamma = gamma
+        self.eD_prev = 0
+        self.I = 0
+        self.e_saved = [0]
+        self.save_error = save_error
+
+    def is_update_step(self, i):
+        """True if the PID updates at system sample i"""
+        return i > 0 and i % self.period_steps == 0
+
+    def lock(self, PV, SP, TR=None):
+        """A single PID update
+
+        :param PV: process variable (the measurement)
+        :param SP: set point
+        :param TR: tracking input, adjusts the I term so the output matches it (bumpless transfer)
+        :return: the manipulated variable (MV)
+        """
+        # adjust I term so output matches tracking input
+        if TR is not None:
+            self.I = TR - self.MV_bar
+
+        # PID calculations
+        P = self.Kp * (self.beta * SP - PV)
+        I = self.I + self.Ki * (SP - PV) * self.dt
+        eD = self.gamma * SP - PV
+        D = self.Kd * (eD - self.eD_prev) / self.dt
+        # set value to saturated MV if out of range
+        total_e = min(max(P + I + D, self.e_lim_n), self.e_lim_p)
+
+        # update stored data for next iteration
+        self.MV_bar = self.MV_bar + total_e
+        self.eD_prev = eD
+        self.I = I
+        if self.save_error:
+            self.e_saved.append(total_e)
+        return self.MV_bar
+
+
+class LIABank:
+    def __init__(self, lpf_params: dict, ref_frequencies, alpha: float = 0.,
+                 amp: float = 1.):
+        """A bank of lock-in amplifiers demodulating several channels at several reference frequencies at once,
+        all with the same low pass filter. The filter design, the reference phase alpha and the lock-in outputs are
+        those of a single LIA, which the bank wraps"""
+        self.lia = LIA(lpf_params, alpha=alpha, amp=amp)
+        self.ref_frequencies = np.atleast_1d(np.asarray(ref_frequencies, dtype=float))
+
+    def use(self, input_signals, input_time):
+        """
+
+        :param input_signals: input signals matrix to the lock-in bank, shape (channels, samples)
+        :param input_time: input time array to the lock-in bank, shape (samples,)
+        :return: the X, Y, R, Theta lock-in outputs, each one with shape (channels, freqs, samples)
+        """
+        input_signals = np.atleast_2d(np.asarray(input_signals, dtype=float))
+        assert input_signals.shape[-1] == len(input_time)
+
+        # a single complex reference X + iY for every reference frequency, shape (freqs, samples)
+        reference = np.exp(-1j * (2 * np.pi * self.ref_frequencies[:, None] * input_time[None, :] + self.lia.alpha))
+
+        # get the input signals amplitudes
+        amplitude_input = np.max(input_signals - np.mean(input_signals, axis=-1, keepdims=True), axis=-1)
+
+        # modulate all the channels at all the frequencies, shape (channels, freqs, samples)
+        modulated = input_signals[:, None, :] * reference[None, :, :] * (2 / amplitude_input)[:, None, None]
+
+        # filter all the demodulated streams in a single call along the last axis
+        filtered = sps.sosfiltfilt(self.lia.lpf_sos, np.stack([modulated.real, modulated.imag]), axis=-1)
+        return self.lia.lia_outputs(filtered[0], filtered[1])
+
+
 if __name__ == "__main__":
     freq = 2
     fs = 1000
@@ -92,12 +245,5 @@ if __name__ == "__main__":
     my_lia = LIA(lpf_params)
     X_lia, Y_lia, R_lia, Theta_lia = my_lia.use(x, t, freq)
 
-    plt.figure(figsize=(20, 4))
-    # plt.title(f'computed phase diff: {lia_phi} [rad], vs injected: {phi}\ncomputed amplitude: {lia_amp}, vs injected {amp}')
-    plt.plot(t, x, label='signal')
-    plt.plot(t, X_lia, label='X_lia')
-    plt.plot(t, Y_lia, label='Y_lia')
-    plt.plot(t, R_lia, label='R_lia')
-    plt.plot(t, Theta_lia, label='Theta_lia')
-    plt.legend()
-    plt.show()
+    import visualization
+    visualization.plot_lia_outputs(t, x, X_lia, Y_lia, R_lia, Theta_lia)
@@ -1,194 +1,439 @@
-# PYTHON PACKAGES
-from scipy.integrate import odeint
-from scipy.linalg import inv
-import matplotlib.pyplot as plt
-import numpy as np
-from tqdm.autonotebook import tqdm
-
-
-# MY PACKAGES
-import physical_constant_units as phy
-import environment as env
-import xenon as xe
-import utils
-
-
-def single_species_Open_Loop_bandwidth_simualtion(gyromagnetic, t1, t2, wr_amp=0.01, B0_amp=1e-6, Bnoise_amp=0, filter_order=2, num_periods=2, points_in_period=1000, freq_list=None, plot_results=True, get_values=False, plot_steps=False, plot_steps_PSD=False):
-
-    if freq_list is None:
-        estimated_bandwidth = 1 / t2 / np.pi
-        freq_list = np.logspace(np.log10(estimated_bandwidth) - 2, np.log10(estimated_bandwidth) + 2, 30)
-
-    phase_diff = np.zeros_like(freq_list)
-    amplitude_ratio = np.zeros_like(freq_list)
-    
-    periods = 1 / freq_list
-    final_times = num_periods * periods
-    for i in range(len(final_times)):
-        if final_times[i] < 10 * t2:
-            final_times[i] = 10 * t2
-    dts = periods / points_in_period
-    sampling_frequencies = 1 / dts
-    steps_of_all_simulations = np.array(final_times // dts, dtype=int)
-    if np.sum(steps_of_all_simulations > 1e5) > 0:
-        raise ValueError('To much points for simulation. Take smaller bandwidth or less points per period !!!')
-
-    for i, f in enumerate(tqdm(freq_list)):
-        # solver parameters
-        freq = f                        # [Hz]
-        noise_cutoff_hz = freq * 1e2  # leave enough flat area around the world signal in the frequency domain
-        period = 1 / freq               # [s]
-        t_final = num_periods * period  # [s]
-        if t_final < 10 * t2:
-            t_final = 10 * t2
-        dt = period / points_in_period  # [s]
-        sampling_frequency = 1 / dt     # [Hz]
-        steps = int(t_final // dt)
-        ts1 = np.linspace(0, dt, 2)
-        ts = np.linspace(0, t_final, steps)
-        Bnoise = np.zeros_like(ts)
-        if Bnoise_amp != 0:
-            noise = utils.get_white_noise(Bnoise_amp * phy.G2T, sampling_frequency, ts)
-            Bnoise = utils.butter_low_pass_filter(noise, filter_order, noise_cutoff_hz, sampling_frequency)  # Tesla
-
-        # world rotation
-        wr = wr_amp * np.sin(2 * np.pi * freq * ts)             # rad / s
-
-        # Xenon parameters
-        Rse = np.array([0, 0, 0.1]) * t1       # |K| / s
-
-        # Environment parameters
-        B0 = B0_amp * phy.G2T * np.ones_like(ts)                             # Tesla
-        Ad_y = 2 * np.sqrt((1 / t1) * (1 / t2)) * np.ones_like(ts)      # rad / s
-        wd_y = gyromagnetic * B0_amp * phy.G2T * np.ones_like(ts)            # rad / s
-        Ad_x = np.zeros_like(ts)                                        # rad / s
-        wd_x = np.zeros_like(ts)                                        # rad / s
-
-        # initialize Environment
-        my_env = env.Environment()
-        my_env.set_state(wr=wr, B0=B0, Bnoise=Bnoise, Ad_y=Ad_y, wd_y=wd_y, Ad_x=Ad_x, wd_x=wd_x)
-
-        # initialize Xenon
-        my_Xe = xe.Xenon(gamma=gyromagnetic, t1=t1, t2=t2, K0=np.array([0.0259, 0.02, 0.3]), ts=t_final, dt=dt)
-        my_Xe.set_spin_exchange_amp(Rse)
-        my_Xe.set_bloch_matrix(my_env)
-        my_Xe.init_with_steady_state()
-
-        # run solver and save dynamics
-        my_Xe.solve_dynamics(my_env)
-        my_Xe.compute_perpendicular_values()
-
-        # computing the world rotation from xenon measurements
-        world_rotation = -my_Xe.phase_perp * my_Xe.gamma2 + my_Xe.gamma * my_env.B0 - my_env.wd_y
-        amplitude_ratio[i] = np.max(np.abs(world_rotation[ts > t_final - period])) / np.max(np.abs(wr[ts > t_final - period]))
-        phase_diff[i] = np.arccos(np.dot(wr[ts > t_final - period], world_rotation[ts > t_final - period]) / utils.l2(wr[ts > t_final - period]) / utils.l2(world_rotation[ts > t_final - period])) / np.pi * 180
-        
-        if plot_steps:
-            print('\nfreq: {}, steps: {}, fs: {}'.format(freq, steps, sampling_frequency))
-            my_Xe.plot_results(my_env)
-            
-        if plot_steps_PSD:
-            signals_list = [B0 + Bnoise, wr / my_Xe.gamma]
-            names = [r'$B$', r'$\Omega_r : \gamma$']
-            Bnoise_amp_tesla = Bnoise_amp * phy.G2T
-            utils.psd_compare(signals_list, sampling_frequency, noise_amplitude=Bnoise_amp_tesla, names=names)
-
-        
-        
-    if plot_results:
-        # plot results
-        fig = plt.figure(figsize=(12, 8))
-        ax = plt.subplot(212)
-        ax.semilogx(freq_list, phase_diff, 'o', label='$\Delta\phi$')
-        ax.vlines(1 / t2 / np.pi, ymin=0, ymax=90,
-                  color='orange', label=r'$\frac{1}{\pi T_2}$ ')
-        ax.set_xlabel('Frequency [Hz]')
-        ax.set_ylabel('Phase [rad]')
-        ax.grid(True)
-        ax.legend()
-
-        ax1 = plt.subplot(211)
-        ax1.set_title('Single species Open-Loop bandwidth simulation')
-        ax1.semilogx(freq_list, 10 * np.log10(amplitude_ratio), 'o', label=r'$\frac{|\Omega_r^{Calc}|}{|\Omega_r^{True}|}$')
-        ax1.vlines(1 / t2 / np.pi, ymin=np.min(10 * np.log10(amplitude_ratio)), ymax=0,
-                   color='orange', label=r'$\frac{1}{\pi T_2}$')
-        ax1.hlines(-3, xmin=freq_list[0], xmax=freq_list[-1],
-                   color='red', label=r'$-3 [dB]$')
-        ax1.set_ylabel('Magnitude [dB]')
-        ax1.set_xlabel('Frequency [Hz]')
-        ax1.grid(True)
-        ax1.legend()
-        plt.tight_layout
-        plt.show()
-
-    if get_values:
-        return freq_list, phase_diff, amplitude_ratio
-
-
-def single_species_Open_Loop_dynamic_range_simulation(gyromagnetic, t1, t2, wr_amp, B0_amp=1e-6, Bnoise_amp=0, noise_cutoff_hz=0.1, filter_order=2, dt=1, t_final=1000, plot_results=True, get_values=False):
-    # world rotation parameters
-    wr_measurements = np.zeros_like(wr_amp)
-
-    # solver parameters
-    steps = int(t_final // dt)
-    sampling_frequency = 1. / dt
-    ts = np.linspace(0, t_final, steps)
-    Bnoise = np.zeros_like(ts)
-        
-    # solver
-    for i, amp in enumerate(tqdm(wr_amp)):
-        # world rotation
-        wr = amp * utils.sigmoid(ts, 1, 100)  # rad / s
-
-        # Xenon parameters
-        Rse = np.array([0, 0, 0.1]) * t1  # |K| / s
-
-        # Environment parameters
-        B0 = B0_amp * phy.G2T * np.ones_like(ts)  # Tesla
-        if Bnoise_amp != 0:
-            noise = utils.get_white_noise(Bnoise_amp * phy.G2T, sampling_frequency, ts)
-            Bnoise = utils.butter_low_pass_filter(noise, filter_order, noise_cutoff_hz, sampling_frequency)
-        Ad_y = 2 * np.sqrt((1 / t1) * (1 / t2)) * np.ones_like(ts)  # rad / s
-        wd_y = gyromagnetic * B0_amp * phy.G2T * np.ones_like(ts)  # rad / s
-        Ad_x = np.zeros_like(ts)  # rad / s
-        wd_x = np.zeros_like(ts)  # rad / s
-
-        # initialize Environment
-        my_env = env.Environment()
-        my_env.set_state(wr=wr, B0=B0, Bnoise=Bnoise, Ad_y=Ad_y, wd_y=wd_y, Ad_x=Ad_x, wd_x=wd_x)
-
-        # initialize Xenon
-        my_Xe = xe.Xenon(gamma=gyromagnetic, t1=t1, t2=t2, K0=np.array([0.0259, 0.02, 0.3]), ts=t_final, dt=dt)
-        my_Xe.set_spin_exchange_amp(Rse)
-        my_Xe.set_bloch_matrix(my_env)
-        my_Xe.init_with_steady_state()
-
-        # run solver and save dynamics
-        my_Xe.solve_dynamics(my_env)
-        my_Xe.compute_perpendicular_values()
-
-        # computing the world rotation from xenon measurements
-        world_rotation = -my_Xe.phase_perp * my_Xe.gamma2 + my_Xe.gamma * my_env.B0 - my_env.wd_y
-        wr_measurements[i] = world_rotation[-1]
-
-    if plot_results:
-        # plot dynamic range results
-        fig = plt.figure(figsize=(12, 8))
-        ax = plt.subplot()
-        ax.set_title('World rotation dynamic range simulation')
-        ax.loglog(wr_amp, wr_measurements, 'o', label='simulation')
-        ax.loglog(wr_amp, wr_amp, '--', label='perfect match')
-        ax.set_ylabel('$\Omega_r^{calc}$ [rad / s]')
-        ax.set_xlabel('$\Omega_r^{True}$ [rad / s]')
-        ax.vlines(1 / np.sqrt(t1 * t2), ymin=np.min(wr_measurements), ymax=np.max(wr_measurements),
-                  color='red', label=r'$\frac{1}{\sqrt{T_1 * T_2}}$')
-        if Bnoise_amp != 0:
-            ax.vlines(np.abs(gyromagnetic * Bnoise_amp * phy.G2T), ymin=np.min(wr_measurements), ymax=np.max(wr_measurements),
-                      color='black', label=r'$\gamma |B^{noise}|$')
-        ax.grid(True)
-        ax.legend()
-        plt.tight_layout
-        plt.show()
-
-    if get_values:
-        return wr_amp, wr_measurements
+# PYTHON PACKAGES
+import numpy as np
+
+
+# MY PACKAGES
+import physical_constant_units as phy
+import environment as env
+import instrumentation
+import xenon as xe
+import xenon_batch as xe_batch
+import sweeps
+import noise
+import utils
+
+
+def _bandwidth_point_environment(gyromagnetic, t1, t2, freq, wr_amp, B0_amp, Bnoise_amp, filter_order, num_periods, points_in_period, rng=None):
+    """Returns the solver parameters and the Environment arrays of a single bandwidth simulation point"""
+    # solver parameters
+    noise_cutoff_hz = freq * 1e2  # leave enough flat area around the world signal in the frequency domain
+    period = 1 / freq               # [s]
+    t_final = num_periods * period  # [s]
+    if t_final < 10 * t2:
+        t_final = 10 * t2
+    dt = period / points_in_period  # [s]
+    sampling_frequency = 1 / dt     # [Hz]
+    steps = int(t_final // dt)
+    ts = np.linspace(0, t_final, steps)
+    Bnoise = 0.
+    if Bnoise_amp != 0:
+        with instrumentation.profiler.phase('noise'):
+            Bnoise = noise.band_limited(Bnoise_amp * phy.G2T, sampling_frequency, steps, noise_cutoff_hz, order=filter_order, rng=rng)  # Tesla
+
+    # world rotation
+    wr = wr_amp * np.sin(2 * np.pi * freq * ts)             # rad / s
+
+    # Environment parameters
+    B0 = B0_amp * phy.G2T                           # Tesla
+    Ad_y = 2 * np.sqrt((1 / t1) * (1 / t2))         # rad / s
+    wd_y = gyromagnetic * B0_amp * phy.G2T          # rad / s
+    Ad_x = 0.                                       # rad / s
+    wd_x = 0.                                       # rad / s
+
+    return {'period': period, 't_final': t_final, 'dt': dt, 'sampling_frequency': sampling_frequency, 'steps': steps,
+            'ts': ts, 'wr': wr, 'B0': B0, 'Bnoise': Bnoise, 'Ad_y': Ad_y, 'wd_y': wd_y, 'Ad_x': Ad_x, 'wd_x': wd_x}
+
+
+def _bandwidth_point_response(ts, t_final, period, wr, world_rotation):
+    """Returns the amplitude ratio and the phase difference [deg] between the true and the calculated world rotation
+    over the last period of a bandwidth simulation point"""
+    last_period = ts > t_final - period
+    amplitude_ratio = np.max(np.abs(world_rotation[last_period])) / np.max(np.abs(wr[last_period]))
+    phase_diff = np.arccos(np.dot(wr[last_period], world_rotation[last_period]) / utils.l2(wr[last_period]) / utils.l2(world_rotation[last_period])) / np.pi * 180
+    return amplitude_ratio, phase_diff
+
+
+def _bandwidth_point(gyromagnetic, t1, t2, freq, wr_amp, B0_amp, Bnoise_amp, filter_order, num_periods, points_in_period, rng=None, plot_steps=False, plot_steps_PSD=False):
+    """Simulates a single bandwidth point and returns its amplitude ratio and phase difference [deg]"""
+    point = _bandwidth_point_environment(gyromagnetic, t1, t2, freq, wr_amp, B0_amp, Bnoise_amp, filter_order, num_periods, points_in_period, rng=rng)
+
+    if plot_steps_PSD:
+        signals_list = [point['B0'] + np.broadcast_to(point['Bnoise'], point['ts'].shape), point['wr'] / gyromagnetic]
+        names = [r'$B$', r'$\Omega_r : \gamma$']
+        Bnoise_amp_tesla = Bnoise_amp * phy.G2T
+        utils.psd_compare(signals_list, point['sampling_frequency'], noise_amplitude=Bnoise_amp_tesla, names=names)
+
+    # Xenon parameters
+    Rse = np.array([0, 0, 0.1]) * t1       # |K| / s
+
+    # initialize Environment
+    my_env = env.Environment()
+    my_env.set_state(wr=point['wr'], B0=point['B0'], Bnoise=point['Bnoise'], Ad_y=point['Ad_y'], wd_y=point['wd_y'], Ad_x=point['Ad_x'], wd_x=point['wd_x'])
+
+    # initialize Xenon, recording only the last period (the whole run for plot_steps)
+    my_Xe = xe.Xenon(gamma=gyromagnetic, t1=t1, t2=t2, K0=np.array([0.0259, 0.02, 0.3]), ts=point['t_final'], dt=point['dt'])
+    if not plot_steps:
+        my_Xe.set_recording(start_time=point['t_final'] - point['period'])
+    my_Xe.set_spin_exchange_amp(Rse)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+
+    # run solver and save dynamics
+    my_Xe.solve_dynamics(my_env)
+    my_Xe.compute_perpendicular_values()
+
+    # computing the world rotation from xenon measurements
+    world_rotation = my_Xe.compute_world_rotation(my_env)
+
+    if plot_steps:
+        print('\nfreq: {}, steps: {}, fs: {}'.format(freq, point['steps'], point['sampling_frequency']))
+        my_Xe.plot_results(my_env)
+
+    recorded = my_Xe.recorded_steps()
+    return _bandwidth_point_response(point['ts'][recorded], point['t_final'], point['period'], point['wr'][recorded], world_rotation)
+
+
+def _bandwidth_batch(points, plot_steps_PSD=False):
+    """Simulates a list of bandwidth points (keyword argument dicts of _bandwidth_point) in lockstep with a single
+    XenonBatch, and returns their amplitude ratios and phase differences [deg]"""
+    environments = []
+    for kwargs in sweeps.progress_bar(points):
+        point = _bandwidth_point_environment(**{name: value for name, value in kwargs.items() if name not in ('plot_steps', 'plot_steps_PSD')})
+        if plot_steps_PSD:
+            signals_list = [point['B0'] + np.broadcast_to(point['Bnoise'], point['ts'].shape), point['wr'] / kwargs['gyromagnetic']]
+            names = [r'$B$', r'$\Omega_r : \gamma$']
+            Bnoise_amp_tesla = kwargs['Bnoise_amp'] * phy.G2T
+            utils.psd_compare(signals_list, point['sampling_frequency'], noise_amplitude=Bnoise_amp_tesla, names=names)
+        environments.append(point)
+
+    # Xenon parameters
+    t1 = np.array([kwargs['t1'] for kwargs in points])
+    Rse = np.array([0, 0, 0.1]) * t1[:, None]       # |K| / s
+
+    # stack all points into (n_runs, t_steps) arrays, padding the shorter runs with their last value. Constants shared
+    # by all the points stay scalars
+    t_steps = max(point['steps'] for point in environments)
+    stacked = {}
+    for key in ['wr', 'B0', 'Bnoise', 'Ad_y', 'wd_y', 'Ad_x', 'wd_x']:
+        values = [point[key] for point in environments]
+        if all(np.ndim(value) == 0 and value == values[0] for value in values):
+            stacked[key] = values[0]
+        else:
+            stacked[key] = np.stack([np.pad(np.broadcast_to(point[key], (point['steps'],)), (0, t_steps - point['steps']), mode='edge')
+                                     for point in environments])
+
+    # initialize Environment
+    my_env = env.Environment()
+    my_env.set_state(**stacked)
+
+    # initialize Xenon batch
+    my_Xe = xe_batch.XenonBatch(gamma=[kwargs['gyromagnetic'] for kwargs in points], t1=t1, t2=[kwargs['t2'] for kwargs in points],
+                                K0=np.array([0.0259, 0.02, 0.3]), ts=[point['t_final'] for point in environments],
+                                dt=[point['dt'] for point in environments])
+    my_Xe.set_spin_exchange_amp(Rse)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+
+    # run solver and save dynamics
+    with instrumentation.profiler.phase('solve_batch'):
+        my_Xe.solve_dynamics(my_env)
+    my_Xe.compute_perpendicular_values()
+
+    # computing the world rotation from xenon measurements
+    world_rotation = my_Xe.compute_world_rotation(my_env)
+    return [_bandwidth_point_response(point['ts'], point['t_final'], point['period'], point['wr'], world_rotation[i, :point['steps']])
+            for i, point in enumerate(environments)]
+
+
+def single_species_Open_Loop_bandwidth_simualtion(gyromagnetic, t1, t2, wr_amp=0.01, B0_amp=1e-6, Bnoise_amp=0, filter_order=2, num_periods=2, points_in_period=1000, freq_list=None, plot_results=True, get_values=False, plot_steps=False, plot_steps_PSD=False, batched=False, workers=1, seed=None, cache=None):
+    """Single species open loop bandwidth simulation. With batched=True all the frequency points are solved in
+    lockstep by a single XenonBatch, where the shorter runs are padded to the length of the longest one. With
+    workers > 1 the frequency points are distributed over a pool of worker processes. A seed makes the magnetic noise
+    of every frequency point reproducible, and the results identical for any number of workers. With a SweepCache
+    in cache, previously computed points are read from the cache and only the new points are simulated."""
+
+    if freq_list is None:
+        estimated_bandwidth = 1 / t2 / np.pi
+        freq_list = np.logspace(np.log10(estimated_bandwidth) - 2, np.log10(estimated_bandwidth) + 2, 30)
+    if batched and plot_steps:
+        raise ValueError('plot_steps is not supported in a batched simulation')
+    if workers > 1 and (batched or plot_steps or plot_steps_PSD):
+        raise ValueError('workers > 1 can not be combined with batched, plot_steps or plot_steps_PSD')
+
+    phase_diff = np.zeros_like(freq_list)
+    amplitude_ratio = np.zeros_like(freq_list)
+
+    periods = 1 / freq_list
+    final_times = num_periods * periods
+    for i in range(len(final_times)):
+        if final_times[i] < 10 * t2:
+            final_times[i] = 10 * t2
+    dts = periods / points_in_period
+    sampling_frequencies = 1 / dts
+    steps_of_all_simulations = np.array(final_times // dts, dtype=int)
+    if np.sum(steps_of_all_simulations > 1e5) > 0:
+        raise ValueError('To much points for simulation. Take smaller bandwidth or less points per period !!!')
+
+    seeds = sweeps.point_seeds(seed, freq_list)
+    points = [dict(gyromagnetic=gyromagnetic, t1=t1, t2=t2, freq=f, wr_amp=wr_amp, B0_amp=B0_amp, Bnoise_amp=Bnoise_amp,
+                   filter_order=filter_order, num_periods=num_periods, points_in_period=points_in_period, rng=seeds[i],
+                   plot_steps=plot_steps, plot_steps_PSD=plot_steps_PSD) for i, f in enumerate(freq_list)]
+
+    # look up the cached points. Points with random (unseeded) magnetic noise are never cached
+    keys = [None] * len(freq_list)
+    results = [None] * len(freq_list)
+    if cache is not None and (Bnoise_amp == 0 or seed is not None):
+        keys = [cache.key(gyromagnetic=gyromagnetic, t1=t1, t2=t2, freq=f, wr_amp=wr_amp, B0_amp=B0_amp,
+                          Bnoise_amp=Bnoise_amp, filter_order=filter_order, dt=dts[i], steps=steps_of_all_simulations[i],
+                          seed=seed if Bnoise_amp != 0 else None, batched=batched) for i, f in enumerate(freq_list)]
+        results = [cache.get(key) for key in keys]
+    missing = [i for i in range(len(freq_list)) if results[i] is None]
+
+    with instrumentation.profiler.phase('bandwidth_sweep'):
+        if not missing:
+            computed = []
+        elif batched:
+            computed = _bandwidth_batch([points[i] for i in missing], plot_steps_PSD=plot_steps_PSD)
+        else:
+            computed = sweeps.run_sweep(_bandwidth_point, [points[i] for i in missing], workers=workers)
+    for i, result in zip(missing, computed):
+        results[i] = result
+        if keys[i] is not None:
+            cache.put(keys[i], result)
+    results = np.array(results, dtype=float)
+    amplitude_ratio[:], phase_diff[:] = results[:, 0], results[:, 1]
+
+    if plot_results:
+        import visualization
+        visualization.plot_bandwidth(freq_list, phase_diff, amplitude_ratio, t2)
+
+    if get_values:
+        return freq_list, phase_diff, amplitude_ratio
+
+
+def single_species_Open_Loop_bandwidth_adaptive(gyromagnetic, t1, t2, wr_amp=0.01, B0_amp=1e-6, Bnoise_amp=0, filter_order=2, num_periods=2, points_in_period=1000, freq_range=None, coarse_points=9, rtol=0.01, max_points=40, plot_results=True, get_values=False, workers=1, seed=None, cache=None):
+    """Single species open loop bandwidth from an adaptive frequency sweep. The response is simulated on a coarse
+    log-spaced grid over freq_range, and the first -3 dB crossing of the magnitude (10 log10 of the amplitude ratio,
+    as plotted by single_species_Open_Loop_bandwidth_simualtion) is then bracketed by bisection in log frequency,
+    until the bracket is narrower than rtol (relative) or max_points points were simulated. With workers > 1 every
+    refinement round splits the bracket into workers + 1 parts, so all the workers are busy. The bandwidth is
+    interpolated linearly in log frequency between the ends of the final bracket.
+
+    :return: the bandwidth [Hz] and, with get_values, (bandwidth, freq_list, phase_diff, amplitude_ratio) of all the
+             simulated points sorted by frequency
+    """
+    if freq_range is None:
+        estimated_bandwidth = 1 / t2 / np.pi
+        freq_range = (estimated_bandwidth / 100, estimated_bandwidth * 100)
+    if coarse_points < 2:
+        raise ValueError('coarse_points must be at least 2')
+
+    def simulate(freqs):
+        return single_species_Open_Loop_bandwidth_simualtion(
+            gyromagnetic, t1, t2, wr_amp=wr_amp, B0_amp=B0_amp, Bnoise_amp=Bnoise_amp, filter_order=filter_order,
+            num_periods=num_periods, points_in_period=points_in_period, freq_list=np.asarray(freqs, dtype=float),
+            plot_results=False, get_values=True, workers=workers, seed=seed, cache=cache)[1:]
+
+    freq_list = np.logspace(np.log10(freq_range[0]), np.log10(freq_range[1]), coarse_points)
+    phase_diff, amplitude_ratio = simulate(freq_list)
+
+    while True:
+        magnitude = 10 * np.log10(amplitude_ratio)
+        below = np.flatnonzero(magnitude < -3)
+        if len(below) == 0 or below[0] == 0:
+            raise ValueError('The -3 dB crossing is not inside freq_range, take a wider frequency range')
+        hi = below[0]
+        lo = hi - 1
+        if freq_list[hi] / freq_list[lo] - 1 <= rtol or len(freq_list) >= max_points:
+            break
+
+        # split the bracket in log frequency, a bisection for a single worker
+        parts = min(max(workers, 1), max_points - len(freq_list)) + 1
+        new_freqs = np.logspace(np.log10(freq_list[lo]), np.log10(freq_list[hi]), parts + 1)[1:-1]
+        new_phase_diff, new_amplitude_ratio = simulate(new_freqs)
+        freq_list = np.concatenate((freq_list, new_freqs))
+        phase_diff = np.concatenate((phase_diff, new_phase_diff))
+        amplitude_ratio = np.concatenate((amplitude_ratio, new_amplitude_ratio))
+        order = np.argsort(freq_list)
+        freq_list, phase_diff, amplitude_ratio = freq_list[order], phase_diff[order], amplitude_ratio[order]
+
+    # -3 dB in log frequency between the ends of the bracket
+    fraction = (-3 - magnitude[lo]) / (magnitude[hi] - magnitude[lo])
+    bandwidth = freq_list[lo] * (freq_list[hi] / freq_list[lo]) ** fraction
+
+    if plot_results:
+        import visualization
+        visualization.plot_bandwidth(freq_list, phase_diff, amplitude_ratio, t2)
+
+    if get_values:
+        return bandwidth, freq_list, phase_diff, amplitude_ratio
+    return bandwidth
+
+
+def single_species_Open_Loop_bandwidth_linear(gyromagnetic, t1, t2, B0_amp=1e-6, freq_list=None, check_freqs=None, wr_amp=0.01, num_periods=2, points_in_period=1000, plot_results=True, get_values=False):
+    """Single species open loop bandwidth from the linearized dynamics around the steady state (Xenon.frequency_response),
+    for all the frequencies at once and without any time domain simulation. The amplitude ratio and phase difference
+    [deg] are |H| and |angle(H)|, as measured by single_species_Open_Loop_bandwidth_simualtion. The frequencies in
+    check_freqs are also simulated in the time domain as a cross check.
+
+    :return: with get_values, (freq_list, phase_diff, amplitude_ratio) and, with check_freqs, also the time domain
+             (check_freqs, phase_diff, amplitude_ratio)
+    """
+    if freq_list is None:
+        estimated_bandwidth = 1 / t2 / np.pi
+        freq_list = np.logspace(np.log10(estimated_bandwidth) - 2, np.log10(estimated_bandwidth) + 2, 1000)
+    freq_list = np.asarray(freq_list, dtype=float)
+
+    # operating point: the bandwidth simulation Environment without world rotation and magnetic noise
+    my_env = env.Environment()
+    my_env.set_state(wr=0., B0=B0_amp * phy.G2T, Bnoise=0., Ad_y=2 * np.sqrt((1 / t1) * (1 / t2)),
+                     wd_y=gyromagnetic * B0_amp * phy.G2T, Ad_x=0., wd_x=0.)
+    my_Xe = xe.Xenon(gamma=gyromagnetic, t1=t1, t2=t2, ts=1, dt=1)
+    my_Xe.set_spin_exchange_amp(np.array([0, 0, 0.1]) * t1)
+    my_Xe.set_bloch_matrix(my_env)
+
+    H = my_Xe.frequency_response(freq_list)
+    amplitude_ratio = np.abs(H)
+    phase_diff = np.abs(np.angle(H, deg=True))
+
+    check = None
+    if check_freqs is not None:
+        check_freqs = np.asarray(check_freqs, dtype=float)
+        check_freqs, check_phase_diff, check_amplitude_ratio = single_species_Open_Loop_bandwidth_simualtion(
+            gyromagnetic, t1, t2, wr_amp=wr_amp, B0_amp=B0_amp, num_periods=num_periods, points_in_period=points_in_period,
+            freq_list=check_freqs, plot_results=False, get_values=True)
+        check = (check_freqs, check_phase_diff, check_amplitude_ratio)
+
+    if plot_results:
+        import visualization
+        visualization.plot_bandwidth(freq_list, phase_diff, amplitude_ratio, t2, style='-', check=check)
+
+    if get_values:
+        if check is not None:
+            return freq_list, phase_diff, amplitude_ratio, check
+        return freq_list, phase_diff, amplitude_ratio
+
+
+def _dynamic_range_point(gyromagnetic, t1, t2, amp, B0_amp, Bnoise_amp, noise_cutoff_hz, filter_order, dt, t_final, rng=None, convergence=None):
+    """Simulates a single dynamic range point and returns the final calculated world rotation and the time the
+    solver stopped at (t_final, or earlier with a convergence monitor)"""
+    # solver parameters
+    steps = int(t_final // dt)
+    sampling_frequency = 1. / dt
+    Bnoise = 0.
+
+    # world rotation, evaluated by the solver at its sample times
+    def wr(t):
+        return amp * utils.sigmoid(t, 1, 100)  # rad / s
+
+    # Xenon parameters
+    Rse = np.array([0, 0, 0.1]) * t1  # |K| / s
+
+    # Environment parameters
+    B0 = B0_amp * phy.G2T  # Tesla
+    if Bnoise_amp != 0:
+        with instrumentation.profiler.phase('noise'):
+            Bnoise = noise.band_limited(Bnoise_amp * phy.G2T, sampling_frequency, steps, noise_cutoff_hz, order=filter_order, rng=rng)
+    Ad_y = 2 * np.sqrt((1 / t1) * (1 / t2))  # rad / s
+    wd_y = gyromagnetic * B0_amp * phy.G2T  # rad / s
+    Ad_x = 0.  # rad / s
+    wd_x = 0.  # rad / s
+
+    # initialize Environment
+    my_env = env.Environment()
+    my_env.set_state(wr=wr, B0=B0, Bnoise=Bnoise, Ad_y=Ad_y, wd_y=wd_y, Ad_x=Ad_x, wd_x=wd_x)
+
+    # initialize Xenon, recording only the final state
+    my_Xe = xe.Xenon(gamma=gyromagnetic, t1=t1, t2=t2, K0=np.array([0.0259, 0.02, 0.3]), ts=t_final, dt=dt)
+    my_Xe.set_recording(final_only=True)
+    if convergence is not None:
+        my_Xe.set_convergence_monitor(**convergence)
+    my_Xe.set_spin_exchange_amp(Rse)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+
+    # run solver and save dynamics
+    my_Xe.solve_dynamics(my_env)
+    my_Xe.compute_perpendicular_values()
+
+    # computing the world rotation from xenon measurements
+    world_rotation = my_Xe.compute_world_rotation(my_env)
+    return world_rotation[-1], my_Xe.ts if my_Xe.stop_time is None else my_Xe.stop_time
+
+
+def single_species_Open_Loop_dynamic_range_simulation(gyromagnetic, t1, t2, wr_amp, B0_amp=1e-6, Bnoise_amp=0, noise_cutoff_hz=0.1, filter_order=2, dt=1, t_final=1000, plot_results=True, get_values=False, batched=False, workers=1, seed=None, convergence=None):
+    """Single species open loop dynamic range simulation. With batched=True all the world rotation amplitudes are
+    solved in lockstep by a single XenonBatch. With workers > 1 the amplitudes are distributed over a pool of worker
+    processes. A seed makes the magnetic noise of every amplitude reproducible, and the results identical for any
+    number of workers. With convergence, a dict of Xenon.set_convergence_monitor parameters, every amplitude stops
+    integrating once its spin state settled, and get_values also returns the stop times [s]."""
+    if workers > 1 and batched:
+        raise ValueError('workers > 1 can not be combined with batched')
+    if batched and convergence is not None:
+        raise ValueError('convergence is not supported in a batched simulation')
+    seeds = sweeps.point_seeds(seed, wr_amp)
+
+    # world rotation parameters
+    wr_measurements = np.zeros_like(wr_amp)
+    stop_times = np.full(len(wr_amp), float(t_final))
+
+    # solver parameters
+    steps = int(t_final // dt)
+    sampling_frequency = 1. / dt
+    ts = np.linspace(0, t_final, steps)
+    Bnoise = 0.
+
+    # Xenon parameters
+    Rse = np.array([0, 0, 0.1]) * t1  # |K| / s
+
+    # Environment parameters
+    B0 = B0_amp * phy.G2T  # Tesla
+    Ad_y = 2 * np.sqrt((1 / t1) * (1 / t2))  # rad / s
+    wd_y = gyromagnetic * B0_amp * phy.G2T  # rad / s
+    Ad_x = 0.  # rad / s
+    wd_x = 0.  # rad / s
+
+    if batched:
+        # world rotation and magnetic noise of all runs, shape (n_runs, t_steps)
+        wr = np.asarray(wr_amp)[:, None] * utils.sigmoid(ts, 1, 100)  # rad / s
+        if Bnoise_amp != 0:
+            with instrumentation.profiler.phase('noise'):
+                Bnoise = noise.band_limited(Bnoise_amp * phy.G2T, sampling_frequency, steps, noise_cutoff_hz, order=filter_order,
+                                            n_realizations=len(wr_amp), rng=seeds)
+
+        # initialize Environment
+        my_env = env.Environment()
+        my_env.set_state(wr=wr, B0=B0, Bnoise=Bnoise, Ad_y=Ad_y, wd_y=wd_y, Ad_x=Ad_x, wd_x=wd_x)
+
+        # initialize Xenon batch
+        my_Xe = xe_batch.XenonBatch(gamma=gyromagnetic, t1=t1, t2=t2, K0=np.array([0.0259, 0.02, 0.3]), ts=t_final, dt=dt, n_runs=len(wr_amp))
+        my_Xe.set_recording(final_only=True)
+        my_Xe.set_spin_exchange_amp(Rse)
+        my_Xe.set_bloch_matrix(my_env)
+        my_Xe.init_with_steady_state()
+
+        # run solver and save dynamics
+        with instrumentation.profiler.phase('solve_batch'):
+            my_Xe.solve_dynamics(my_env)
+        my_Xe.compute_perpendicular_values()
+
+        # computing the world rotation from xenon measurements
+        world_rotation = my_Xe.compute_world_rotation(my_env)
+        wr_measurements[:] = world_rotation[:, -1]
+    else:
+        points = [dict(gyromagnetic=gyromagnetic, t1=t1, t2=t2, amp=amp, B0_amp=B0_amp, Bnoise_amp=Bnoise_amp,
+                       noise_cutoff_hz=noise_cutoff_hz, filter_order=filter_order, dt=dt, t_final=t_final, rng=seeds[i],
+                       convergence=convergence) for i, amp in enumerate(wr_amp)]
+        with instrumentation.profiler.phase('dynamic_range_sweep'):
+            results = sweeps.run_sweep(_dynamic_range_point, points, workers=workers)
+        wr_measurements[:] = [result[0] for result in results]
+        stop_times[:] = [result[1] for result in results]
+
+    if plot_results:
+        import visualization
+        visualization.plot_dynamic_range(wr_amp, wr_measurements, gyromagnetic, t1, t2, Bnoise_amp=Bnoise_amp)
+
+    if get_values:
+        if convergence is not None:
+            return wr_amp, wr_measurements, stop_times
+        return wr_amp, wr_measurements
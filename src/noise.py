@@ -0,0 +1,160 @@
+# PYTHON PACKAGES
+import numpy as np
+import scipy.signal as signal
+
+# MY PACKAGES
+import utils
+
+
+# Paul Kellet's refined pink noise filter: six one pole low pass filters (pole, gain) summed with a direct path
+# and a one sample delayed path. Accurate to +-0.05 dB above ~2e-4 of the sampling frequency.
+KELLET_POLES = [(0.99886, 0.0555179), (0.99332, 0.0750759), (0.96900, 0.1538520), (0.86650, 0.3104856),
+                (0.55000, 0.5329522), (-0.7616, -0.0168980)]
+KELLET_DIRECT = 0.5362
+KELLET_DELAYED = 0.115926
+
+
+def _generators(rng):
+    """The random source(s) of rng: the global NumPy random state for None, a list of Generators for a list of
+    seeds (one per realization), and a single Generator otherwise"""
+    if rng is None:
+        return np.random
+    if isinstance(rng, (list, tuple)):
+        return [np.random.default_rng(r) for r in rng]
+    return np.random.default_rng(rng)
+
+
+def _standard_normal(generators, shape):
+    """Standard normal samples of the given shape. A list of generators draws row shape[0] from generator i"""
+    if isinstance(generators, list):
+        assert len(generators) == shape[0]
+        return np.stack([g.standard_normal(shape[1:]) for g in generators])
+    return generators.standard_normal(shape)
+
+
+def _shape(n_samples, n_realizations, rng):
+    """(n_samples,) for a single realization, else (n_realizations, n_samples)"""
+    if n_realizations is None and isinstance(rng, (list, tuple)):
+        n_realizations = len(rng)
+    return (n_samples,) if n_realizations is None else (n_realizations, n_samples)
+
+
+def shaped(amplitude_spectral_density, sampling_frequency, n_samples, n_realizations=None, rng=None):
+    """Gaussian noise with an arbitrary one sided amplitude spectral density, synthesized in the frequency domain
+    (the record is periodic, its end is correlated with its start at the lowest frequencies)
+
+    :param amplitude_spectral_density: function of the frequency [Hz] array, returning the ASD [units / sqrt(Hz)]
+    :param sampling_frequency: [Hz]
+    :param n_samples: number of samples of every realization
+    :param n_realizations: None for a single (n_samples,) record, else an (n_realizations, n_samples) batch
+    :param rng: seed / SeedSequence / numpy.random.Generator, or a list of them (one per realization). None uses the
+                global NumPy random state
+    """
+    shape = _shape(n_samples, n_realizations, rng)
+    f = np.fft.rfftfreq(n_samples, d=1. / sampling_frequency)
+    asd = np.broadcast_to(np.asarray(amplitude_spectral_density(f), dtype=float), f.shape)
+    z = _standard_normal(_generators(rng), shape[:-1] + (2, f.size))
+
+    # interior bins are complex with E|X|^2 = n * S * fs / 2, the DC (and Nyquist) bins are real
+    spectrum = (z[..., 0, :] + 1j * z[..., 1, :]) * asd * np.sqrt(n_samples * sampling_frequency / 4)
+    real_bins = [0, -1] if n_samples % 2 == 0 else [0]
+    spectrum[..., real_bins] = z[..., 0, real_bins] * asd[real_bins] * np.sqrt(n_samples * sampling_frequency / 2)
+    return np.fft.irfft(spectrum, n=n_samples, axis=-1)
+
+
+def white(amplitude, sampling_frequency, n_samples, n_realizations=None, rng=None):
+    """Gaussian white noise with amplitude spectral density amplitude [units / sqrt(Hz)] (as utils.get_white_noise)"""
+    shape = _shape(n_samples, n_realizations, rng)
+    return amplitude * np.sqrt(sampling_frequency / 2) * _standard_normal(_generators(rng), shape)
+
+
+def band_limited(amplitude, sampling_frequency, n_samples, cutoff_hz, order=2, n_realizations=None, rng=None):
+    """White noise of amplitude [units / sqrt(Hz)] band limited by a Butterworth low pass filter of the given order.
+    The spectrum is the one of white noise through utils.butter_low_pass_filter (filtfilt, so |H|^2), without
+    generating the white noise and filtering it"""
+    def asd(f):
+        return amplitude / (1 + (f / cutoff_hz) ** (2 * order))
+    return shaped(asd, sampling_frequency, n_samples, n_realizations=n_realizations, rng=rng)
+
+
+def pink(amplitude, sampling_frequency, n_samples, f_ref=1., n_realizations=None, rng=None):
+    """1/f noise with amplitude spectral density amplitude * sqrt(f_ref / f), amplitude [units / sqrt(Hz)] at f_ref"""
+    def asd(f):
+        return amplitude * np.sqrt(f_ref / np.where(f > 0, f, np.inf))
+    return shaped(asd, sampling_frequency, n_samples, n_realizations=n_realizations, rng=rng)
+
+
+def random_walk(amplitude, sampling_frequency, n_samples, n_realizations=None, rng=None):
+    """Random walk (1/f^2 power) noise, the time integral of white noise with amplitude [units / sqrt(Hz) / s].
+    Starts at 0"""
+    return np.cumsum(white(amplitude, sampling_frequency, n_samples, n_realizations=n_realizations, rng=rng),
+                     axis=-1) / sampling_frequency
+
+
+def kellet_gain(frequency, sampling_frequency):
+    """|H(f)| of the Kellet pink noise filter"""
+    z = np.exp(-2j * np.pi * np.asarray(frequency) / sampling_frequency)  # z^-1
+    return np.abs(sum(gain / (1 - pole * z) for pole, gain in KELLET_POLES) + KELLET_DIRECT + KELLET_DELAYED * z)
+
+
+class NoiseStream:
+    """Chunked generation of a long noise record for streaming runs, one block of samples at a time.
+
+    The models are the ones of this module with causal, stateful filters in place of the frequency domain shaping:
+        'white'         - as white()
+        'band_limited'  - white noise through the Butterworth filter of band_limited() applied twice (same |H|^2)
+        'pink'          - white noise through the Kellet filter, scaled to amplitude [units / sqrt(Hz)] at f_ref
+        'random_walk'   - as random_walk(), continuing from the last sample of the previous block
+    The filtered models start from a filter at rest, so the first ~1 / cutoff_hz (or ~1 / f_ref) seconds ramp in.
+    """
+    models = ['white', 'band_limited', 'pink', 'random_walk']
+
+    def __init__(self, model, amplitude, sampling_frequency, n_realizations=None, rng=None, cutoff_hz=None, order=2,
+                 f_ref=1.):
+        if model not in self.models:
+            raise ValueError(f'model must be one of {self.models}, got {model}')
+        if model == 'band_limited' and cutoff_hz is None:
+            raise ValueError('band_limited noise needs a cutoff_hz')
+        self.model = model
+        self.amplitude = amplitude
+        self.sampling_frequency = sampling_frequency
+        self.n_realizations = len(rng) if n_realizations is None and isinstance(rng, (list, tuple)) else n_realizations
+        self.generators = _generators(rng)
+        self.samples = 0            # number of samples generated so far
+
+        batch = () if self.n_realizations is None else (self.n_realizations,)
+        self.scale = amplitude * np.sqrt(sampling_frequency / 2)
+        if model == 'band_limited':
+            self.sos = np.concatenate([utils.butter_low_pass_sos(order, cutoff_hz, sampling_frequency)] * 2)
+            self.zi = np.zeros((self.sos.shape[0],) + batch + (2,))
+        elif model == 'pink':
+            self.scale = self.scale / kellet_gain(f_ref, sampling_frequency)
+            self.poles = np.array([pole for pole, gain in KELLET_POLES])
+            self.gains = np.array([gain for pole, gain in KELLET_POLES])
+            self.zi = np.zeros((len(KELLET_POLES),) + batch)     # one pole filter states
+            self.delayed = np.zeros(batch)                      # last white sample
+        elif model == 'random_walk':
+            self.last = np.zeros(batch)
+
+    def next(self, n_samples):
+        """The next n_samples of the record, shape (n_samples,) or (n_realizations, n_samples)"""
+        w = _standard_normal(self.generators, _shape(n_samples, self.n_realizations, None))
+        self.samples += n_samples
+        if self.model == 'white':
+            return self.scale * w
+        if self.model == 'band_limited':
+            x, self.zi = signal.sosfilt(self.sos, w, axis=-1, zi=self.zi)
+            return self.scale * x
+        if self.model == 'pink':
+            x = KELLET_DIRECT * w
+            x[..., 0] += KELLET_DELAYED * self.delayed
+            x[..., 1:] += KELLET_DELAYED * w[..., :-1]
+            self.delayed = w[..., -1].copy()
+            for k in range(len(self.poles)):
+                y, zf = signal.lfilter([self.gains[k]], [1., -self.poles[k]], w, axis=-1, zi=self.zi[k][..., None])
+                self.zi[k] = zf[..., 0]
+                x += y
+            return self.scale * x
+        x = self.last[..., None] + np.cumsum(self.scale * w, axis=-1) / self.sampling_frequency
+        self.last = x[..., -1].copy()
+        return x
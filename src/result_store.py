@@ -0,0 +1,83 @@
+# PYTHON PACKAGES
+import json
+import os
+import numpy as np
+
+
+class ResultStore:
+    """On-disk store of simulation results.
+
+    Every run is a directory under root, holding one .npy file per result array and a metadata.json file with the
+    simulation parameters. Arrays are read back as read-only memory maps, so large runs can be sliced without being
+    loaded into memory, and several processes can read the same run at once.
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def run_path(self, run_id):
+        return os.path.join(self.root, str(run_id))
+
+    def runs(self):
+        """List the ids of all the stored runs"""
+        return sorted(run_id for run_id in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.run_path(run_id), 'metadata.json')))
+
+    def create_array(self, run_id, name, shape, dtype=np.float64):
+        """Create an empty on-disk array and return it as a writable memory map, e.g. for writing the result chunks
+        of a streaming simulation. Call flush() on it when done"""
+        os.makedirs(self.run_path(run_id), exist_ok=True)
+        return np.lib.format.open_memmap(os.path.join(self.run_path(run_id), name + '.npy'), mode='w+',
+                                         dtype=dtype, shape=tuple(shape))
+
+    def save_metadata(self, run_id, metadata):
+        """Write the run metadata. It is written last, so a run is listed only after all its arrays are saved"""
+        os.makedirs(self.run_path(run_id), exist_ok=True)
+        path = os.path.join(self.run_path(run_id), 'metadata.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f, indent=2, default=_to_json)
+        os.replace(path + '.tmp', path)
+
+    def save(self, run_id, arrays, metadata=None):
+        """Save a dict of result arrays and the run metadata"""
+        for name, x in arrays.items():
+            x = np.asarray(x)
+            out = self.create_array(run_id, name, x.shape, x.dtype)
+            out[...] = x
+            out.flush()
+            del out
+        metadata = dict(metadata or {})
+        metadata['arrays'] = sorted(arrays)
+        self.save_metadata(run_id, metadata)
+
+    def load(self, run_id, name, mode='r'):
+        """Load a result array as a memory map (zero copy). Use mode=None to load it into memory"""
+        return np.load(os.path.join(self.run_path(run_id), name + '.npy'), mmap_mode=mode)
+
+    def metadata(self, run_id):
+        with open(os.path.join(self.run_path(run_id), 'metadata.json')) as f:
+            return json.load(f)
+
+    def save_xenon(self, run_id, xenon, environment, seed=None, metadata=None):
+        """Save the results of a solved Xenon (Kt, Ks, Kt_perp, Ks_perp, phase_perp and the world rotation
+        estimate) together with its parameters and the hash of the Environment it was solved in"""
+        assert xenon.solver_done
+        xenon.compute_perpendicular_values()
+        arrays = {'time_vec': xenon.time_vec, 'Kt': xenon.Kt, 'Ks': xenon.Ks, 'Kt_perp': xenon.Kt_perp,
+                  'Ks_perp': xenon.Ks_perp, 'phase_perp': xenon.phase_perp,
+                  'world_rotation': xenon.compute_world_rotation(environment)}
+        run_metadata = {'name': xenon.name, 'gamma': xenon.gamma, 't1': xenon.t1, 't2': xenon.t2, 'dt': xenon.dt,
+                        'ts': xenon.ts, 'Rse': xenon.Rse, 'seed': seed, 'environment_hash': environment.hash(times=xenon.sample_times())}
+        run_metadata.update(metadata or {})
+        self.save(run_id, arrays, run_metadata)
+
+
+def _to_json(x):
+    """JSON serialization of NumPy values in the metadata"""
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    if isinstance(x, np.random.SeedSequence):
+        return {'entropy': x.entropy, 'spawn_key': list(x.spawn_key)}
+    raise TypeError(f'Object of type {type(x).__name__} is not JSON serializable')
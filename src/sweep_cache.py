@@ -0,0 +1,100 @@
+# PYTHON PACKAGES
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+
+
+class SweepCache:
+    """Persistent on-disk memoization cache of sweep points.
+
+    Every entry is a pickle file named after the hash of all the physics inputs of the point (see key), so a point
+    computed once is returned instantly by any later sweep with the same inputs. The total size of the cache is
+    bounded by max_bytes, evicting the least recently used entries first.
+    """
+    version = 2     # bump to invalidate all the cached points after a change in the simulation itself
+
+    def __init__(self, directory, max_bytes=2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, **params):
+        """Content hash of the physics inputs of a sweep point"""
+        params = dict(params, cache_version=self.version)
+        payload = json.dumps(params, sort_keys=True, default=_to_json)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key, default=None):
+        """Returns the cached value of key (marking it as recently used), or default if it is not cached"""
+        try:
+            with open(self.path(key), 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return default
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass    # evicted by another process since it was loaded
+        return value
+
+    def put(self, key, value):
+        """Cache a value and evict the least recently used entries if the cache is over its size bound"""
+        tmp_path = self.path(key) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def entries(self):
+        """List the (key, size [bytes], last use time) of all the entries, least recently used first"""
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.directory, file_name))
+                entries.append((file_name[:-len('.pkl')], stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """Total size of the cache [bytes]"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
+
+    def invalidate(self, key=None, **params):
+        """Remove a single entry, given by its key or by its physics inputs"""
+        if key is None:
+            key = self.key(**params)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Remove all the entries"""
+        for key, _, _ in self.entries():
+            self.invalidate(key)
+
+
+def _to_json(x):
+    """JSON serialization of NumPy values in the hashed parameters"""
+    if isinstance(x, np.ndarray):
+        return x.tolist()
+    if isinstance(x, np.generic):
+        return x.item()
+    raise TypeError(f'Object of type {type(x).__name__} is not JSON serializable')
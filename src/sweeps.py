@@ -0,0 +1,70 @@
+# PYTHON PACKAGES
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+import numpy as np
+
+# MY PACKAGES
+import instrumentation
+
+
+def point_seeds(seed, point_values):
+    """Returns independent and reproducible RNG seeds (numpy SeedSequence) for every point of a sweep.
+    The seeds depend only on the sweep seed and the value of the swept parameter at the point, so a point gets the
+    same noise no matter which worker process computes it, or which other points are in the sweep.
+    With seed=None the seeds are spawned from fresh entropy drawn once here, in the parent process, so every point of
+    an unseeded sweep gets its own noise, also in worker processes forked with copies of the same global random state."""
+    if seed is None:
+        return np.random.SeedSequence().spawn(len(point_values))
+    return [np.random.SeedSequence(seed, spawn_key=tuple(np.array([value], dtype=np.float64).view(np.uint32).tolist()))
+            for value in point_values]
+
+
+def progress_bar(iterable, total=None, disable=False):
+    """A tqdm progress bar over iterable. tqdm is imported only when a bar is shown, so the worker processes and
+    the runs without progress bars do not import it"""
+    if disable:
+        return iterable
+    from tqdm.autonotebook import tqdm
+    return tqdm(iterable, total=total)
+
+
+def _timed_point(point_function, point):
+    """point_function(**point) and its wall time [s]"""
+    start = time.perf_counter()
+    result = point_function(**point)
+    return result, time.perf_counter() - start
+
+
+def run_sweep(point_function, points, workers=1, progress=True):
+    """Evaluate point_function(**point) for every point (a dict of keyword arguments) of a sweep.
+    With instrumentation enabled the wall time of every point is recorded under the point_function name.
+
+    :param point_function: a module level (picklable) function computing a single sweep point
+    :param points: list of keyword argument dicts, one for every sweep point
+    :param workers: number of worker processes. With workers=1 the points are computed serially in this process
+    :param progress: show a progress bar
+    :return: list of the point_function results, in the order of points
+    """
+    profiler = instrumentation.profiler
+    if workers == 1 and not profiler.enabled:
+        return [point_function(**point) for point in progress_bar(points, disable=not progress)]
+
+    results = [None] * len(points)
+    if workers == 1:
+        for i, point in enumerate(progress_bar(points, disable=not progress)):
+            results[i], wall_time = _timed_point(point_function, point)
+            profiler.record_point(point_function.__name__, i, wall_time)
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if profiler.enabled:
+            futures = {executor.submit(_timed_point, point_function, point): i for i, point in enumerate(points)}
+        else:
+            futures = {executor.submit(point_function, **point): i for i, point in enumerate(points)}
+        for future in progress_bar(as_completed(futures), total=len(futures), disable=not progress):
+            if profiler.enabled:
+                results[futures[future]], wall_time = future.result()
+                profiler.record_point(point_function.__name__, futures[future], wall_time)
+            else:
+                results[futures[future]] = future.result()
+    return results
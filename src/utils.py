@@ -1,5 +1,5 @@
 # PYTHON PACKAGES
-import matplotlib.pyplot as plt
+from functools import lru_cache
 import numpy as np
 import scipy.signal as signal
 
@@ -39,58 +39,87 @@ def l2(x):
     return np.sqrt(np.sum(np.power(x, 2)))
 
 
+@lru_cache(maxsize=256)
+def _butter_low_pass_sos_design(order, cutoff_hz, sampling_frequency_hz):
+    return signal.butter(order, cutoff_hz / (sampling_frequency_hz / 2), btype='low', analog=False, output='sos')
+
+
+def butter_low_pass_sos(order, cutoff_hz, sampling_frequency_hz):
+    """Returns the second order sections of a Butterworth low pass filter. Designs are cached by
+    (order, cutoff_hz, sampling_frequency_hz), so a filter is designed only once"""
+    return _butter_low_pass_sos_design(order, cutoff_hz, sampling_frequency_hz).copy()
+
+
 def butter_low_pass_filter(x, order, cutoff_hz, sampling_frequency_hz, plot_filter=False):
-    """Returns the filtered signal using a Butterworth low pass filter"""
-    b, a = signal.butter(order, cutoff_hz / (sampling_frequency_hz / 2), btype='low', analog=False)
-    filtered_x = signal.filtfilt(b, a, x)
+    """Returns the filtered signal using a (zero phase) Butterworth low pass filter in second order sections"""
+    sos = butter_low_pass_sos(order, cutoff_hz, sampling_frequency_hz)
+    filtered_x = signal.sosfiltfilt(sos, x)
     if plot_filter:
-        # plot the filter frequency response
-        w, h = signal.freqz(b, a, fs=sampling_frequency_hz)
-        plt.semilogx(w, 20 * np.log10(abs(h)))
-        plt.title('Butterworth filter frequency response')
-        plt.xlabel('Frequency [rad / sec]')
-        plt.ylabel('Amplitude [dB]')
-        plt.grid(which='both', axis='both')
-        plt.axvline(cutoff_hz, color='green') # cutoff frequency
-        plt.show()
+        import visualization
+        visualization.plot_filter_response(sos, cutoff_hz, sampling_frequency_hz)
     return filtered_x
 
 
+def sos_to_state_space(sos):
+    """State space (A, B, C, D) of a filter in second order sections, built by cascading the state spaces of the
+    individual sections (which stays well conditioned where the single transfer function does not). Every section
+    is in the transposed direct form II of scipy.signal.sosfilt, so the state is the flattened sosfilt zi"""
+    A, B, C, D = np.zeros((0, 0)), np.zeros((0, 1)), np.zeros((1, 0)), np.ones((1, 1))
+    for b0, b1, b2, a0, a1, a2 in np.atleast_2d(sos) / np.atleast_2d(sos)[:, 3:4]:
+        a_k = np.array([[-a1, 1.], [-a2, 0.]])
+        b_k = np.array([[b1 - a1 * b0], [b2 - a2 * b0]])
+        c_k = np.array([[1., 0.]])
+        d_k = np.array([[b0]])
+        n, m = A.shape[0], a_k.shape[0]
+        A = np.block([[A, np.zeros((n, m))], [b_k @ C, a_k]])
+        B = np.vstack([B, b_k @ D])
+        C = np.hstack([d_k @ C, c_k])
+        D = d_k @ D
+    return A, B, C, D
+
+
+def state_space_block_operators(A, B, C, D, n):
+    """Matrices that run the state space filter (A, B, C, D) over a block of n input samples u at once:
+        y = O @ x0 + T @ u,     x_n = An @ x0 + G @ u
+    with x0 the state before the block and x_n the state after it. Returns (O, T, An, G)"""
+    powers = [np.eye(A.shape[0])]
+    for _ in range(n):
+        powers.append(A @ powers[-1])
+    O = np.stack([C[0] @ powers[k] for k in range(n)])                              # (n, n_state)
+    h = np.array([D[0, 0]] + [(C @ powers[k] @ B)[0, 0] for k in range(n - 1)])     # impulse response
+    T = np.zeros((n, n))
+    for k in range(n):
+        T[k, :k + 1] = h[k::-1]
+    G = np.hstack([powers[n - 1 - j] @ B for j in range(n)])                        # (n_state, n)
+    return O, T, powers[n], G
+
+
 def psd_compare(signals_list, sampling_frequency_hz, noise_amplitude=None, names=None, logx=False):
-    """ Plot the Power Spectral Density (PSD) of all signals in the signals list
-        in units of \sqrt(power) / \sqrt(Hz)
-    """
-    frequencies = []
-    psd = []
-    for x in signals_list:
-        f, Pxx = signal.welch(x, fs=sampling_frequency_hz)
-        frequencies.append(f)
-        psd.append(np.sqrt(Pxx))
-
-    fig = plt.figure(figsize=(20, 4))
-    ax = plt.subplot(111)
-    ax.set_title('The Power Spectral Density (PSD) plot')
-    for i in range(len(psd)):
-        if logx:
-            if names is not None and len(names) == len(psd):
-                ax.loglog(frequencies[i], psd[i], label=names[i])
-            else:
-                ax.loglog(frequencies[i], psd[i], label=str(i))
-        else:
-            if names is not None and len(names) == len(psd):
-                ax.semilogy(frequencies[i], psd[i], label=names[i])
-            else:
-                ax.semilogy(frequencies[i], psd[i], label=str(i))
-    if noise_amplitude is not None:
-        ax.hlines(noise_amplitude, frequencies[i].min(), frequencies[i].max(), label='noise amplitude')
-    ax.set_ylabel(r'PSD $\left[\sqrt{\frac{a.u.}{Hz}}\right]$')
-    ax.set_xlabel('Frequency [Hz]')
-    ax.legend()
-    ax.grid(True)
-    plt.show()
-
-
-def get_white_noise(noise_amplitude, sampling_frequency, time_vector):
-    """Get Gaussian White Noise vector in the same length as time_vector"""
+    """Plot the Power Spectral Density (PSD) of all signals in the signals list (see visualization.psd_compare)"""
+    import visualization
+    visualization.psd_compare(signals_list, sampling_frequency_hz, noise_amplitude=noise_amplitude, names=names, logx=logx)
+
+
+def get_white_noise(noise_amplitude, sampling_frequency, time_vector, rng=None):
+    """Get Gaussian White Noise vector in the same length as time_vector. The noise is drawn from the global NumPy
+    random state, unless a seed / SeedSequence / numpy.random.Generator is given in rng"""
     noise_power = np.power(noise_amplitude, 2) * sampling_frequency / 2  # noise power [power / Hz]
-    return np.random.normal(scale=np.sqrt(noise_power), size=time_vector.shape)
+    if rng is None:
+        return np.random.normal(scale=np.sqrt(noise_power), size=time_vector.shape)
+    return np.random.default_rng(rng).normal(scale=np.sqrt(noise_power), size=time_vector.shape)
+
+
+def expm_stack(A, order=10):
+    """Matrix exponential of a stack of square matrices A with shape (..., n, n), computed at once for the whole
+    stack with a truncated Taylor series and scaling and squaring"""
+    A = np.asarray(A, dtype=float)
+    norm = np.max(np.sum(np.abs(A), axis=-1)) if A.size else 0.
+    squarings = max(0, int(np.ceil(np.log2(norm / 0.25)))) if norm > 0 else 0
+    A = A / 2 ** squarings
+    identity = np.eye(A.shape[-1])
+    E = identity + A / order
+    for k in range(order - 1, 0, -1):
+        E = identity + (A @ E) / k
+    for _ in range(squarings):
+        E = E @ E
+    return E
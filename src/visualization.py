@@ -0,0 +1,218 @@
+# PYTHON PACKAGES
+import matplotlib.pyplot as plt
+import numpy as np
+import scipy.signal as signal
+
+# MY PACKAGES
+import physical_constant_units as phy
+
+
+# The plotting layer. The numeric modules (xenon, environment, utils, lab_instruments, measurements, sweeps,
+# analysis) import this module only inside their plotting branches, so solver and sweep worker processes never import
+# matplotlib.
+
+
+def plot_filter_response(sos, cutoff_hz, sampling_frequency_hz):
+    """Plot the frequency response of a filter in second order sections"""
+    w, h = signal.sosfreqz(sos, fs=sampling_frequency_hz)
+    plt.semilogx(w, 20 * np.log10(abs(h)))
+    plt.title('Butterworth filter frequency response')
+    plt.xlabel('Frequency [rad / sec]')
+    plt.ylabel('Amplitude [dB]')
+    plt.grid(which='both', axis='both')
+    plt.axvline(cutoff_hz, color='green')  # cutoff frequency
+    plt.show()
+
+
+def psd_compare(signals_list, sampling_frequency_hz, noise_amplitude=None, names=None, logx=False):
+    """ Plot the Power Spectral Density (PSD) of all signals in the signals list
+        in units of \sqrt(power) / \sqrt(Hz)
+    """
+    frequencies = []
+    psd = []
+    for x in signals_list:
+        f, Pxx = signal.welch(x, fs=sampling_frequency_hz)
+        frequencies.append(f)
+        psd.append(np.sqrt(Pxx))
+
+    fig = plt.figure(figsize=(20, 4))
+    ax = plt.subplot(111)
+    ax.set_title('The Power Spectral Density (PSD) plot')
+    for i in range(len(psd)):
+        if logx:
+            if names is not None and len(names) == len(psd):
+                ax.loglog(frequencies[i], psd[i], label=names[i])
+            else:
+                ax.loglog(frequencies[i], psd[i], label=str(i))
+        else:
+            if names is not None and len(names) == len(psd):
+                ax.semilogy(frequencies[i], psd[i], label=names[i])
+            else:
+                ax.semilogy(frequencies[i], psd[i], label=str(i))
+    if noise_amplitude is not None:
+        ax.hlines(noise_amplitude, frequencies[i].min(), frequencies[i].max(), label='noise amplitude')
+    ax.set_ylabel(r'PSD $\left[\sqrt{\frac{a.u.}{Hz}}\right]$')
+    ax.set_xlabel('Frequency [Hz]')
+    ax.legend()
+    ax.grid(True)
+    plt.show()
+
+
+def plot_xenon_results(xenon, environment, ti=0):
+    """Plot the polarizations, the perpendicular polarization and phase, and the world rotation of a solved Xenon"""
+    assert xenon.solver_done
+    xenon.compute_perpendicular_values()
+    ts = xenon.time_vec
+    # Plot the spin solution
+    plt.rcParams.update({'font.size': 12})  # increase the font size
+    plt.rcParams['axes.facecolor'] = 'white'
+    plt.rcParams["figure.facecolor"] = 'lightyellow'
+    plt.rcParams["figure.facecolor"] = 'lightyellow'
+    plt.rcParams["lines.linewidth"] = 2.5
+
+    fig = plt.figure(figsize=(20, 14))
+    ax1 = plt.subplot(3, 2, (1, 2))
+    ax1.set_title('Kx, Ky, Kz polarizations')
+    ax1.set_xlabel("time [s]")
+    ax1.set_ylabel("$K$")
+    ax1.plot(ts, xenon.Kt[:, 0], label='$K_x$', color='tab:blue')
+    ax1.plot(ts, xenon.Kt[:, 1], label='$K_y$', color='tab:orange')
+    ax1.plot(ts, xenon.Kt[:, 2], label='$K_z$', color='tab:green')
+    ax1.plot(ts, xenon.Ks[:, 0], '--', label='$K_x$ - steady state solution', color='tab:blue')
+    ax1.plot(ts, xenon.Ks[:, 1], '--', label='$K_y$ - steady state solution', color='tab:orange')
+    ax1.plot(ts, xenon.Ks[:, 2], '--', label='$K_z$ - steady state solution', color='tab:green')
+    ax1.legend()
+    ax1.grid(True)
+
+    ax2 = plt.subplot(3, 2, 3)
+    ax2.plot(ts[ts > ti], xenon.Kt_perp[ts > ti], label='$|K_{\perp}|$', color='tab:blue')
+    ax2.plot(ts[ts > ti], xenon.Ks_perp[ts > ti], '--', label='$|K_{\perp}|$ steady state solution', color='tab:blue')
+    ax2.set_xlabel("time [s]")
+    ax2.set_ylabel("$K$")
+    ax2.grid(True)
+    ax2.legend()
+    ax2.set_title('Perpendicular polarization')
+
+    ax3 = plt.subplot(3, 2, 4)
+    ax3.plot(ts[ts > ti], xenon.phase_perp[ts > ti] * phy.R2D, label='$\phi = arctan(K_y/K_x)$')
+    ax3.set_xlabel("time [s]")
+    ax3.set_ylabel("$\phi$ [degree]")
+    ax3.grid(True)
+    ax3.legend()
+    ax3.set_title('Phase difference with respect to drive')
+
+    world_rotation = xenon.compute_world_rotation(environment)
+    wr = np.broadcast_to(xenon.recorded_channel(environment, 'wr'), ts.shape)
+    ax4 = plt.subplot(3, 2, (5, 6))
+    ax4.plot(ts[ts > ti], world_rotation[ts > ti], label='$\Omega_r$ - calculated', color='tab:green')
+    ax4.plot(ts[ts > ti], wr[ts > ti], '--', label='$\Omega_r$ - true', color='tab:green')
+    ax4.set_xlabel("time [s]")
+    ax4.set_ylabel("$\omega$ [rad/s]")
+    ax4.grid(True)
+    ax4.legend(loc='upper right')
+    ax4.set_title('World rotation')
+    ax5 = ax4.twinx()
+    ax5.plot(ts[ts > ti], world_rotation[ts > ti] - wr[ts > ti],
+             label='$\Omega_r^{calc} - \Omega_r^{true}$', color='red')
+    ax5.legend(loc='lower right')
+    ax5.set_ylabel('error', color='red')
+    ax5.tick_params(axis='y', labelcolor='red')
+
+    plt.tight_layout
+    plt.show()
+
+
+def plot_bandwidth(freq_list, phase_diff, amplitude_ratio, t2, style='o', check=None):
+    """Plot the magnitude [dB] and phase [deg] of a bandwidth simulation, with time domain check points
+    check = (freq_list, phase_diff, amplitude_ratio) if given"""
+    fig = plt.figure(figsize=(12, 8))
+    ax = plt.subplot(212)
+    ax.semilogx(freq_list, phase_diff, style, label='$\Delta\phi$')
+    if check is not None:
+        ax.semilogx(check[0], check[1], 'x', markersize=10, label='time domain')
+    ax.vlines(1 / t2 / np.pi, ymin=0, ymax=90,
+              color='orange', label=r'$\frac{1}{\pi T_2}$ ')
+    ax.set_xlabel('Frequency [Hz]')
+    ax.set_ylabel('Phase [rad]')
+    ax.grid(True)
+    ax.legend()
+
+    ax1 = plt.subplot(211)
+    ax1.set_title('Single species Open-Loop bandwidth simulation')
+    ax1.semilogx(freq_list, 10 * np.log10(amplitude_ratio), style, label=r'$\frac{|\Omega_r^{Calc}|}{|\Omega_r^{True}|}$')
+    if check is not None:
+        ax1.semilogx(check[0], 10 * np.log10(check[2]), 'x', markersize=10, label='time domain')
+    ax1.vlines(1 / t2 / np.pi, ymin=np.min(10 * np.log10(amplitude_ratio)), ymax=0,
+               color='orange', label=r'$\frac{1}{\pi T_2}$')
+    ax1.hlines(-3, xmin=freq_list[0], xmax=freq_list[-1],
+               color='red', label=r'$-3 [dB]$')
+    ax1.set_ylabel('Magnitude [dB]')
+    ax1.set_xlabel('Frequency [Hz]')
+    ax1.grid(True)
+    ax1.legend()
+    plt.tight_layout
+    plt.show()
+
+
+def plot_dynamic_range(wr_amp, wr_measurements, gyromagnetic, t1, t2, Bnoise_amp=0):
+    """Plot the calculated vs the true world rotation of a dynamic range simulation"""
+    fig = plt.figure(figsize=(12, 8))
+    ax = plt.subplot()
+    ax.set_title('World rotation dynamic range simulation')
+    ax.loglog(wr_amp, wr_measurements, 'o', label='simulation')
+    ax.loglog(wr_amp, wr_amp, '--', label='perfect match')
+    ax.set_ylabel('$\Omega_r^{calc}$ [rad / s]')
+    ax.set_xlabel('$\Omega_r^{True}$ [rad / s]')
+    ax.vlines(1 / np.sqrt(t1 * t2), ymin=np.min(wr_measurements), ymax=np.max(wr_measurements),
+              color='red', label=r'$\frac{1}{\sqrt{T_1 * T_2}}$')
+    if Bnoise_amp != 0:
+        ax.vlines(np.abs(gyromagnetic * Bnoise_amp * phy.G2T), ymin=np.min(wr_measurements), ymax=np.max(wr_measurements),
+                  color='black', label=r'$\gamma |B^{noise}|$')
+    ax.grid(True)
+    ax.legend()
+    plt.tight_layout
+    plt.show()
+
+
+def plot_lia_outputs(t, x, X_lia, Y_lia, R_lia, Theta_lia):
+    """Plot a signal and the outputs of a lock-in amplifier (LIA.use)"""
+    plt.figure(figsize=(20, 4))
+    plt.plot(t, x, label='signal')
+    plt.plot(t, X_lia, label='X_lia')
+    plt.plot(t, Y_lia, label='Y_lia')
+    plt.plot(t, R_lia, label='R_lia')
+    plt.plot(t, Theta_lia, label='Theta_lia')
+    plt.legend()
+    plt.show()
+
+
+def plot_allan_deviation(taus, adev, coefficients=None, ax=None, label=None):
+    """Log-log plot of an Allan deviation curve, with the fitted noise coefficients if given"""
+    if ax is None:
+        fig = plt.figure(figsize=(12, 8))
+        ax = plt.subplot(111)
+    ax.set_title('Allan deviation')
+    ax.loglog(taus, adev, 'o-', label=label)
+    if coefficients is not None:
+        ax.loglog(taus, coefficients['angle_random_walk'] / np.sqrt(taus), '--',
+                  label=f"ARW {coefficients['angle_random_walk']:.3g}")
+        ax.axhline(coefficients['bias_instability'] * np.sqrt(2 * np.log(2) / np.pi), color='black', linestyle=':',
+                   label=f"bias instability {coefficients['bias_instability']:.3g}")
+    ax.set_xlabel(r'$\tau$ [s]')
+    ax.set_ylabel(r'$\sigma(\tau)$')
+    ax.legend()
+    ax.grid(True, which='both')
+    return ax
+
+
+def plot_psd(frequencies, pxx, ax=None, label=None):
+    """Log-log plot of the amplitude spectral density sqrt(PSD)"""
+    if ax is None:
+        fig = plt.figure(figsize=(12, 8))
+        ax = plt.subplot(111)
+    ax.set_title('The Power Spectral Density (PSD) plot')
+    ax.loglog(frequencies[1:], np.sqrt(pxx[..., 1:]).T, label=label)
+    ax.set_ylabel(r'PSD $\left[\sqrt{\frac{a.u.}{Hz}}\right]$')
+    ax.set_xlabel('Frequency [Hz]')
+    ax.grid(True, which='both')
+    return ax
@@ -1,14 +1,99 @@
 # PYTHON PACKAGES
-from scipy.integrate import odeint
-from scipy.linalg import inv
-import matplotlib.pyplot as plt
+from scipy.integrate import odeint, solve_ivp
 import numpy as np
 
 # MY PACKAGES
-import physical_constant_units as phy
+import instrumentation
 import utils
 
 
+def bloch_matrices(gamma, gamma1, gamma2, wr, B0, Bnoise, wd_x, Ad_x, wd_y, Ad_y, drive=True):
+    """Constructing a stack of Bloch matrices in one vectorized pass. The Environment channels (and the Xenon
+    parameters) may be scalars or arrays of any broadcastable shape S, and the returned stack has shape S + (3, 3)"""
+    M12 = gamma * (B0 + Bnoise) + wr
+    if drive:
+        M12 = M12 - wd_x - wd_y
+    shape = np.broadcast(gamma1, gamma2, M12, Ad_x, Ad_y).shape
+    M = np.zeros(shape + (3, 3))
+    M[..., 0, 0] = -gamma2
+    M[..., 1, 1] = -gamma2
+    M[..., 2, 2] = -gamma1
+    if drive:
+        M[..., 0, 2] = -Ad_y / 2.
+        M[..., 1, 2] = Ad_x / 2.
+        M[..., 2, 0] = Ad_y / 2.
+        M[..., 2, 1] = -Ad_x / 2.
+    M[..., 0, 1] = M12
+    M[..., 1, 0] = -M12
+    return M
+
+
+def steady_states(gamma1, gamma2, M12, Ad_x, Ad_y, Rse):
+    """Closed form steady state of dK/dt = M K + Rse for the Bloch matrix
+        M = [[-gamma2, M12, -Ad_y / 2], [-M12, -gamma2, Ad_x / 2], [Ad_y / 2, -Ad_x / 2, -gamma1]],
+    i.e. K = -inv(M) @ Rse = adj(M) @ Rse / D with D = -det(M). All arguments broadcast (Rse along its last axis)
+    and the returned stack has shape (..., 3)"""
+    a, b, w, p, q = gamma2, gamma1, M12, Ad_y / 2., Ad_x / 2.
+    Rse = np.asarray(Rse, dtype=float)
+    Rx, Ry, Rz = Rse[..., 0], Rse[..., 1], Rse[..., 2]
+    D = b * (a ** 2 + w ** 2) + a * (p ** 2 + q ** 2)
+    Kx = ((a * b + q ** 2) * Rx + (w * b + p * q) * Ry + (w * q - a * p) * Rz) / D
+    Ky = ((p * q - w * b) * Rx + (a * b + p ** 2) * Ry + (a * q + w * p) * Rz) / D
+    Kz = ((w * q + a * p) * Rx + (w * p - a * q) * Ry + (a ** 2 + w ** 2) * Rz) / D
+    return np.stack(np.broadcast_arrays(Kx, Ky, Kz), axis=-1)
+
+
+def bloch_matrix_steady_states(M, Rse):
+    """Closed form steady states of a stack of Bloch matrices M with shape (..., 3, 3)"""
+    return steady_states(-M[..., 2, 2], -M[..., 0, 0], M[..., 0, 1], 2. * M[..., 1, 2], 2. * M[..., 2, 0], Rse)
+
+
+def propagators(M, Rse, dt):
+    """Exact single step propagators of dK/dt = M K + Rse for a stack of Bloch matrices with shape (..., d, d) (d = 3
+    for a single species), i.e. the exponentials of the augmented matrices [[M, Rse], [0, 0]] over dt, with shape
+    (..., d + 1, d + 1)"""
+    d = M.shape[-1]
+    A = np.zeros(M.shape[:-2] + (d + 1, d + 1))
+    A[..., :d, :d] = M
+    A[..., :d, d] = Rse
+    return utils.expm_stack(A * dt)
+
+
+def propagator_products(P):
+    """The products P[i] @ ... @ P[0] of a stack of single step propagators P with shape (..., n, d + 1, d + 1),
+    along the step axis n, formed with a log(n) depth scan, so there is no per step Python loop"""
+    Q = np.array(P, dtype=float)
+    shift = 1
+    while shift < Q.shape[-3]:
+        Q[..., shift:, :, :] = Q[..., shift:, :, :] @ Q[..., :-shift, :, :]
+        shift *= 2
+    return Q
+
+
+def apply_propagators(Q, K):
+    """The states Q[..., i, :, :] applied to the state K with shape (..., d) for a stack of (multi step) propagators Q
+    with shape (..., n, d + 1, d + 1), shape (..., n, d)"""
+    d = Q.shape[-1] - 1
+    return (Q[..., :d, :d] @ np.asarray(K)[..., None, :, None])[..., 0] + Q[..., :d, d]
+
+
+def propagate(P, K):
+    """Apply a stack of single step propagators P with shape (..., n, d + 1, d + 1) to the state K with shape (..., d)
+    in turn, and return the states after every step, shape (..., n, d)"""
+    return apply_propagators(propagator_products(P), K)
+
+
+def sample_times(ts, t_steps, start=0, stop=None, step=1):
+    """The times [s] of every step-th solver sample in [start, stop) of a time frame ts with t_steps samples: evenly
+    spaced from 0 with the last sample at ts. ts and t_steps may be per run vectors (a longer run sets stop), then the
+    times have shape (n_runs, len(range(start, stop, step)))"""
+    ts, t_steps = np.asarray(ts, dtype=float), np.asarray(t_steps)
+    stop = int(np.max(t_steps)) if stop is None else stop
+    steps = np.arange(start, stop, step)
+    spacing = np.divide(ts, t_steps - 1, out=np.zeros(np.shape(ts)), where=t_steps > 1)
+    return np.where(steps == t_steps[..., None] - 1, ts[..., None], np.multiply.outer(spacing, steps))
+
+
 class Xenon:
     def __init__(self, gamma, t1, t2, K0=np.array([0.05, 0.03, 0.95]), ts=500, dt=1, name='129'):
 
@@ -26,20 +111,25 @@ class Xenon:
         self.ts = ts                                                # solver time frame [s]
         self.dt = dt                                                # solver time steps [s]
         self.t_steps = int(ts // dt)                                # solver number of steps
-        self.time_vec = np.linspace(0, self.ts, self.t_steps)       # time vector [s]
         self.solver_done = False                                    # boolean for state of solver
 
-        # Spin polarization
-        self.Kt = np.zeros((self.t_steps, 3))
-        self.Kt[0, :] = K0
-        self.Ks = np.zeros((self.t_steps, 3))
+        # Spin polarization, recorded at the solver steps record_start, record_start + record_every, ...
+        self.K0 = np.array(K0, dtype=float)                         # initial spin polarization
         self.Rse = np.array([0, 0, 0])
-        self.Kt_perp = None
-        self.Ks_perp = None
-        self.phase_perp = None
+        self.set_recording()
 
-        # Bloch matrix
+        # convergence monitor (None: integrate the whole time frame), and the time the solver stopped at
+        self.convergence = None
+        self.stop_time = None
+
+        # Bloch matrix (current step) and the Bloch matrices of all steps, shape (t_steps, 3, 3)
         self.M = None
+        self.M_stack = None
+
+        # exact single step propagator (cached for the Bloch matrix it was computed with) and its powers P, P^2, ...
+        self.P = None
+        self.P_M = None
+        self.P_powers = None
 
         # boolean params
         self.drive = True
@@ -47,70 +137,468 @@ class Xenon:
     def set_spin_exchange_amp(self, rse):
         """Set spin exchange pumping"""
         self.Rse = rse
+        self.P = None
+
+    def set_recording(self, every=1, start_time=0., final_only=False):
+        """Set the recording policy of the solver: the spin polarization (Kt), the steady states (Ks) and their
+        derived values are kept only at every Nth solver step from start_time on, or only at the final step. The
+        record arrays (and time_vec) are reallocated to the recorded steps, so the memory scales with the recorded
+        window instead of the whole time frame
+
+        :param every: record every Nth solver step
+        :param start_time: record only the steps at or after start_time [s]
+        :param final_only: record only the final step
+        """
+        if every < 1:
+            raise ValueError('every must be a positive number of steps')
+        if final_only:
+            start, every = self.t_steps - 1, 1
+        else:
+            start = min(self.first_step_at(start_time), self.t_steps - 1)
+        self._allocate_records(start, every)
+
+    def first_step_at(self, time):
+        """The first solver step at or after time [s] (t_steps if there is none), found from the sample spacing
+        without building the sample times"""
+        if self.t_steps < 3:
+            return int(np.searchsorted(self.sample_times(), time))
+        guess = min(max(int(np.ceil(time / (self.ts / (self.t_steps - 1)))), 1), self.t_steps - 1)
+        # the rounding of the division may miss by a step, so settle it on the neighbouring samples
+        return guess - 1 + int(np.searchsorted(self.sample_times(guess - 1, min(guess + 2, self.t_steps)), time))
+
+    def _allocate_records(self, start, every):
+        """Allocate the record arrays of the solver steps start, start + every, ..."""
+        self.record_start = start                   # first recorded solver step
+        self.record_every = every                   # solver steps between records
+        n = len(range(start, self.t_steps, every))
+        self.Kt = np.zeros((n, 3))
+        if start == 0:
+            self.Kt[0, :] = self.K0
+        self.Ks = np.zeros((n, 3))
+        self.Kt_perp = None
+        self.Ks_perp = None
+        self.phase_perp = None
+
+    def recorded_steps(self):
+        """The solver steps of the records"""
+        return np.arange(self.record_start, self.t_steps, self.record_every)
+
+    @property
+    def time_vec(self):
+        """The time vector of the records [s], built on demand for the recorded steps only"""
+        return self.sample_times(self.record_start, self.t_steps, self.record_every)
+
+    def set_convergence_monitor(self, tolerance=1e-6, rotation_tolerance=1e-6, dwell_time=None, check_time=None):
+        """Stop the 'odeint' / 'expm' solvers early, once the spin state settled on the steady state of a stationary
+        Environment. After the Environment channels stopped changing (see stationary_step) the monitor checks every
+        check_time, and stops when for dwell_time
+            |Kt - Ks| <= tolerance,
+            the world rotation estimate stayed within rotation_tolerance.
+        The records after the stop time hold the final spin state, and the stop time is kept in stop_time.
+        Call with tolerance=None to integrate the whole time frame again.
+
+        :param tolerance: tolerance of the spin state
+        :param rotation_tolerance: tolerance of the world rotation estimate [rad / s]
+        :param dwell_time: the time all the checks must pass for [s], by default T1
+        :param check_time: the time between checks [s], by default a quarter of dwell_time
+        """
+        if tolerance is None:
+            self.convergence = None
+            return
+        dwell_time = self.t1 if dwell_time is None else dwell_time
+        check_time = dwell_time / 4 if check_time is None else check_time
+        self.convergence = {'tolerance': tolerance, 'rotation_tolerance': rotation_tolerance, 'dwell_time': dwell_time,
+                            'check_steps': max(1, int(round(check_time / self.dt)))}
+
+    def stationary_step(self, environment, chunk_size=4096):
+        """The first solver step from which all the Environment channels stay constant. The channels are scanned
+        backwards from the end of the time frame, chunk by chunk"""
+        step = 0
+        for name in environment.channel_names:
+            if environment.is_constant(name):
+                continue
+            final = self.channel_samples(environment, name, self.t_steps - 1, self.t_steps)
+            for stop in range(self.t_steps, 0, -chunk_size):
+                start = max(stop - chunk_size, 0)
+                changes = np.flatnonzero(self.channel_samples(environment, name, start, stop) != final)
+                if len(changes):
+                    step = max(step, start + changes[-1] + 1)
+                    break
+        return step
+
+    def _check_convergence(self, environment, i, K, anchor):
+        """A convergence monitor check of the spin state K at step i of a stationary Environment. anchor is the
+        (step, world rotation estimate) the checks have passed since, or None. Returns True once the checks passed
+        for the dwell time, and the updated anchor"""
+        M = self.bloch_matrix_chunk(environment, i, i + 1)
+        Ks = bloch_matrix_steady_states(M if M.ndim == 2 else M[0], self.Rse)
+        B0, wd_y = [float(np.ravel(self.channel_samples(environment, name, i, i + 1))[0]) for name in ['B0', 'wd_y']]
+        wr = -np.arctan(K[1] / K[0]) * self.gamma2 - self.gamma * B0 + wd_y
+        if np.linalg.norm(K - Ks) > self.convergence['tolerance']:
+            return False, None
+        if anchor is None or abs(wr - anchor[1]) > self.convergence['rotation_tolerance']:
+            return False, (i, wr)
+        return (i - anchor[0]) * self.dt >= self.convergence['dwell_time'], anchor
+
+    def sample_times(self, start=0, stop=None, step=1):
+        """The times [s] of every step-th solver sample in [start, stop)"""
+        return sample_times(self.ts, self.t_steps, start, stop, step)
+
+    def channel_samples(self, environment, name, start=0, stop=None, step=1):
+        """The samples [start, stop) (every step-th one) of an Environment channel: a scalar for a constant channel,
+        otherwise an array. Callable channels are evaluated at the solver sample times"""
+        stop = self.t_steps if stop is None else stop
+        if environment.is_lazy(name):
+            return np.asarray(environment.channel(name, start, stop, self.sample_times(start, stop, step)), dtype=float)
+        x = np.asarray(environment.channel(name, start, stop), dtype=float)
+        return x[..., ::step] if x.ndim else x
+
+    def recorded_channel(self, environment, name):
+        """The samples of an Environment channel at the recorded steps"""
+        return self.channel_samples(environment, name, self.record_start, self.t_steps, self.record_every)
+
+    def bloch_matrix_chunk(self, environment, start, stop):
+        """Constructing the Bloch matrices of the solver steps [start, stop), shape (stop - start, 3, 3), or a single
+        (3, 3) Bloch matrix if all the Environment channels are constant"""
+        channels = [self.channel_samples(environment, name, start, stop) for name in environment.channel_names]
+        return bloch_matrices(self.gamma, self.gamma1, self.gamma2, *channels, drive=self.drive)
 
     def set_bloch_matrix(self, environment):
         """Constructing the Bloch matrix of the dynamics"""
         i = environment.i
-        M = np.array(
-            [
-              [-self.gamma2 , 0              , 0             ],
-              [0            , -self.gamma2   , 0             ],
-              [0            , 0              , -self.gamma1  ]
-              ]
-        )
-        M12 = self.gamma * (environment.B0[i] + environment.Bnoise[i]) + environment.wr[i]
-        if self.drive:
-            M[0, 2] = -environment.Ad_y[i] / 2.
-            M[1, 2] = environment.Ad_x[i] / 2.
-            M[2, 0] = environment.Ad_y[i] / 2.
-            M[2, 1] = -environment.Ad_x[i] / 2.
-            M12 = M12 - environment.wd_x[i] - environment.wd_y[i]
+        M = self.bloch_matrix_chunk(environment, i, i + 1)
+        self.M = M if M.ndim == 2 else M[0]
 
-        M[0, 1] = M12
-        M[1, 0] = -M12
-        self.M = M
+    def set_bloch_matrices(self, environment):
+        """Constructing the Bloch matrices of all the solver steps at once from the Environment channels. With a
+        constant Environment M_stack is a read only view of a single Bloch matrix"""
+        M = self.bloch_matrix_chunk(environment, 0, self.t_steps)
+        self.M_stack = np.broadcast_to(M, (self.t_steps, 3, 3))
 
     def solve_steady_state(self, i):
-        self.Ks[i, :] = -inv(self.M) @ self.Rse
+        self.Ks[i, :] = bloch_matrix_steady_states(self.M, self.Rse)
+
+    def solve_steady_states(self, environment):
+        """Solving the steady states (and their perpendicular magnitude) of all the recorded steps in closed form,
+        vectorized over the Environment arrays. Constant channels are reduced to scalars first, so with a constant
+        Environment a single steady state is computed"""
+        wr, B0, Bnoise, wd_x, Ad_x, wd_y, Ad_y = [self.recorded_channel(environment, name)
+                                                  for name in ['wr', 'B0', 'Bnoise', 'wd_x', 'Ad_x', 'wd_y', 'Ad_y']]
+        M12 = self.gamma * (B0 + Bnoise) + wr
+        if self.drive:
+            M12 = M12 - wd_x - wd_y
+        else:
+            Ad_x, Ad_y = 0., 0.
+        Ks = steady_states(self.gamma1, self.gamma2, M12, Ad_x, Ad_y, self.Rse)
+        self.Ks[:, :] = Ks
+        self.Ks_perp = np.broadcast_to(np.sqrt(Ks[..., 0] ** 2 + Ks[..., 1] ** 2), (len(self.Ks),)).copy()
 
     def init_with_steady_state(self):
         assert self.M is not None
-        self.solve_steady_state(0)
-        self.Kt[0, :] = self.Ks[0, :]
+        self.K0 = bloch_matrix_steady_states(self.M, self.Rse)
+        if self.record_start == 0:
+            self.Ks[0, :] = self.K0
+            self.Kt[0, :] = self.K0
 
     def bloch_equations(self, K, t):
         """Bloch dynamics model"""
         dK_dt = np.matmul(self.M, K) + self.Rse
         return dK_dt
 
+    def set_propagator(self):
+        """Constructing the exact single step propagator of dK/dt = M K + Rse, i.e. the exponential of the
+        augmented 4x4 matrix [[M, Rse], [0, 0]] over dt. The propagator is reused while M is unchanged."""
+        if self.P is not None and np.array_equal(self.M, self.P_M):
+            return
+        self.P = propagators(self.M, self.Rse, self.dt)
+        self.P_M = self.M
+        self.P_powers = None
+
+    def propagator_powers(self, n):
+        """The powers P, P^2, ..., P^n of the single step propagator (see set_propagator), shape (n, 4, 4). They are
+        kept along with the propagator, so the steps of a constant Environment cost a single matrix product per step"""
+        if self.P_powers is None or len(self.P_powers) < n:
+            self.P_powers = propagator_products(np.broadcast_to(self.P, (n, 4, 4)))
+        return self.P_powers[:n]
+
     def update_solver_time_frame(self, ts, dt):
         """Updating the solver parameters"""
         # solver parameters
         self.ts = ts                                            # solver time frame [s]
         self.dt = dt                                            # solver time steps [s]
         self.t_steps = int(ts // dt)                            # solver number of steps
-        self.time_vec = np.linspace(0, self.ts, self.t_steps)   # time vector [s]
+        self.P = None
+        self.set_recording()
+
+    def interpolated_bloch_matrix(self, t, interpolation='previous'):
+        """The Bloch matrix at time t, where the Environment sample i is taken at time i * dt and held constant
+        ('previous') or linearly interpolated ('linear') between samples. Works for a scalar t or an array of times"""
+        t = np.asarray(t, dtype=float)
+        k = np.clip(np.floor(np.round(t / self.dt, 9)).astype(int), 0, self.t_steps - 1)  # robust to t = i * dt round off
+        if interpolation == 'previous':
+            return self.M_stack[k]
+        frac = np.clip(t / self.dt - k, 0., 1.)[..., None, None]
+        return self.M_stack[k] + frac * (self.M_stack[np.minimum(k + 1, self.t_steps - 1)] - self.M_stack[k])
+
+    def solve_dynamics_adaptive(self, environment, t_eval=None, interpolation='previous', method='LSODA', rtol=1.49012e-8, atol=1.49012e-8, max_segments=1000):
+        """Solving the Bloch equations over the whole time frame with an adaptive step integrator, with the
+        Environment interpolated between its samples and the solution evaluated only at the recorded steps. Long
+        quiet stretches of the Environment are covered with a few large steps. With 'previous' interpolation the
+        Bloch matrix is piecewise constant, and every stretch where it does not change is integrated on its own, so
+        the integrator never steps over a discontinuity. 'linear' interpolation is meant for a smooth Environment,
+        whose slope changes only gradually between samples: every kink of the interpolated Bloch matrix costs the
+        integrator a few small steps. An Environment that changes at more than max_segments samples with 'previous'
+        interpolation, or whose slope kinks at more than max_segments samples with 'linear' interpolation (e.g. with
+        magnetic noise), is refused, it is solved far faster by the 'expm' solver
+
+        :param environment: the Environment to solve the dynamics in, its sample i is taken at time i * dt
+        :param t_eval: output times [s], by default the recorded solver steps i * dt. They must be the steps of a
+                       recording policy (evenly spaced solver steps i * dt up to the last one), and the recording
+                       policy is reset to them
+        :param interpolation: 'previous' (piecewise constant) or 'linear' interpolation of the Environment
+        :param method, rtol, atol: scipy.integrate.solve_ivp integration parameters
+        :param max_segments: the largest number of stretches of constant ('previous') or linearly varying
+                             ('linear') Environment
+        """
+        if interpolation not in ('previous', 'linear'):
+            raise ValueError(f'Unknown interpolation: {interpolation}. Use one of: previous, linear')
+        if t_eval is not None:
+            steps = np.round(np.asarray(t_eval, dtype=float) / self.dt).astype(int)
+            every = int(steps[1] - steps[0]) if len(steps) > 1 else 1
+            if (every < 1 or not np.allclose(steps * self.dt, t_eval, rtol=0., atol=1e-9 * self.dt)
+                    or not np.array_equal(steps, np.arange(steps[0], self.t_steps, every))):
+                raise ValueError('t_eval must be evenly spaced solver steps i * dt up to the last step, '
+                                 'use set_recording for other output times')
+            self._allocate_records(int(steps[0]), every)
+        profiler = instrumentation.profiler
+        with profiler.phase('set_bloch_matrices'):
+            self.set_bloch_matrices(environment)
+        steps = self.recorded_steps()
+        t_eval = steps * self.dt
+
+        if interpolation == 'previous':
+            # the steps at which the Bloch matrix changes, up to the last recorded step
+            changes = np.flatnonzero(np.any(self.M_stack[1:steps[-1]] != self.M_stack[:steps[-1] - 1], axis=(1, 2))) + 1
+            if len(changes) + 1 > max_segments:
+                raise ValueError(f'The Environment changes at {len(changes)} samples, more than max_segments '
+                                 f'({max_segments}). Use the expm solver, or linear interpolation for a smooth Environment')
+        else:
+            # the samples at which the slope of the Bloch matrix changes by more than a tenth of its largest change
+            slopes = np.diff(self.M_stack[:steps[-1] + 1], axis=0)
+            threshold = 0.1 * np.max(np.abs(slopes), initial=0.)
+            kinks = np.count_nonzero(np.any(np.abs(np.diff(slopes, axis=0)) > threshold, axis=(1, 2)))
+            if kinks + 1 > max_segments:
+                raise ValueError(f'The Environment slope changes at {kinks} samples, more than max_segments '
+                                 f'({max_segments}), it is not smooth. Use the expm solver')
+
+        with profiler.phase('integrate'):
+            if interpolation == 'previous':
+                Kt = np.zeros((len(steps), 3))
+                K = np.array(self.K0, dtype=float)
+                Kt[steps == 0] = K
+                bounds = np.concatenate(([0], changes, [steps[-1]]))
+                for a, b in zip(bounds[:-1], bounds[1:]):
+                    if b == a:
+                        continue
+                    M = self.M_stack[a]
+                    records = np.flatnonzero((steps > a) & (steps < b))
+                    sol = solve_ivp(lambda t, K: M @ K + self.Rse, (a * self.dt, b * self.dt), K, method=method,
+                                    t_eval=np.append(steps[records], b) * self.dt, rtol=rtol, atol=atol,
+                                    jac=lambda t, K: M)
+                    if not sol.success:
+                        raise RuntimeError(f'Adaptive solver failed: {sol.message}')
+                    profiler.count('nfev', sol.nfev)
+                    Kt[records] = sol.y[:, :-1].T
+                    K = sol.y[:, -1]
+                    Kt[steps == b] = K
+            else:
+                def bloch_equations(t, K):
+                    return self.interpolated_bloch_matrix(t, interpolation) @ K + self.Rse
+
+                def jacobian(t, K):
+                    return self.interpolated_bloch_matrix(t, interpolation)
 
-    def solve_dynamics(self, environment):
-        """Solving the Bloch equations"""
+                sol = solve_ivp(bloch_equations, (0., t_eval[-1]), self.K0, method=method, t_eval=t_eval,
+                                rtol=rtol, atol=atol, jac=jacobian)
+                if not sol.success:
+                    raise RuntimeError(f'Adaptive solver failed: {sol.message}')
+                profiler.count('nfev', sol.nfev)
+                Kt = sol.y.T
+        profiler.count('steps', steps[-1])
+
+        self.Kt = Kt
+        with profiler.phase('solve_steady_states'):
+            self.Ks = bloch_matrix_steady_states(self.M_stack[steps], self.Rse)
+        self.Ks_perp = np.sqrt(self.Ks[:, 0] ** 2 + self.Ks[:, 1] ** 2)
+        environment.set_step(self.t_steps - 1)
+        self.M = self.M_stack[self.t_steps - 1]
+        self.solver_done = True
+
+    def solve_dynamics(self, environment, solver='odeint', chunk_size=4096, **adaptive_params):
+        """Solving the Bloch equations
+
+        :param environment: the Environment to solve the dynamics in
+        :param solver: 'odeint' integrates every time step numerically, 'expm' uses the exact matrix exponential
+                       propagators of the time steps, built for a whole chunk at once (a single propagator for a
+                       constant chunk), 'adaptive'
+                       integrates the whole time frame at once (see solve_dynamics_adaptive)
+        :param chunk_size: number of time steps whose Bloch matrices are built at once. With a constant Environment
+                           a single Bloch matrix (and propagator) is used for all the steps
+        :param adaptive_params: parameters of solve_dynamics_adaptive
+
+        With a convergence monitor (set_convergence_monitor) the integration stops once the spin state settled, and
+        the stop time is kept in stop_time (None if the whole time frame was integrated).
+        """
+        if solver not in ('odeint', 'expm', 'adaptive'):
+            raise ValueError(f'Unknown solver: {solver}. Use one of: odeint, expm, adaptive')
+        if solver == 'adaptive':
+            return self.solve_dynamics_adaptive(environment, **adaptive_params)
+        if adaptive_params:
+            raise TypeError(f'The {solver} solver got unexpected keyword arguments: {", ".join(adaptive_params)}')
+        profiler = instrumentation.profiler
         ts_frame = np.linspace(0, self.dt, 2)  # single time frame for solver
-        for i in range(1, self.t_steps):
-            environment.set_step(i - 1)
-            self.set_bloch_matrix(environment=environment)
-            self.solve_steady_state(i - 1)
-            Kt_temp = self.Kt[i - 1, :]
-            Kt_temp = odeint(self.bloch_equations, Kt_temp, ts_frame)
-            self.Kt[i, :] = Kt_temp[-1, :]
+        with profiler.phase('solve_steady_states'):
+            self.solve_steady_states(environment)
+
+        # the spin state is carried along all the steps, and stored only at the recorded ones
+        K = np.array(self.K0, dtype=float)
+        record, j = self.record_start, 0    # the next recorded step and its index in Kt
+        if record == 0:
+            self.Kt[0, :] = K
+            record, j = self.record_every, 1
+        self.stop_time = None
+        last = self.t_steps - 1             # the last integrated step
+        anchor = None                       # the convergence monitor checks passed since
+        if self.convergence is not None:
+            chunk_size = min(chunk_size, self.convergence['check_steps'])
+            stationary = self.stationary_step(environment)
+        with profiler.phase('integrate'):
+            for start in range(0, self.t_steps - 1, chunk_size):
+                stop = min(start + chunk_size, self.t_steps - 1)
+                with profiler.phase('set_bloch_matrices'):
+                    M = self.bloch_matrix_chunk(environment, start, stop)
+                constant = M.ndim == 2
+                if constant:
+                    self.M = M
+                if solver == 'expm':
+                    if constant:
+                        # nothing changes along the chunk, the powers of a single propagator
+                        self.set_propagator()
+                        states = apply_propagators(self.propagator_powers(stop - start), K)
+                    else:
+                        # the propagators of all the steps of the chunk at once, the state at step i is propagated
+                        # with the environment of step i - 1
+                        states = propagate(propagators(M, self.Rse, self.dt), K)
+                        self.M = M[-1]
+                    if record <= stop:
+                        steps = np.arange(record, stop + 1, self.record_every)
+                        self.Kt[j:j + len(steps), :] = states[steps - start - 1]
+                        record, j = int(steps[-1]) + self.record_every, j + len(steps)
+                    K = states[-1]
+                    environment.set_step(stop - 1)
+                else:
+                    # the state at step i is propagated with the environment of step i - 1
+                    for i in range(start + 1, stop + 1):
+                        environment.set_step(i - 1)
+                        if not constant:
+                            self.M = M[i - 1 - start]
+                        if profiler.enabled:
+                            # count the right hand side evaluations of the integrator
+                            Kt_temp, info = odeint(self.bloch_equations, K, ts_frame, full_output=True)
+                            profiler.count('nfev', info['nfe'][-1])
+                            K = Kt_temp[-1, :]
+                        else:
+                            K = odeint(self.bloch_equations, K, ts_frame)[-1, :]
+                        if i == record:
+                            self.Kt[j, :] = K
+                            record, j = record + self.record_every, j + 1
+
+                if self.convergence is not None and stationary <= stop < self.t_steps - 1:
+                    converged, anchor = self._check_convergence(environment, stop, K, anchor)
+                    if converged:
+                        # the spin state is held from the stop time on
+                        self.Kt[j:, :] = K
+                        self.stop_time = float(self.sample_times(stop, stop + 1)[0])
+                        last = stop
+                        break
+        profiler.count('steps', last)
         environment.set_step(self.t_steps - 1)
-        self.solve_steady_state(self.t_steps - 1)
+        self.set_bloch_matrix(environment)
         self.solver_done = True
 
+    def solve_dynamics_stream(self, environment_chunks, K0=None, chunk_steps=None):
+        """Solving the Bloch equations over an Environment supplied in chunks, with memory proportional to the chunk
+        size regardless of the run length. The spin state is carried over between chunks, so the concatenated
+        results are the same as those of the 'expm' solver over the whole Environment. The Xenon Kt / Ks arrays
+        and time frame are not used.
+
+        :param environment_chunks: an iterable (e.g. a generator or Environment.chunks) of Environments, each one
+                                   with channels of the chunk length (or scalars)
+        :param K0: the initial spin polarization, by default the Xenon K0
+        :param chunk_steps: the number of steps of the chunks whose channels are all scalars (the length of the other
+                            chunks is that of their arrays)
+        :return: a generator of (Kt, Ks, phase_perp) result chunks
+        """
+        K = np.array(self.K0 if K0 is None else K0, dtype=float)
+        P_last = None   # propagator of the last sample of the previous chunk
+        for chunk in environment_chunks:
+            if any(chunk.is_lazy(name) for name in chunk.channel_names):
+                raise ValueError('The chunks must not have callable channels, evaluate them first '
+                                 '(e.g. with Environment.chunks(chunk_size, times))')
+            n = chunk.steps()
+            if n is None:
+                if chunk_steps is None:
+                    raise ValueError('The length of a chunk whose channels are all scalars is unknown, give chunk_steps')
+                n = chunk_steps
+            channels = [np.broadcast_to(np.asarray(getattr(chunk, name), dtype=float), (n,)) for name in chunk.channel_names]
+            M = bloch_matrices(self.gamma, self.gamma1, self.gamma2, *channels, drive=self.drive)
+            Ks = bloch_matrix_steady_states(M, self.Rse)
+            constant = np.array_equal(M, np.broadcast_to(M[:1], M.shape))
+            P = propagators(M[:1] if constant else M, self.Rse, self.dt)
+
+            # the first state of the chunk is propagated with the last sample of the previous chunk, only the
+            # state is carried over between chunks
+            Kt = np.empty((n, 3))
+            if P_last is not None:
+                K = P_last[:3, :3] @ K + P_last[:3, 3]
+            Kt[0, :] = K
+            Kt[1:, :] = propagate(np.broadcast_to(P, (n - 1, 4, 4)) if constant else P[:-1], K)
+            K = Kt[-1, :]
+            P_last = P[-1]
+            self.M = M[-1]
+            yield Kt, Ks, np.arctan(Kt[:, 1] / Kt[:, 0])
+
+    def frequency_response(self, frequencies):
+        """Linearized transfer function H(f) from the world rotation to the world rotation estimate, around the
+        steady state Ks0 of the Bloch matrix M (set with set_bloch_matrix, with wr = 0)
+            H(s) = C (sI - M)^-1 B,   B = E Ks0,   C = -gamma2 [-Ky0, Kx0, 0] / (Kx0^2 + Ky0^2)
+        where E = dM / d(wr) and C is the gradient of -gamma2 * phase_perp. All the frequencies are solved at once
+
+        :param frequencies: frequencies [Hz]
+        :return: complex H, one value per frequency
+        """
+        assert self.M is not None
+        Ks0 = bloch_matrix_steady_states(self.M, self.Rse)
+        E = np.array([[0., 1., 0.], [-1., 0., 0.], [0., 0., 0.]])
+        B = E @ Ks0
+        C = -self.gamma2 * np.array([-Ks0[1], Ks0[0], 0.]) / (Ks0[0] ** 2 + Ks0[1] ** 2)
+        s = 2j * np.pi * np.atleast_1d(np.asarray(frequencies, dtype=float))
+        X = np.linalg.solve(s[:, None, None] * np.eye(3) - self.M, np.broadcast_to(B[:, None], (len(s), 3, 1)))
+        return X[..., 0] @ C
+
     def compute_perpendicular_values(self):
         """Compute perpendicular polarization magnitude and phase with respect to the drive"""
         self.Kt_perp = np.sqrt(self.Kt[:, 0] ** 2 + self.Kt[:, 1] ** 2)
         self.Ks_perp = np.sqrt(self.Ks[:, 0] ** 2 + self.Ks[:, 1] ** 2)
         self.phase_perp = np.arctan(self.Kt[:, 1] / self.Kt[:, 0])
 
+    def compute_world_rotation(self, environment):
+        """Compute the world rotation estimated from the phase of the perpendicular polarization"""
+        if self.phase_perp is None:
+            self.compute_perpendicular_values()
+        return (-self.phase_perp * self.gamma2 - self.gamma * self.recorded_channel(environment, 'B0')
+                + self.recorded_channel(environment, 'wd_y'))
+
     def display_params(self):
         print('===================================================================')
         print(f'| Xenon {self.name}:')
@@ -118,70 +606,13 @@ class Xenon:
         print(f'| gyromagnetic ratio:     {self.gamma}')
         print(f'| T1:                     {self.t1}')
         print(f'| T2:                     {self.t2}')
-        print(f'| K0:                     {self.Kt[0, :]}')
+        print(f'| K0:                     {self.K0}')
         print(f'| Kt:                     {self.Kt[-1, :]}')
         print(f'| K steady:               {self.Ks[-1, :]}')
         print('===================================================================')
 
     def plot_results(self, environment, ti=0):
-        assert self.solver_done
-        self.compute_perpendicular_values()
-        ts = self.time_vec
-        # Plot the spin solution
-        plt.rcParams.update({'font.size': 12})  # increase the font size
-        plt.rcParams['axes.facecolor'] = 'white'
-        plt.rcParams["figure.facecolor"] = 'lightyellow'
-        plt.rcParams["figure.facecolor"] = 'lightyellow'
-        plt.rcParams["lines.linewidth"] = 2.5
-
-        fig = plt.figure(figsize=(20, 14))
-        ax1 = plt.subplot(3, 2, (1, 2))
-        ax1.set_title('Kx, Ky, Kz polarizations')
-        ax1.set_xlabel("time [s]")
-        ax1.set_ylabel("$K$")
-        ax1.plot(ts, self.Kt[:, 0], label='$K_x$', color='tab:blue')
-        ax1.plot(ts, self.Kt[:, 1], label='$K_y$', color='tab:orange')
-        ax1.plot(ts, self.Kt[:, 2], label='$K_z$', color='tab:green')
-        ax1.plot(ts, self.Ks[:, 0], '--', label='$K_x$ - steady state solution', color='tab:blue')
-        ax1.plot(ts, self.Ks[:, 1], '--', label='$K_y$ - steady state solution', color='tab:orange')
-        ax1.plot(ts, self.Ks[:, 2], '--', label='$K_z$ - steady state solution', color='tab:green')
-        ax1.legend()
-        ax1.grid(True)
-
-        ax2 = plt.subplot(3, 2, 3)
-        ax2.plot(ts[ts > ti], self.Kt_perp[ts > ti], label='$|K_{\perp}|$', color='tab:blue')
-        ax2.plot(ts[ts > ti], self.Ks_perp[ts > ti], '--', label='$|K_{\perp}|$ steady state solution', color='tab:blue')
-        ax2.set_xlabel("time [s]")
-        ax2.set_ylabel("$K$")
-        ax2.grid(True)
-        ax2.legend()
-        ax2.set_title('Perpendicular polarization')
-
-        ax3 = plt.subplot(3, 2, 4)
-        ax3.plot(ts[ts > ti], self.phase_perp[ts > ti] * phy.R2D, label='$\phi = arctan(K_y/K_x)$')
-        ax3.set_xlabel("time [s]")
-        ax3.set_ylabel("$\phi$ [degree]")
-        ax3.grid(True)
-        ax3.legend()
-        ax3.set_title('Phase difference with respect to drive')
-
-        world_rotation = -self.phase_perp * self.gamma2 + self.gamma * environment.B0 - environment.wd_y
-        ax4 = plt.subplot(3, 2, (5, 6))
-        ax4.plot(ts[ts > ti], world_rotation[ts > ti], label='$\Omega_r$ - calculated', color='tab:green')
-        ax4.plot(ts[ts > ti], environment.wr[ts > ti], '--', label='$\Omega_r$ - true', color='tab:green')
-        ax4.set_xlabel("time [s]")
-        ax4.set_ylabel("$\omega$ [rad/s]")
-        ax4.grid(True)
-        ax4.legend(loc='upper right')
-        ax4.set_title('World rotation')
-        ax5 = ax4.twinx()
-        ax5.plot(ts[ts > ti], world_rotation[ts > ti] - environment.wr[ts > ti],
-                 label='$\Omega_r^{calc} - \Omega_r^{true}$', color='red')
-        ax5.legend(loc='lower right')
-        ax5.set_ylabel('error', color='red')
-        ax5.tick_params(axis='y', labelcolor='red')
-
-        plt.tight_layout
-        plt.show()
+        import visualization
+        visualization.plot_xenon_results(self, environment, ti=ti)
 
 
@@ -0,0 +1,170 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import xenon as xe
+
+
+class XenonBatch:
+    """Many independent Xenon trajectories solved in lockstep.
+
+    Every run has its own gyromagnetic ratio, T1, T2, spin exchange pumping and time step, and is driven by
+    an Environment whose arrays are either stacked with shape (n_runs, t_steps) or shared with shape (t_steps,).
+    The Bloch matrices and exact matrix exponential propagators are computed for a whole chunk of time steps of
+    all runs at once, so the only per-step work left is a batched matrix-vector product.
+    """
+    def __init__(self, gamma, t1, t2, K0=np.array([0.05, 0.03, 0.95]), ts=500, dt=1, n_runs=None, name='129'):
+
+        self.name = name
+        self.n_runs = n_runs if n_runs is not None else np.broadcast(np.atleast_1d(gamma), np.atleast_1d(t1),
+                                                                     np.atleast_1d(t2), np.atleast_1d(ts),
+                                                                     np.atleast_1d(dt)).size
+        # Physical parameters
+        self.gamma = self._per_run(gamma)       # The xenon gyromagnetic ratios     [rad  s^-1 T^-1]
+
+        # Decays
+        self.t1 = self._per_run(t1)             # T1 of xenon                       [s]
+        self.t2 = self._per_run(t2)             # T2 of xenon                       [s]
+        self.gamma1 = 1. / self.t1              #                                   [s^-1]
+        self.gamma2 = 1. / self.t2              #                                   [s^-1]
+
+        # solver parameters
+        self.ts = self._per_run(ts)                                 # solver time frames [s]
+        self.dt = self._per_run(dt)                                 # solver time steps [s]
+        self.run_steps = np.array(self.ts // self.dt, dtype=int)    # solver number of steps of every run
+        self.t_steps = int(np.max(self.run_steps))                  # solver number of steps (longest run)
+        self.solver_done = False                                    # boolean for state of solver
+
+        # Spin polarization, recorded at the solver steps record_start, record_start + record_every, ...
+        self.K0 = np.broadcast_to(np.asarray(K0, dtype=float), (self.n_runs, 3)).copy()     # initial spin polarization
+        self.Rse = np.zeros((self.n_runs, 3))
+        self.set_recording()
+
+        # Bloch matrices of all runs, shape (n_runs, 3, 3)
+        self.M = None
+
+        # boolean params
+        self.drive = True
+
+    def set_recording(self, every=1, start_step=0, final_only=False):
+        """Set the recording policy of the solver (see Xenon.set_recording). The runs share the step axis, so the
+        recorded window is given in steps: every Nth step from start_step on, or only the final step t_steps - 1"""
+        if every < 1:
+            raise ValueError('every must be a positive number of steps')
+        if final_only:
+            start_step, every = self.t_steps - 1, 1
+        self.record_start = min(start_step, self.t_steps - 1)     # first recorded step
+        self.record_every = every                                   # steps between records
+        n = len(range(self.record_start, self.t_steps, every))
+        self.Kt = np.zeros((self.n_runs, n, 3))
+        if self.record_start == 0:
+            self.Kt[:, 0, :] = self.K0
+        self.Ks = np.zeros((self.n_runs, n, 3))
+        self.Kt_perp = None
+        self.Ks_perp = None
+        self.phase_perp = None
+
+    def recorded_steps(self):
+        """The solver steps of the records"""
+        return np.arange(self.record_start, self.t_steps, self.record_every)
+
+    def _per_run(self, x):
+        """Broadcast a scalar or a per-run vector into a float vector of shape (n_runs,)"""
+        return np.broadcast_to(np.asarray(x, dtype=float), (self.n_runs,)).copy()
+
+    def _at_steps(self, environment, name, start, stop):
+        """Values of an Environment channel at steps [start, stop) for all runs, shape (n_runs, stop - start).
+        Callable channels are evaluated at the sample times of every run, the same as those of a Xenon"""
+        times = xe.sample_times(self.ts, self.run_steps, start, stop) if environment.is_lazy(name) else None
+        return np.broadcast_to(environment.channel(name, start, stop, times), (self.n_runs, stop - start))
+
+    def set_spin_exchange_amp(self, rse):
+        """Set spin exchange pumping, a single (3,) vector or one vector per run (n_runs, 3)"""
+        self.Rse = np.broadcast_to(np.asarray(rse, dtype=float), (self.n_runs, 3)).copy()
+
+    def bloch_matrices(self, environment, start, stop):
+        """Constructing the Bloch matrices of all runs at steps [start, stop), shape (n_runs, stop - start, 3, 3)"""
+        channels = [self._at_steps(environment, name, start, stop) for name in
+                    ['wr', 'B0', 'Bnoise', 'wd_x', 'Ad_x', 'wd_y', 'Ad_y']]
+        return xe.bloch_matrices(self.gamma[:, None], self.gamma1[:, None], self.gamma2[:, None], *channels, drive=self.drive)
+
+    def set_bloch_matrix(self, environment):
+        """Constructing the Bloch matrices of all runs at the current environment step"""
+        self.M = self.bloch_matrices(environment, environment.i, environment.i + 1)[:, 0]
+
+    def steady_states(self, M):
+        """Closed form steady states of a stack of Bloch matrices with shape (n_runs, steps, 3, 3)"""
+        return xe.bloch_matrix_steady_states(M, self.Rse[:, None, :])
+
+    def solve_steady_state(self, i):
+        self.Ks[:, i, :] = self.steady_states(self.M[:, None])[:, 0]
+
+    def init_with_steady_state(self):
+        assert self.M is not None
+        self.K0 = self.steady_states(self.M[:, None])[:, 0]
+        if self.record_start == 0:
+            self.Ks[:, 0, :] = self.K0
+            self.Kt[:, 0, :] = self.K0
+
+    def propagators(self, M):
+        """Exact single step propagators of a stack of Bloch matrices with shape (n_runs, steps, 3, 3) (see
+        xenon.propagators). If the Bloch matrices did not change along the steps a single propagator per run is
+        computed."""
+        if np.array_equal(M, np.broadcast_to(M[:, :1], M.shape)):
+            M = M[:, :1]
+        return xe.propagators(M, self.Rse[:, None, :], self.dt[:, None, None, None])
+
+    def solve_dynamics(self, environment, chunk_size=1024):
+        """Solving the Bloch equations of all runs in lockstep
+
+        :param environment: Environment with channels of shape (n_runs, t_steps) or (t_steps,)
+        :param chunk_size: number of time steps whose Bloch matrices and propagators are computed at once
+        """
+        K = self.K0.copy()
+        steps = self.recorded_steps()
+        for start in range(0, self.t_steps, chunk_size):
+            stop = min(start + chunk_size, self.t_steps)
+            M = self.bloch_matrices(environment, start, stop)
+            # steady states of the recorded steps of the chunk only
+            records = np.flatnonzero((steps >= start) & (steps < stop))
+            if len(records):
+                self.Ks[:, records, :] = self.steady_states(M[:, steps[records] - start])
+            if start == 0 and self.record_start == 0:
+                self.Kt[:, 0, :] = K
+            P = self.propagators(M)
+            # the state at step i is propagated with the environment of step i - 1, all the steps of the chunk at once
+            n = min(stop, self.t_steps - 1) - start
+            if n > 0:
+                states = xe.propagate(np.broadcast_to(P, (self.n_runs, n, 4, 4)) if P.shape[1] == 1 else P[:, :n], K)
+                recorded = steps[(steps > start) & (steps <= start + n)]
+                self.Kt[:, (recorded - self.record_start) // self.record_every, :] = states[:, recorded - start - 1]
+                K = states[:, -1]
+        environment.set_step(self.t_steps - 1)
+        self.M = M[:, -1]
+        self.solver_done = True
+
+    def compute_perpendicular_values(self):
+        """Compute perpendicular polarization magnitude and phase with respect to the drive"""
+        self.Kt_perp = np.sqrt(self.Kt[..., 0] ** 2 + self.Kt[..., 1] ** 2)
+        self.Ks_perp = np.sqrt(self.Ks[..., 0] ** 2 + self.Ks[..., 1] ** 2)
+        self.phase_perp = np.arctan(self.Kt[..., 1] / self.Kt[..., 0])
+
+    def compute_world_rotation(self, environment):
+        """Compute the world rotation of all runs estimated from the phase of the perpendicular polarization at the
+        recorded steps, shape (n_runs, recorded steps)"""
+        if self.phase_perp is None:
+            self.compute_perpendicular_values()
+        B0 = self._at_steps(environment, 'B0', self.record_start, self.t_steps)[:, ::self.record_every]
+        wd_y = self._at_steps(environment, 'wd_y', self.record_start, self.t_steps)[:, ::self.record_every]
+        return -self.phase_perp * self.gamma2[:, None] - self.gamma[:, None] * B0 + wd_y
+
+    def display_params(self):
+        print('===================================================================')
+        print(f'| Xenon {self.name} batch of {self.n_runs} runs:')
+        print(f'| ----------')
+        print(f'| gyromagnetic ratio:     {self.gamma}')
+        print(f'| T1:                     {self.t1}')
+        print(f'| T2:                     {self.t2}')
+        print(f'| dt:                     {self.dt}')
+        print(f'| steps:                  {self.run_steps}')
+        print('===================================================================')
@@ -0,0 +1,37 @@
+# PYTHON PACKAGES
+import os
+import sys
+import numpy as np
+import pytest
+
+# the modules live flat in src/ and import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# MY PACKAGES
+import physical_constant_units as phy
+import environment as env
+import xenon as xe
+import utils
+
+
+T1, T2 = 30., 8.
+
+
+def single_species(steps, dt=0.1, wr=None, seed=0, gamma=phy.G129):
+    """A noisy Environment (world rotation step and filtered magnetic noise) and a Xenon in its steady state"""
+    ts = np.arange(steps) * dt
+    my_env = env.Environment()
+    my_env.set_state(wr=0.01 * utils.sigmoid(ts, 1, 5) if wr is None else wr, B0=1e-6 * phy.G2T,
+                     Bnoise=utils.butter_low_pass_filter(utils.get_white_noise(5e-7 * phy.G2T, 1 / dt, ts, rng=seed), 2, 1, 1 / dt),
+                     Ad_y=2 * np.sqrt(1 / T1 / T2), wd_y=gamma * 1e-6 * phy.G2T, Ad_x=0., wd_x=0.)
+    my_Xe = xe.Xenon(gamma=gamma, t1=T1, t2=T2, K0=np.array([0.0259, 0.02, 0.3]), ts=steps * dt + dt / 2, dt=dt)
+    my_Xe.set_spin_exchange_amp(np.array([0, 0, 0.1]) * T1)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+    return my_Xe, my_env
+
+
+@pytest.fixture
+def noisy_run():
+    return single_species(500)
@@ -0,0 +1,31 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import analysis
+
+
+def _allan_deviation_direct(x, m):
+    """Overlapping Allan deviation straight from the averages of x over m samples"""
+    averages = np.convolve(x, np.ones(m) / m, mode='valid')
+    return np.sqrt(np.mean((averages[m:] - averages[:-m]) ** 2) / 2)
+
+
+def test_allan_deviation_of_white_noise():
+    sigma, fs = 0.5, 10.
+    x = sigma * np.random.default_rng(0).normal(size=2 ** 18)
+    taus, adev = analysis.allan_deviation(x, fs)
+    m = taus * fs
+    short = m <= 256    # enough averages for a few percent accuracy
+    np.testing.assert_allclose(adev[short], sigma / np.sqrt(m[short]), rtol=0.05)
+    slope = np.polyfit(np.log(taus[short]), np.log(adev[short]), 1)[0]
+    assert abs(slope + 0.5) < 0.02
+    assert abs(analysis.angle_random_walk(taus, adev) - sigma / np.sqrt(fs)) < 0.05 * sigma / np.sqrt(fs)
+
+
+def test_allan_deviation_chunks():
+    x = 0.3 + np.random.default_rng(1).normal(size=5000)
+    taus, adev = analysis.allan_deviation(x, 1.)
+    for chunk_size in [1, 7, 1000]:
+        np.testing.assert_allclose(analysis.allan_deviation(x, 1., chunk_size=chunk_size)[1], adev, rtol=1e-9)
+    np.testing.assert_allclose(adev, [_allan_deviation_direct(x, int(m)) for m in taus], rtol=1e-9)
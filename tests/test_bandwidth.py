@@ -0,0 +1,48 @@
+# PYTHON PACKAGES
+import numpy as np
+import pytest
+
+# MY PACKAGES
+import physical_constant_units as phy
+import measurements
+from conftest import T1, T2
+
+
+def test_frequency_response_tracks_slow_rotations(noisy_run):
+    my_Xe, my_env = noisy_run
+    my_env.wr, my_env.Bnoise = 0., 0.
+    my_Xe.set_bloch_matrix(my_env)
+    np.testing.assert_allclose(my_Xe.frequency_response([1e-7]), [1.], rtol=1e-4)
+    assert np.all(np.diff(np.abs(my_Xe.frequency_response(np.logspace(-3, 1, 50)))) < 0)
+
+
+def test_linear_bandwidth_matches_the_time_domain():
+    freq_list = np.array([0.005, 0.02, 0.05, 0.2])
+    _, phase_diff, amplitude_ratio, check = measurements.single_species_Open_Loop_bandwidth_linear(
+        phy.G129, T1, T2, freq_list=freq_list, check_freqs=freq_list, points_in_period=1000, plot_results=False,
+        get_values=True)
+    np.testing.assert_allclose(phase_diff, check[1], atol=0.5)  # [deg], the time domain lags by a fraction of a step
+    np.testing.assert_allclose(amplitude_ratio, check[2], rtol=0.01)
+
+
+def test_adaptive_bandwidth_matches_the_dense_sweep():
+    args = dict(gyromagnetic=phy.G129, t1=T1, t2=T2, points_in_period=100, plot_results=False, get_values=True)
+    bandwidth, freq_list, _, _ = measurements.single_species_Open_Loop_bandwidth_adaptive(
+        freq_range=(0.005, 0.2), coarse_points=5, rtol=0.005, **args)
+    dense = np.logspace(np.log10(0.02), np.log10(0.06), 40)
+    _, _, amplitude_ratio = measurements.single_species_Open_Loop_bandwidth_simualtion(freq_list=dense, **args)
+    # the first -3 dB crossing of the dense sweep, interpolated in log frequency
+    magnitude = 10 * np.log10(amplitude_ratio)
+    hi = np.flatnonzero(magnitude < -3)[0]
+    expected = np.exp(np.interp(-3, magnitude[[hi, hi - 1]], np.log(dense[[hi, hi - 1]])))
+    np.testing.assert_allclose(bandwidth, expected, rtol=0.005)
+    assert len(freq_list) < len(dense)
+
+
+def test_adaptive_bandwidth_needs_the_crossing_in_range():
+    with pytest.raises(ValueError, match='freq_range'):
+        measurements.single_species_Open_Loop_bandwidth_adaptive(phy.G129, T1, T2, freq_range=(1e-4, 1e-3),
+                                                                 coarse_points=2, points_in_period=100,
+                                                                 plot_results=False)
+    with pytest.raises(ValueError, match='coarse_points'):
+        measurements.single_species_Open_Loop_bandwidth_adaptive(phy.G129, T1, T2, coarse_points=1)
@@ -0,0 +1,34 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import physical_constant_units as phy
+import environment as env
+import xenon as xe
+import lab_instruments as li
+import closed_loop as cl
+from conftest import T1, T2
+
+
+def test_drive_locks_onto_the_world_rotation():
+    fs, ts, wr = 1000., 60., 0.05
+    B0 = 2 * np.pi * 16. / abs(phy.G129)    # a Larmor frequency of 16 Hz
+    t = np.arange(int(ts * fs)) / fs
+    my_env = env.Environment()
+    my_env.set_state(wr=wr * (t >= 10.), B0=B0, Bnoise=0., Ad_y=2 * np.sqrt(1 / T1 / T2), wd_y=phy.G129 * B0,
+                     Ad_x=0., wd_x=0.)
+    my_Xe = xe.Xenon(gamma=phy.G129, t1=T1, t2=T2, K0=np.array([0.0259, 0.02, 0.3]), ts=ts, dt=1 / fs)
+    my_Xe.set_spin_exchange_amp(np.array([0, 0, 0.1]) * T1)
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.init_with_steady_state()
+    lia = li.LIA({'order': 2, 'cutoff_hz': 2., 'sampling_frequency_hz': fs, 'plot_filter': False})
+    pid = li.PIDController(Kp=0.002, Ki=0, Kd=0, fs_system=fs, fs_pid=100.)
+    loop = cl.ClosedLoop(my_Xe, lia, pid)
+    world_rotation = loop.run(my_env)
+
+    # the drive follows the precession, gamma * B0 + wr
+    detuning = loop.wd_y - phy.G129 * B0
+    before, settled = (loop.time_vec > 5.) & (loop.time_vec < 10.), loop.time_vec > 40.
+    assert np.max(np.abs(detuning[before])) < 5e-3
+    assert abs(np.mean(detuning[settled]) - wr) < 2e-3
+    assert abs(np.mean(world_rotation[settled]) - wr) < 2e-3
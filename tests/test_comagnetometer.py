@@ -0,0 +1,24 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import physical_constant_units as phy
+import comagnetometer as comag
+from conftest import single_species
+
+
+def test_comagnetometer_matches_independent_species():
+    xenon_a, environment_a = single_species(500, gamma=phy.G129)
+    xenon_b, environment_b = single_species(500, gamma=phy.G131)
+    my_comag = comag.Comagnetometer(xenon_a, xenon_b)
+    my_comag.solve_dynamics(environment_a, environment_b, chunk_size=128)
+
+    for xenon, gamma in [(xenon_a, phy.G129), (xenon_b, phy.G131)]:
+        alone, environment = single_species(500, gamma=gamma)
+        alone.solve_dynamics(environment, solver='expm')
+        np.testing.assert_allclose(xenon.Kt, alone.Kt, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(xenon.Ks, alone.Ks, rtol=1e-12)
+    A = [(xenon.phase_perp * xenon.gamma2 - environment.wd_y) / xenon.gamma
+         for xenon, environment in [(xenon_a, environment_a), (xenon_b, environment_b)]]
+    np.testing.assert_allclose(my_comag.world_rotation,
+                               phy.G129 * phy.G131 / (phy.G129 - phy.G131) * (A[0] - A[1]), rtol=1e-12)
@@ -0,0 +1,69 @@
+# PYTHON PACKAGES
+import numpy as np
+import pytest
+
+# MY PACKAGES
+import measurements
+from conftest import single_species
+
+
+def _step_run(steps=6000, wr=0.01):
+    """A run whose world rotation steps at 5 s and then stays constant, without magnetic noise"""
+    my_Xe, my_env = single_species(steps, wr=wr * (np.arange(steps) * 0.1 >= 5))
+    my_env.Bnoise = 0.
+    my_Xe.set_recording(every=10)
+    return my_Xe, my_env
+
+
+def test_stationary_step(noisy_run):
+    my_Xe, my_env = _step_run()
+    assert my_Xe.stationary_step(my_env, chunk_size=64) == 50
+    my_Xe, my_env = noisy_run
+    my_env.Bnoise = 0.
+    my_env.wr = 0.01
+    assert my_Xe.stationary_step(my_env) == 0
+
+
+@pytest.mark.parametrize('solver', ['expm', 'odeint'])
+def test_monitor_stops_once_settled(solver):
+    full, full_env = _step_run()
+    full.solve_dynamics(full_env, solver=solver)
+    monitored, monitored_env = _step_run()
+    monitored.set_convergence_monitor(tolerance=1e-6, rotation_tolerance=1e-6)
+    monitored.solve_dynamics(monitored_env, solver=solver)
+    # settled well before the end of the time frame, but only after the dwell time from the step
+    assert 5 + monitored.t1 <= monitored.stop_time < monitored.ts / 2
+    stopped = np.searchsorted(monitored.time_vec, monitored.stop_time)
+    np.testing.assert_array_equal(monitored.Kt[stopped:], np.broadcast_to(monitored.Kt[-1], monitored.Kt[stopped:].shape))
+    np.testing.assert_allclose(monitored.Kt[:stopped], full.Kt[:stopped], rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(monitored.Kt[-1], full.Kt[-1], atol=1e-6)
+
+
+def test_monitor_does_not_stop_a_changing_run(noisy_run):
+    full, full_env = single_species(500)
+    full.solve_dynamics(full_env, solver='expm')
+    my_Xe, my_env = noisy_run
+    my_Xe.set_convergence_monitor(tolerance=1e-3, rotation_tolerance=1e-3, dwell_time=1.)
+    my_Xe.solve_dynamics(my_env, solver='expm')
+    assert my_Xe.stop_time is None
+    np.testing.assert_allclose(my_Xe.Kt, full.Kt, rtol=1e-12, atol=1e-15)
+
+
+def test_monitor_can_be_switched_off():
+    my_Xe, my_env = _step_run()
+    my_Xe.set_convergence_monitor()
+    my_Xe.set_convergence_monitor(tolerance=None)
+    my_Xe.solve_dynamics(my_env, solver='expm')
+    assert my_Xe.convergence is None and my_Xe.stop_time is None
+
+
+def test_dynamic_range_stop_times():
+    args = dict(gyromagnetic=1., t1=30., t2=8., wr_amp=np.array([0.01, 0.05]), dt=0.5, t_final=2000, plot_results=False,
+                get_values=True)
+    _, full = measurements.single_species_Open_Loop_dynamic_range_simulation(**args)
+    _, converged, stop_times = measurements.single_species_Open_Loop_dynamic_range_simulation(
+        **args, convergence=dict(tolerance=1e-7, rotation_tolerance=1e-7))
+    assert np.all(stop_times < args['t_final'])
+    np.testing.assert_allclose(converged, full, rtol=1e-4)
+    with pytest.raises(ValueError, match='batched'):
+        measurements.single_species_Open_Loop_dynamic_range_simulation(**args, batched=True, convergence={})
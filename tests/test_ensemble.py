@@ -0,0 +1,38 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import physical_constant_units as phy
+import ensemble
+from conftest import T1, T2
+
+
+def test_running_stats_match_numpy():
+    x = np.random.default_rng(0).normal(3., 2., size=(1000, 4, 2))
+    stats = ensemble.RunningStats((4, 2))
+    for batch in np.split(x[:600], [1, 7, 250]):
+        stats.update(batch)
+    other = ensemble.RunningStats((4, 2))
+    other.update(x[600:])
+    stats.merge(other)
+    stats.merge(ensemble.RunningStats((4, 2)))     # an empty stream changes nothing
+    assert stats.count == 1000
+    np.testing.assert_allclose(stats.mean, np.mean(x, axis=0), rtol=1e-12)
+    np.testing.assert_allclose(stats.std, np.std(x, axis=0, ddof=1), rtol=1e-12)
+
+
+def _ensemble(workers, seed):
+    return ensemble.run_ensemble(phy.G129, T1, T2, 0.01, Bnoise_amp=1e-8, t_final=100, n_members=8, batch_size=2,
+                                 workers=workers, seed=seed, progress=False)
+
+
+def test_unseeded_members_are_independent():
+    assert len(np.unique(_ensemble(workers=4, seed=None).final_errors)) == 8
+    assert len(np.unique(_ensemble(workers=1, seed=None).final_errors)) == 8
+
+
+def test_seeded_ensemble_is_independent_of_the_workers():
+    serial, parallel = _ensemble(workers=1, seed=5), _ensemble(workers=2, seed=5)
+    np.testing.assert_array_equal(parallel.final_errors, serial.final_errors)
+    np.testing.assert_allclose(parallel.error.mean, serial.error.mean, rtol=1e-12)
+    np.testing.assert_allclose(parallel.error.std, serial.error.std, rtol=1e-12)
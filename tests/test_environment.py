@@ -0,0 +1,15 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import environment as env
+
+
+def test_constant_channels_follow_in_place_changes():
+    my_env = env.Environment()
+    my_env.set_state(wr=np.zeros(100), B0=1., Bnoise=0., wd_x=0., Ad_x=0., wd_y=0., Ad_y=0.)
+    assert my_env.is_constant('wr') and my_env.channel('wr', 0, 100) == 0.
+    my_env.wr[60] = 1.
+    assert not my_env.is_constant('wr')
+    assert my_env.channel('wr', 0, 50) == 0.
+    np.testing.assert_array_equal(my_env.channel('wr', 50, 100), my_env.wr[50:])
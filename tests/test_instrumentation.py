@@ -0,0 +1,45 @@
+# PYTHON PACKAGES
+import json
+import numpy as np
+import pytest
+
+# MY PACKAGES
+import physical_constant_units as phy
+import instrumentation
+import measurements
+from conftest import single_species, T1, T2
+
+
+def test_solver_phases_and_counters():
+    plain, plain_env = single_species(300)
+    plain.solve_dynamics(plain_env, solver='odeint')
+    my_Xe, my_env = single_species(300)
+    with instrumentation.profiling() as profiler:
+        my_Xe.solve_dynamics(my_env, solver='odeint', chunk_size=64)
+    report = profiler.report()
+    assert {'integrate', 'set_bloch_matrices', 'solve_steady_states'} <= set(report.phases)
+    assert report.phases['set_bloch_matrices']['calls'] == 5
+    assert report.counters['steps'] == my_Xe.t_steps - 1 and report.counters['nfev'] > report.counters['steps']
+    assert report.steps_per_second > 0
+    np.testing.assert_array_equal(my_Xe.Kt, plain.Kt)     # the instrumentation does not change the results
+
+
+def test_sweep_points_and_json_lines(tmp_path):
+    path = tmp_path / 'profile.jsonl'
+    with instrumentation.profiling(json_lines=path) as profiler:
+        measurements.single_species_Open_Loop_bandwidth_simualtion(phy.G129, T1, T2, freq_list=np.array([0.01, 0.1, 1.]),
+                                                                   points_in_period=50, plot_results=False)
+    assert [point['index'] for point in profiler.points] == [0, 1, 2]
+    assert 'bandwidth_sweep' in profiler.phases
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert sum(record['type'] == 'point' for record in records) == 3
+    assert records[-1]['type'] == 'summary'
+
+
+def test_profiling_is_disabled_after_the_block():
+    with pytest.raises(RuntimeError):
+        with instrumentation.profiling():
+            assert instrumentation.profiler.enabled
+            raise RuntimeError
+    assert not instrumentation.profiler.enabled
+    assert str(instrumentation.Profiler().report()).startswith('phase')
@@ -0,0 +1,63 @@
+# PYTHON PACKAGES
+import numpy as np
+import scipy.signal as sps
+
+# MY PACKAGES
+import lab_instruments as li
+
+
+FS, FREQ, AMP, PHI = 1000., 2., 4., np.pi / 5
+
+
+def _signal(seconds=20.):
+    t = np.arange(int(seconds * FS)) / FS
+    return t, AMP * np.cos(2 * np.pi * FREQ * t + PHI)
+
+
+def _lia():
+    return li.LIA({'order': 3, 'cutoff_hz': 0.2, 'sampling_frequency_hz': FS, 'plot_filter': False})
+
+
+def _use_stream(lia, x, blocks):
+    lia.start_stream(FREQ, input_amplitude=AMP)
+    outputs, start = [], 0
+    for n in blocks:
+        outputs.append(lia.use_stream(x[start:start + n]))
+        start += n
+    return [np.concatenate(output) for output in zip(*outputs)]
+
+
+def test_stream_matches_causal_filter_over_the_whole_record():
+    t, x = _signal(2.)
+    blocks = [1, 7, 256, 257, 3, 1000, 476]     # both the block operator and the sosfilt paths
+    lia = _lia()
+    X, Y, R, Theta = _use_stream(lia, x, blocks)
+    phase = 2 * np.pi * FREQ * t
+    expected = sps.sosfilt(lia.lpf_sos, np.stack([x * np.cos(phase), x * np.cos(phase + np.pi / 2)]) * 2 / AMP, axis=-1)
+    np.testing.assert_allclose(X, expected[0], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(Y, expected[1], rtol=1e-9, atol=1e-12)
+
+
+def test_stream_settles_on_use():
+    t, x = _signal()
+    lia = _lia()
+    X_use, Y_use, R_use, Theta_use = lia.use(x, t, FREQ)
+    X, Y, R, Theta = _use_stream(_lia(), x, [100] * (len(x) // 100))
+    settled = (t > 10.) & (t < 15.)     # after the causal filter settled, away from the use() record edges
+    np.testing.assert_allclose(R[settled], R_use[settled], atol=5e-3)
+    np.testing.assert_allclose(Theta[settled], Theta_use[settled], atol=5e-3)
+    np.testing.assert_allclose(Theta[settled], PHI, atol=5e-3)
+
+
+def test_bank_matches_lia_use():
+    t, x = _signal(5.)
+    rng = np.random.default_rng(0)
+    signals = np.stack([x, 0.5 * np.cos(2 * np.pi * 3.5 * t) + 0.1 * rng.normal(size=len(t))])
+    frequencies = [FREQ, 3.5, 10.]
+    lia_params = {'order': 3, 'cutoff_hz': 0.2, 'sampling_frequency_hz': FS, 'plot_filter': False}
+    outputs = li.LIABank(lia_params, frequencies, alpha=0.3, amp=2.).use(signals, t)
+    lia = li.LIA(lia_params, alpha=0.3, amp=2.)
+    for c, signal in enumerate(signals):
+        for f, frequency in enumerate(frequencies):
+            for output, expected in zip(outputs, lia.use(signal, t, frequency)):
+                np.testing.assert_allclose(output[c, f], expected, rtol=1e-9, atol=1e-10)
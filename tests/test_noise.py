@@ -0,0 +1,63 @@
+# PYTHON PACKAGES
+import numpy as np
+import pytest
+import scipy.signal as sps
+
+# MY PACKAGES
+import noise
+
+
+FS, N, AMP, CUTOFF = 100., 2 ** 14, 3e-3, 5.
+
+
+def _asd(x):
+    """Amplitude spectral density [units / sqrt(Hz)] averaged over the realizations (rows) of x"""
+    f, pxx = sps.welch(x, fs=FS, nperseg=1024, axis=-1)
+    return f, np.sqrt(np.mean(pxx, axis=0))
+
+
+def _expected_asd(model, f):
+    if model == 'white':
+        return np.full_like(f, AMP)
+    if model == 'band_limited':
+        return AMP / (1 + (f / CUTOFF) ** 4)
+    return AMP * np.sqrt(1. / f)
+
+
+@pytest.mark.parametrize('model', ['white', 'band_limited', 'pink'])
+def test_noise_levels(model):
+    rng = np.random.default_rng(0)
+    if model == 'band_limited':
+        x = noise.band_limited(AMP, FS, N, CUTOFF, n_realizations=16, rng=rng)
+    else:
+        x = getattr(noise, model)(AMP, FS, N, n_realizations=16, rng=rng)
+    f, asd = _asd(x)
+    band = (f >= 0.5) & (f <= 3 * CUTOFF)
+    np.testing.assert_allclose(asd[band], _expected_asd(model, f[band]), rtol=0.1)
+
+
+@pytest.mark.parametrize('model', ['white', 'band_limited', 'pink'])
+def test_stream_noise_levels(model):
+    stream = noise.NoiseStream(model, AMP, FS, n_realizations=16, rng=1, cutoff_hz=CUTOFF)
+    x = np.concatenate([stream.next(n) for n in [1000, 1, 4095, N - 5096]], axis=-1)
+    assert x.shape == (16, N) and stream.samples == N
+    f, asd = _asd(x[:, 1024:])     # after the filters ramped in
+    band = (f >= 0.5) & (f <= 3 * CUTOFF)
+    expected = _expected_asd(model, f[band])
+    if model == 'band_limited':
+        # the causal digital filter, whose response is warped from the analog one towards the Nyquist frequency
+        expected = AMP * np.abs(sps.sosfreqz(stream.sos, worN=f[band], fs=FS)[1])
+    np.testing.assert_allclose(asd[band], expected, rtol=0.1)
+
+
+def test_random_walk_variance_grows_linearly():
+    x = noise.random_walk(AMP, FS, N, n_realizations=256, rng=2)
+    t = np.arange(1, N + 1) / FS
+    # the integral of white noise of one sided ASD AMP has variance AMP^2 t / 2
+    np.testing.assert_allclose(np.var(x[:, [N // 4, N - 1]], axis=0), AMP ** 2 * t[[N // 4, N - 1]] / 2, rtol=0.2)
+
+
+def test_realization_seeds_are_per_row():
+    seeds = np.random.SeedSequence(3).spawn(3)
+    batch = noise.band_limited(AMP, FS, 1000, CUTOFF, rng=seeds)
+    np.testing.assert_array_equal(batch[1], noise.band_limited(AMP, FS, 1000, CUTOFF, rng=seeds[1]))
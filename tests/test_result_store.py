@@ -0,0 +1,39 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import result_store
+from conftest import single_species
+
+
+def test_save_xenon_round_trip(tmp_path, noisy_run):
+    my_Xe, my_env = noisy_run
+    my_Xe.solve_dynamics(my_env, solver='expm')
+    store = result_store.ResultStore(tmp_path)
+    store.save_xenon('run', my_Xe, my_env, seed=np.random.SeedSequence(7), metadata={'note': 'test'})
+    Kt = store.load('run', 'Kt')
+    assert isinstance(Kt, np.memmap) and not Kt.flags.writeable
+    np.testing.assert_array_equal(Kt, my_Xe.Kt)
+    np.testing.assert_array_equal(store.load('run', 'world_rotation', mode=None), my_Xe.compute_world_rotation(my_env))
+    metadata = store.metadata('run')
+    assert metadata['note'] == 'test' and metadata['seed']['entropy'] == 7 and metadata['t2'] == my_Xe.t2
+    assert metadata['environment_hash'] == my_env.hash(times=my_Xe.sample_times())
+    assert 'phase_perp' in metadata['arrays']
+
+
+def test_streamed_run_is_listed_once_complete(tmp_path):
+    my_Xe, my_env = single_species(500)
+    store = result_store.ResultStore(tmp_path)
+    Kt = store.create_array('stream', 'Kt', (500, 3))
+    assert store.runs() == []
+    start = 0
+    for chunk in my_Xe.solve_dynamics_stream(my_env.chunks(64)):
+        Kt[start:start + len(chunk[0])] = chunk[0]
+        start += len(chunk[0])
+    Kt.flush()
+    store.save_metadata('stream', {'arrays': ['Kt']})
+    assert store.runs() == ['stream']
+
+    xenon_expm, env_expm = single_species(500)
+    xenon_expm.solve_dynamics(env_expm, solver='expm')
+    np.testing.assert_allclose(store.load('stream', 'Kt'), xenon_expm.Kt, rtol=1e-10, atol=1e-12)
@@ -0,0 +1,55 @@
+# PYTHON PACKAGES
+import os
+import numpy as np
+import pytest
+
+# MY PACKAGES
+import physical_constant_units as phy
+import measurements
+import sweep_cache
+import sweeps
+from conftest import T1, T2
+
+
+def test_key_is_stable(tmp_path):
+    cache = sweep_cache.SweepCache(tmp_path)
+    key = cache.key(freq=np.float64(0.1), steps=np.int64(100), K0=np.array([0., 1.]))
+    assert key == cache.key(K0=[0., 1.], steps=100, freq=0.1)
+    assert key != cache.key(freq=0.1, steps=101, K0=[0., 1.])
+    cache.version += 1
+    assert key != cache.key(freq=0.1, steps=100, K0=[0., 1.])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = sweep_cache.SweepCache(tmp_path)
+    cache.put('a', np.zeros(100))
+    cache.put('b', np.zeros(100))
+    entry_size = os.path.getsize(cache.path('a'))
+    os.utime(cache.path('a'), (1, 1))
+    os.utime(cache.path('b'), (2, 2))
+    cache.max_bytes = 2 * entry_size
+    assert cache.get('a') is not None     # a is now the most recently used
+    cache.put('c', np.zeros(100))
+    assert 'a' in cache and 'b' not in cache and 'c' in cache
+    assert cache.get('b', default='missing') == 'missing'
+
+
+def test_cached_sweep_points_are_not_recomputed(tmp_path, monkeypatch):
+    cache = sweep_cache.SweepCache(tmp_path)
+    freq_list = np.array([0.01, 0.1])
+
+    def sweep():
+        return measurements.single_species_Open_Loop_bandwidth_simualtion(phy.G129, T1, T2, freq_list=freq_list.copy(),
+                                                                          points_in_period=50, plot_results=False,
+                                                                          get_values=True, cache=cache)
+    first = sweep()
+    assert len(cache.entries()) == 2
+
+    def no_sweep(*args, **kwargs):
+        raise RuntimeError('a cached point was recomputed')
+    monkeypatch.setattr(sweeps, 'run_sweep', no_sweep)
+    for expected, cached in zip(first, sweep()):
+        np.testing.assert_array_equal(cached, expected)
+    freq_list[1] = 1.
+    with pytest.raises(RuntimeError, match='recomputed'):
+        sweep()
@@ -0,0 +1,23 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import physical_constant_units as phy
+import measurements
+from conftest import T1, T2
+
+
+def _dynamic_range(wr_amp, workers, seed):
+    return measurements.single_species_Open_Loop_dynamic_range_simulation(
+        phy.G129, T1, T2, np.asarray(wr_amp), Bnoise_amp=1e-8, t_final=100, plot_results=False, get_values=True,
+        workers=workers, seed=seed)[1]
+
+
+def test_unseeded_parallel_points_get_independent_noise():
+    wr = _dynamic_range([0.01] * 4, workers=2, seed=None)
+    assert len(np.unique(wr)) == 4
+
+
+def test_seeded_sweep_is_independent_of_the_workers():
+    wr_amp = np.logspace(-3, -1, 4)
+    np.testing.assert_array_equal(_dynamic_range(wr_amp, workers=2, seed=3), _dynamic_range(wr_amp, workers=1, seed=3))
@@ -0,0 +1,135 @@
+# PYTHON PACKAGES
+import numpy as np
+import pytest
+from scipy.linalg import expm
+
+# MY PACKAGES
+import xenon as xe
+import utils
+from conftest import single_species
+
+
+def test_expm_stack_matches_scipy():
+    rng = np.random.default_rng(0)
+    A = rng.normal(size=(50, 4, 4)) * np.logspace(-3, 1, 50)[:, None, None]
+    E = utils.expm_stack(A)
+    for a, e in zip(A, E):
+        np.testing.assert_allclose(e, expm(a), rtol=1e-12, atol=1e-12)
+
+
+def test_propagators_match_scipy(noisy_run):
+    my_Xe, my_env = noisy_run
+    M = my_Xe.bloch_matrix_chunk(my_env, 0, 20)
+    P = xe.propagators(M, my_Xe.Rse, my_Xe.dt)
+    for m, p in zip(M, P):
+        A = np.zeros((4, 4))
+        A[:3, :3], A[:3, 3] = m, my_Xe.Rse
+        np.testing.assert_allclose(p, expm(A * my_Xe.dt), rtol=1e-12, atol=1e-14)
+
+
+def test_propagate_matches_sequential_steps():
+    rng = np.random.default_rng(1)
+    P = utils.expm_stack(rng.normal(size=(37, 4, 4)) * 0.1 * np.array([1., 1., 1., 0.])[:, None])
+    K = rng.normal(size=3)
+    states = xe.propagate(P, K)
+    for p, state in zip(P, states):
+        K = p[:3, :3] @ K + p[:3, 3]
+        np.testing.assert_allclose(state, K, rtol=1e-12, atol=1e-14)
+
+
+def test_expm_matches_odeint():
+    xenon_odeint, env_odeint = single_species(500)
+    xenon_odeint.solve_dynamics(env_odeint, solver='odeint')
+    xenon_expm, env_expm = single_species(500)
+    xenon_expm.solve_dynamics(env_expm, solver='expm', chunk_size=128)
+    np.testing.assert_allclose(xenon_expm.Kt, xenon_odeint.Kt, atol=5e-6)  # odeint tolerance
+    np.testing.assert_allclose(xenon_expm.M, xenon_odeint.M)
+
+
+def test_expm_recording_policy():
+    full, full_env = single_species(500)
+    full.solve_dynamics(full_env, solver='expm', chunk_size=64)
+    recorded, recorded_env = single_species(500)
+    recorded.set_recording(every=7, start_time=12.3)
+    recorded.solve_dynamics(recorded_env, solver='expm', chunk_size=64)
+    np.testing.assert_allclose(recorded.Kt, full.Kt[recorded.recorded_steps()], rtol=1e-12, atol=1e-15)
+
+
+@pytest.mark.parametrize('ts, dt', [(50.05, 0.1), (17.3, 0.37), (0.15, 0.1), (2., 1.)])
+def test_recording_window_matches_the_sample_times(ts, dt):
+    my_Xe = xe.Xenon(gamma=1., t1=30., t2=8., ts=ts, dt=dt)
+    times = my_Xe.sample_times()
+    for start_time in [-1., 0., ts / 3, times[len(times) // 2], ts, 2 * ts]:
+        assert my_Xe.first_step_at(start_time) == np.searchsorted(times, start_time)
+        my_Xe.set_recording(every=3, start_time=start_time)
+        np.testing.assert_array_equal(my_Xe.time_vec, times[my_Xe.record_start::3])
+        assert len(my_Xe.Kt) == len(my_Xe.time_vec)
+
+
+def test_expm_constant_environment_matches_closed_form(noisy_run):
+    my_Xe, my_env = noisy_run
+    my_env.wr, my_env.Bnoise = 0.01, 0.
+    my_Xe.set_bloch_matrix(my_env)
+    my_Xe.K0 = np.array([0.05, 0.03, 0.95])
+    my_Xe.set_recording(every=3)
+    my_Xe.solve_dynamics(my_env, solver='expm', chunk_size=100)
+    # K(t) = Ks + exp(M t) (K0 - Ks)
+    Ks = xe.bloch_matrix_steady_states(my_Xe.M, my_Xe.Rse)
+    expected = [Ks + expm(my_Xe.M * i * my_Xe.dt) @ (my_Xe.K0 - Ks) for i in my_Xe.recorded_steps()]
+    np.testing.assert_allclose(my_Xe.Kt, expected, rtol=1e-10, atol=1e-12)
+
+
+def _step_run(steps=2000):
+    """A run whose world rotation steps twice, without magnetic noise"""
+    wr = 0.01 * (np.arange(steps) * 0.1 > 50) - 0.005 * (np.arange(steps) * 0.1 > 120)
+    my_Xe, my_env = single_species(steps, wr=wr)
+    my_env.Bnoise = 0.
+    return my_Xe, my_env
+
+
+def test_adaptive_matches_expm():
+    xenon_expm, env_expm = _step_run()
+    xenon_expm.solve_dynamics(env_expm, solver='expm')
+    xenon_adaptive, env_adaptive = _step_run()
+    xenon_adaptive.solve_dynamics(env_adaptive, solver='adaptive')
+    np.testing.assert_allclose(xenon_adaptive.Kt, xenon_expm.Kt, atol=1e-6)
+    np.testing.assert_allclose(xenon_adaptive.Ks, xenon_expm.Ks, rtol=1e-12)
+
+
+def test_adaptive_t_eval_resets_recording():
+    xenon_expm, env_expm = _step_run()
+    xenon_expm.solve_dynamics(env_expm, solver='expm')
+    my_Xe, my_env = _step_run()
+    my_Xe.solve_dynamics(my_env, solver='adaptive', t_eval=np.arange(100, 2000, 25) * my_Xe.dt)
+    assert (my_Xe.record_start, my_Xe.record_every) == (100, 25)
+    assert len(my_Xe.time_vec) == len(my_Xe.Kt) == len(my_Xe.compute_world_rotation(my_env))
+    np.testing.assert_allclose(my_Xe.Kt, xenon_expm.Kt[my_Xe.recorded_steps()], atol=1e-6)
+
+
+def test_adaptive_rejects_bad_inputs(noisy_run):
+    my_Xe, my_env = noisy_run
+    with pytest.raises(ValueError):
+        my_Xe.solve_dynamics(my_env, solver='adaptive', max_segments=100)
+    with pytest.raises(ValueError):
+        my_Xe.solve_dynamics(my_env, solver='adaptive', interpolation='linear', max_segments=100)
+    with pytest.raises(ValueError):
+        my_Xe.solve_dynamics(my_env, solver='adaptive', t_eval=np.array([1.05, 2.]))
+    with pytest.raises(TypeError):
+        my_Xe.solve_dynamics(my_env, solver='expm', rtol=1e-3)
+
+
+def test_stream_matches_expm():
+    xenon_expm, env_expm = single_species(500)
+    xenon_expm.solve_dynamics(env_expm, solver='expm')
+    my_Xe, my_env = single_species(500)
+    Kt = np.concatenate([chunk[0] for chunk in my_Xe.solve_dynamics_stream(my_env.chunks(64))])
+    np.testing.assert_allclose(Kt, xenon_expm.Kt, rtol=1e-10, atol=1e-12)
+
+
+def test_stream_needs_the_length_of_scalar_chunks(noisy_run):
+    my_Xe, my_env = noisy_run
+    my_env.wr, my_env.Bnoise = 0., 0.
+    with pytest.raises(ValueError):
+        next(my_Xe.solve_dynamics_stream([my_env]))
+    Kt, Ks, phase_perp = next(my_Xe.solve_dynamics_stream([my_env], chunk_steps=10))
+    assert Kt.shape == (10, 3)
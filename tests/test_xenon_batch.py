@@ -0,0 +1,53 @@
+# PYTHON PACKAGES
+import numpy as np
+
+# MY PACKAGES
+import physical_constant_units as phy
+import environment as env
+import xenon as xe
+import xenon_batch as xb
+from conftest import T1, T2
+
+
+def _environment():
+    """An Environment with a callable world rotation, evaluated at the sample times of every run"""
+    my_env = env.Environment()
+    my_env.set_state(wr=lambda t: 0.01 * np.sin(2 * np.pi * 0.2 * t), B0=1e-6 * phy.G2T, Bnoise=0.,
+                     Ad_y=2 * np.sqrt(1 / T1 / T2), wd_y=phy.G129 * 1e-6 * phy.G2T, Ad_x=0., wd_x=0.)
+    return my_env
+
+
+def test_batch_matches_xenon_with_callable_channels():
+    # the time frames are not multiples of dt, so the sample times are not i * dt
+    dt, ts = np.array([0.1, 0.2]), np.array([40.05, 30.1])
+    K0, Rse = np.array([0.0259, 0.02, 0.3]), np.array([0, 0, 0.1]) * T1
+    batch = xb.XenonBatch(gamma=phy.G129, t1=T1, t2=T2, K0=K0, ts=ts, dt=dt)
+    batch.set_spin_exchange_amp(Rse)
+    my_env = _environment()
+    batch.set_bloch_matrix(my_env)
+    batch.init_with_steady_state()
+    batch.solve_dynamics(my_env, chunk_size=64)
+
+    for k in range(batch.n_runs):
+        my_Xe = xe.Xenon(gamma=phy.G129, t1=T1, t2=T2, K0=K0, ts=ts[k], dt=dt[k])
+        my_Xe.set_spin_exchange_amp(Rse)
+        my_env = _environment()
+        my_Xe.set_bloch_matrix(my_env)
+        my_Xe.init_with_steady_state()
+        my_Xe.solve_dynamics(my_env, solver='expm')
+        np.testing.assert_allclose(batch.Kt[k, :my_Xe.t_steps], my_Xe.Kt, rtol=1e-10, atol=1e-12)
+
+
+def test_batch_recording_policy():
+    def solve(**recording):
+        batch = xb.XenonBatch(gamma=[phy.G129, phy.G131], t1=T1, t2=T2, ts=50., dt=0.1)
+        batch.set_spin_exchange_amp(np.array([0, 0, 0.1]) * T1)
+        my_env = _environment()
+        batch.set_bloch_matrix(my_env)
+        batch.init_with_steady_state()
+        batch.set_recording(**recording)
+        batch.solve_dynamics(my_env, chunk_size=64)
+        return batch
+    full, recorded = solve(), solve(every=7, start_step=30)
+    np.testing.assert_allclose(recorded.Kt, full.Kt[:, recorded.recorded_steps()], rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(solve(final_only=True).Kt[:, 0], full.Kt[:, -1], rtol=1e-12, atol=1e-15)